@@ -5,14 +5,45 @@ Perfect for Zapier integration!
 """
 
 from flask import Flask, request, jsonify
+from datetime import datetime
 from functools import wraps
 import secrets
+import base64
+import hashlib
 import os
 from rtd_client import RTDClient
 from google_transit_client import GoogleTransitClient
+from spatial_index import parse_bbox, parse_coordinates
+from tiles import LAYERS, TileBuilder, valid_tile, vehicles_geojson
+from arrivals import ArrivalEngine
+from event_log import (DELAY_EXCEEDED, EVENT_FEEDS, EVENT_TYPES, GEOFENCE_ENTER, GEOFENCE_EXIT,
+                       FeedEventDetector, visible_to)
+from geofence import GeofenceEngine
+from webhooks import WebhookDispatcher
+from memory_usage import setup_memory
+from metrics import ENRICH_SECONDS, ENRICHED_VEHICLES, cache_collector, setup_metrics
+from profiling import setup_profiling
+from tracing import setup_tracing, span
+from http_utils import (
+    SerializedResponse, negotiate_format, not_modified, request_etag, setup_feed_age, setup_responses,
+    stream_ndjson, with_etag
+)
 from config import GOOGLE_MAPS_API_KEY
 
 app = Flask(__name__)
+# Prometheus metrics at /metrics (registered first so request time includes compression)
+setup_metrics(app, [cache_collector(lambda: {
+    'geocode': google_client.geocode_stats if google_client else None,
+    'directions': google_client.directions_stats if google_client else None,
+})])
+# Request traces (X-Trace-Id, /debug/traces and RTD_TRACE_FILE)
+trace_buffer = setup_tracing(app, lambda: is_admin_request())
+# Request profiles (?profile=1 with an admin key, or RTD_PROFILE_SAMPLE_RATE) at /debug/profiles
+profile_store = setup_profiling(app, lambda: is_admin_request())
+# Fast JSON encoding, gzip/brotli compression and per-endpoint encode stats
+response_stats = setup_responses(app)
+# X-Feed-Age / X-Feed-Stale headers on responses built from realtime feeds
+setup_feed_age(app)
 
 # API Key Management
 # In production, store these in a database
@@ -21,7 +52,7 @@ API_KEYS = {
     #os.environ.get('RTD_API_KEY', 'demo-key-change-in-production'): {
     'h2YQRikxcs5uvYBsGNdotSYG7yVsDxlMpUqkitX6QPY': {
         'name': 'Default Key',
-        'permissions': ['read']
+        'permissions': ['read']   # Add 'admin' to allow ?profile=1 and /debug/profiles
     }
 }
 
@@ -48,9 +79,57 @@ def require_api_key(f):
     return decorated_function
 
 
+def is_admin_request():
+    """Whether the request carries an API key with the 'admin' permission"""
+    api_key = request.headers.get('X-API-Key') or request.args.get('api_key')
+    return 'admin' in API_KEYS.get(api_key, {}).get('permissions', ())
+
+
+def api_key_owner():
+    """Stable id for the caller's API key (webhooks belong to the key that made them)"""
+    api_key = request.headers.get('X-API-Key') or request.args.get('api_key') or ''
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+
 # Initialize clients
 rtd_client = RTDClient()
 google_client = GoogleTransitClient(GOOGLE_MAPS_API_KEY) if GOOGLE_MAPS_API_KEY != 'YOUR_GOOGLE_MAPS_API_KEY_HERE' else None
+tile_builder = TileBuilder(rtd_client)
+# Change events (new vehicles, routes, alerts, delays) for Zapier triggers
+event_detector = FeedEventDetector(rtd_client)
+# Enter/exit events for registered geofences, checked on every vehicle snapshot
+geofence_engine = GeofenceEngine(event_detector)
+# "Bus is N minutes away" events, checked on every trip update snapshot
+arrival_engine = ArrivalEngine(event_detector)
+# Pushes those events to registered webhooks (started with the server)
+webhook_dispatcher = WebhookDispatcher(event_detector, visible=visible_to)
+
+# Sizes of the feeds and caches at /debug/memory (tracemalloc with RTD_TRACEMALLOC)
+setup_memory(app, lambda: is_admin_request(), dict(
+    rtd_client.memory_caches(),
+    stops_cache=lambda: _stops_cache,
+    tiles=lambda: tile_builder.cache,
+    event_log=lambda: event_detector.log,
+))
+
+_dispatcher_checked = False
+
+
+@app.before_request
+def resume_webhook_deliveries():
+    """
+    On the first request, start the dispatcher if SQLite holds webhooks or queued deliveries
+
+    Runs in whichever process serves requests (gunicorn workers, the
+    reloader child), so persisted deliveries survive restarts without
+    waiting for a new POST /api/webhooks. Workers share the queue: only one
+    of them queues events, and each delivery is sent by one worker.
+    """
+    global _dispatcher_checked
+    if not _dispatcher_checked:
+        _dispatcher_checked = True
+        webhook_dispatcher.start_if_pending()
+
 
 # Cache for stops data (to avoid reloading on every request)
 _stops_cache = None
@@ -60,21 +139,35 @@ CACHE_DURATION = 3600  # Cache for 1 hour
 
 def get_stops_cache():
     """Get stops data with caching"""
-    global _stops_cache, _stops_cache_time
     import time
     
     current_time = time.time()
     
-    # Reload cache if expired or not loaded
+    # Reload cache if expired or not loaded. Concurrent requests that see an
+    # expired cache share a single reload instead of stampeding.
     if _stops_cache is None or (_stops_cache_time and current_time - _stops_cache_time > CACHE_DURATION):
-        stops = rtd_client.parse_stops()
-        if stops:
-            _stops_cache = stops
-            _stops_cache_time = current_time
+        return rtd_client.single_flight.do('stops_cache', _reload_stops_cache)
+    
+    return _stops_cache
+
+
+def _reload_stops_cache():
+    """Reload the stops cache from the static feed"""
+    global _stops_cache, _stops_cache_time
+    import time
+    
+    stops = rtd_client.parse_stops()
+    if stops:
+        _stops_cache = stops
+        _stops_cache_time = time.time()
     
     return _stops_cache
 
 
+# Vehicles further than this from every stop get no closest stop
+CLOSEST_STOP_MAX_M = 50000
+
+
 def calculate_distance(lat1, lng1, lat2, lng2):
     """
     Calculate distance between two GPS coordinates in miles
@@ -98,6 +191,9 @@ def find_closest_stop(vehicle_lat, vehicle_lng):
     """
     Find the closest stop to a vehicle
     
+    Uses the static feed's stop grid index, so only the stops in the cells
+    around the vehicle are measured rather than every stop.
+    
     Args:
         vehicle_lat: Vehicle latitude
         vehicle_lng: Vehicle longitude
@@ -105,37 +201,30 @@ def find_closest_stop(vehicle_lat, vehicle_lng):
     Returns:
         Dictionary with closest stop information or None
     """
-    stops = get_stops_cache()
-    if not stops:
+    feed = rtd_client.get_static_feed()
+    if feed is None or not feed.stops:
         return None
     
-    min_distance = float('inf')
-    closest_stop = None
-    
-    for stop in stops:
-        try:
-            stop_lat = float(stop.get('stop_lat', 0))
-            stop_lng = float(stop.get('stop_lon', 0))
-            
-            if stop_lat == 0 or stop_lng == 0:
-                continue
-            
-            distance = calculate_distance(vehicle_lat, vehicle_lng, stop_lat, stop_lng)
-            
-            if distance < min_distance:
-                min_distance = distance
-                closest_stop = {
-                    'stop_id': stop.get('stop_id'),
-                    'stop_name': stop.get('stop_name', 'Unknown Stop'),
-                    'stop_lat': stop_lat,
-                    'stop_lng': stop_lng,
-                    'distance_miles': round(distance, 3),
-                    'distance_meters': round(distance * 1609.34, 1)  # Convert to meters
-                }
-        except (ValueError, TypeError):
-            continue
+    found = feed.stop_spatial_index.nearest(vehicle_lat, vehicle_lng, max_distance_m=CLOSEST_STOP_MAX_M)
+    if found is None:
+        return None
     
-    return closest_stop
+    index, distance_meters = found
+    stop = feed.stops[index]
+    return {
+        'stop_id': stop.get('stop_id'),
+        'stop_name': stop.get('stop_name', 'Unknown Stop'),
+        'stop_lat': float(stop['stop_lat']),
+        'stop_lng': float(stop['stop_lon']),
+        'distance_miles': round(distance_meters / 1609.34, 3),
+        'distance_meters': round(distance_meters, 1)
+    }
+
+
+def feed_etag(snapshot, *extra):
+    """ETag for a response built from a realtime snapshot (and the static stops)"""
+    static_feed = rtd_client.current_static_feed()
+    return request_etag(snapshot.version, static_feed.version if static_feed else None, *extra)
 
 
 @app.route('/')
@@ -149,11 +238,36 @@ def index():
         'endpoints': {
             'GET /api/vehicles': 'Get all active vehicle positions',
             'GET /api/vehicles/<route_id>': 'Get vehicles for specific route',
+            'GET /api/vehicles.geojson': 'Get vehicle positions as GeoJSON',
+            'GET /tiles/<z>/<x>/<y>': 'Map tile of vehicles and stops (clustered at low zoom)',
             'GET /api/routes': 'Get list of all active routes',
-            'GET /api/directions': 'Get transit directions (requires Google Maps API)',
-            'GET /api/stations/nearby': 'Find nearby transit stations',
+            'GET /api/trip_updates': 'Get real-time trip updates (delays, predicted stop times)',
+            'GET /api/alerts': 'Get service alerts',
+            'GET /api/export/<vehicles|trip_updates|alerts>.ndjson': 'Bulk export, one JSON record per line (streamed)',
+            'GET /api/triggers/<event_type>': f"New events since a cursor for Zapier triggers ({', '.join(EVENT_TYPES)})",
+            'POST /api/webhooks': 'Register a webhook URL for events (with filters)',
+            'GET /api/webhooks': 'List your webhooks with delivery metrics',
+            'DELETE /api/webhooks/<id>': 'Remove a webhook',
+            'POST /api/geofences': 'Register a geofence (circle or polygon, optional routes)',
+            'GET /api/geofences': 'List your geofences',
+            'DELETE /api/geofences/<id>': 'Remove a geofence',
+            'GET /api/geofences/events': 'Poll geofence enter/exit events since a cursor',
+            'GET /api/geofences/events/stream': 'Stream geofence enter/exit events (Server-Sent Events)',
+            'POST /api/arrivals': 'Get an arrival_soon event when a bus is N minutes from a stop',
+            'GET /api/arrivals': 'List your arrival subscriptions',
+            'DELETE /api/arrivals/<id>': 'Remove an arrival subscription',
+            'GET /api/directions': 'Get transit directions (Google Maps, or planner=local for the offline planner)',
+            'POST /api/directions/batch': 'Get directions for many origin/destination pairs at once',
+            'GET /api/stations/nearby': 'Find nearby RTD stops (lat/lng or location)',
+            'GET /api/stops/search': 'Search stops by name (autocomplete)',
+            'GET /api/reachability': 'Stops reachable by transit within N minutes (isochrone)',
             'GET /api/health': 'Health check (no auth required)',
+            'GET /metrics': 'Prometheus metrics (no auth required)',
+            'GET /debug/profiles[/<id>]': 'Recent request profiles (admin key; add profile=1 to any request)',
+            'GET /debug/traces': 'Recent request traces (admin key; min_ms=, name=, errors=1)',
+            'GET /debug/memory': 'Memory held by the feeds and caches (admin key; cache=, top=)',
         },
+        'formats': 'json (default), msgpack or protobuf via format= or the Accept header on vehicle, trip update and alert endpoints',
         'zapier_webhook_url': request.host_url + 'api/vehicles',
         'example_request': request.host_url + 'api/vehicles?api_key=YOUR_API_KEY'
     })
@@ -165,10 +279,169 @@ def health():
     return jsonify({
         'status': 'healthy',
         'rtd_api': 'available',
-        'google_maps_api': 'configured' if google_client else 'not configured'
+        'google_maps_api': 'configured' if google_client else 'not configured',
+        'geocode_cache': google_client.geocode_stats.as_dict() if google_client else None,
+        'directions_cache': google_client.directions_stats.as_dict() if google_client else None,
+        'coalesced_requests': {
+            'rtd': rtd_client.single_flight.stats(),
+            'google': google_client.single_flight.stats() if google_client else None
+        },
+        'responses': response_stats.as_dict(),
+        'events': event_detector.log.stats(),
+        'webhook_queue_depth': sum(webhook_dispatcher.store.depth().values()),
+        'geofences': geofence_engine.stats(),
+        'arrival_subscriptions': arrival_engine.stats(),
+        'realtime_feeds': rtd_client.feed_status()
     })
 
 
+# Fields that can be requested with fields= on the vehicle endpoints
+VEHICLE_FIELDS = (
+    'vehicle_id', 'route_id', 'trip_id', 'latitude', 'longitude',
+    'bearing', 'speed', 'timestamp', 'closest_stop', 'distance_meters'
+)
+MAX_PAGE_SIZE = 1000
+MAX_NEAR_RADIUS = 10000
+
+
+def parse_vehicle_query():
+    """
+    Parse the projection and pagination parameters of the vehicle endpoints
+    
+    Returns:
+        (fields, limit, cursor) - fields is a tuple or None for all fields,
+        cursor is the vehicle_id to continue after or None
+    
+    Raises:
+        ValueError: With a message for the client
+    """
+    fields = None
+    if request.args.get('fields'):
+        fields = tuple(dict.fromkeys(f.strip() for f in request.args['fields'].split(',') if f.strip()))
+        unknown = [f for f in fields if f not in VEHICLE_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}. Valid fields: {', '.join(VEHICLE_FIELDS)}")
+    
+    limit = request.args.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError('limit must be an integer')
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+    
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        try:
+            cursor = base64.b64decode(cursor + '=' * (-len(cursor) % 4), altchars=b'-_', validate=True).decode('utf-8')
+        except (ValueError, UnicodeError):
+            raise ValueError('Invalid cursor')
+    
+    return fields, limit, cursor
+
+
+def parse_area_query():
+    """
+    Parse the bbox / near / radius parameters of /api/vehicles
+    
+    Returns:
+        (bbox, near, radius) - bbox and near are None when not given
+    
+    Raises:
+        ValueError: With a message for the client
+    """
+    bbox = near = None
+    if request.args.get('bbox'):
+        bbox = parse_bbox(request.args['bbox'])
+        if bbox is None:
+            raise ValueError('bbox must be "west,south,east,north" in degrees')
+    if request.args.get('near'):
+        near = parse_coordinates(request.args['near'])
+        if near is None:
+            raise ValueError('near must be "lat,lng"')
+    radius = max(1, min(request.args.get('radius', 1000, type=int), MAX_NEAR_RADIUS))
+    return bbox, near, radius
+
+
+def encode_cursor(vehicle_id):
+    """Opaque pagination cursor for the page after vehicle_id"""
+    return base64.urlsafe_b64encode(vehicle_id.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def page_vehicles(vehicles, limit, cursor):
+    """
+    Slice vehicles into a page
+    
+    Pages are ordered by vehicle_id and the cursor is the last vehicle_id
+    of the previous page, so paging stays consistent when the feed updates
+    between requests.
+    
+    Returns:
+        (page, next_cursor) - next_cursor is None on the last page
+    """
+    if limit is None and cursor is None:
+        return vehicles, None
+    
+    vehicles = sorted(vehicles, key=lambda v: v['vehicle_id'] or '')
+    if cursor is not None:
+        vehicles = [v for v in vehicles if (v['vehicle_id'] or '') > cursor]
+    if limit is None or len(vehicles) <= limit:
+        return vehicles, None
+    page = vehicles[:limit]
+    return page, encode_cursor(page[-1]['vehicle_id'] or '')
+
+
+def project_vehicles(vehicles, fields):
+    """Keep only the requested fields (None = all)"""
+    if fields is None:
+        return vehicles
+    return [{f: v.get(f) for f in fields} for v in vehicles]
+
+
+def add_closest_stops(vehicles):
+    """Add closest stop information to each vehicle (in place)"""
+    with ENRICH_SECONDS.labels('closest_stop').time(), span('closest_stops', vehicles=len(vehicles)):
+        _add_closest_stops(vehicles)
+    ENRICHED_VEHICLES.labels('closest_stop').inc(len(vehicles))
+
+
+def _add_closest_stops(vehicles):
+    for v in vehicles:
+        try:
+            closest_stop = find_closest_stop(v['latitude'], v['longitude'])
+            if closest_stop:
+                v['closest_stop'] = {
+                    'stop_id': closest_stop['stop_id'],
+                    'stop_name': closest_stop['stop_name'],
+                    'stop_latitude': closest_stop['stop_lat'],
+                    'stop_longitude': closest_stop['stop_lng'],
+                    'distance_miles': closest_stop['distance_miles'],
+                    'distance_meters': closest_stop['distance_meters']
+                }
+            else:
+                v['closest_stop'] = None
+        except (KeyError, TypeError):
+            v['closest_stop'] = None
+
+
+def cached_response(snapshot, key, builder):
+    """
+    Get a serialized response built from a realtime snapshot
+    
+    Identical requests against the same snapshot (and static feed version)
+    share one SerializedResponse, so the payload is built and encoded once
+    per feed update.
+    
+    Args:
+        snapshot: FeedSnapshot the response is built from
+        key: Tuple identifying the response (endpoint and parameters)
+        builder: Zero-argument callable returning a SerializedResponse,
+                 or None on failure (not cached)
+    """
+    static_feed = rtd_client.current_static_feed()
+    return snapshot.derived(('response',) + key + (static_feed.version if static_feed else None,), builder)
+
+
 @app.route('/api/vehicles', methods=['GET'])
 @require_api_key
 def get_vehicles():
@@ -177,25 +450,115 @@ def get_vehicles():
     
     Query Parameters:
         route (optional): Filter by route ID (e.g., ?route=A)
-        format (optional): Response format (default: json)
+        format (optional): json (default), array (a bare list for Zapier), msgpack,
+                           or protobuf (a GTFS-realtime FeedMessage with only the
+                           matching vehicles); without it the Accept header picks
+                           json, msgpack or protobuf
+        include_stops (optional): Add the closest stop to each vehicle (default: true)
+        fields (optional): Comma-separated fields to return (e.g. vehicle_id,route_id,latitude,longitude);
+                           closest stops are only computed if closest_stop is requested
+        limit (optional): Page size (max: 1000); pages are ordered by vehicle_id
+        cursor (optional): next_cursor from the previous page (also sent as X-Next-Cursor)
+        bbox (optional): Only vehicles inside "west,south,east,north"
+        near (optional): Only vehicles within radius of "lat,lng", nearest first,
+                         with distance_meters
+        radius (optional): Radius for near in meters (default: 1000, max: 10000)
+    
+    Responses carry an ETag tied to the feed version; polls with a matching
+    If-None-Match get 304 Not Modified with no body. Each distinct query is
+    serialized once per feed update.
     
     Example:
         GET /api/vehicles?api_key=YOUR_KEY
         GET /api/vehicles?api_key=YOUR_KEY&route=A
+        GET /api/vehicles?api_key=YOUR_KEY&near=39.7539,-105.0002&radius=800
+        GET /api/vehicles?api_key=YOUR_KEY&format=protobuf
     """
-    route_filter = request.args.get('route')
+    route_filter = (request.args.get('route') or '').upper() or None
+    include_stops = request.args.get('include_stops', 'true').lower() == 'true'
+    format_type = 'array' if request.args.get('format') == 'array' else 'json'
+    try:
+        output = 'json' if format_type == 'array' else negotiate_format()
+        fields, limit, cursor = parse_vehicle_query()
+        bbox, near, radius = parse_area_query()
+        check_protobuf_query(output, fields, limit, cursor)
+    except ValueError as e:
+        return jsonify({'error': 'Invalid parameters', 'message': str(e)}), 400
     
-    vehicles = rtd_client.get_vehicle_positions()
+    snapshot = rtd_client.get_snapshot('VehiclePosition.pb')
+    if snapshot is not None:
+        etag = feed_etag(snapshot, output)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        
+        def build():
+            if output == 'protobuf':
+                return build_vehicles_feed(snapshot, route_filter, bbox, near, radius)
+            return build_vehicles_response(
+                snapshot, route_filter, include_stops, format_type, fields, limit, cursor, bbox, near, radius, output
+            )
+        
+        if bbox is not None or near is not None:
+            # Map viewports rarely repeat exactly - don't fill the snapshot cache with them
+            body = build()
+        else:
+            body = cached_response(
+                snapshot, ('vehicles', route_filter, format_type, output, include_stops, fields, limit, cursor), build
+            )
+        if body is not None:
+            return body.to_response(etag)
     
+    return jsonify({
+        'error': 'Failed to fetch vehicle data',
+        'message': 'RTD API may be temporarily unavailable'
+    }), 503
+
+
+def check_protobuf_query(output, fields, limit, cursor):
+    """Reject parameters that have no meaning for GTFS-realtime output"""
+    if output == 'protobuf' and (fields is not None or limit is not None or cursor is not None):
+        raise ValueError('fields, limit and cursor are not supported with format=protobuf')
+
+
+def build_vehicles_feed(snapshot, route_filter, bbox=None, near=None, radius=None):
+    """
+    Build the format=protobuf vehicle response for one snapshot
+    
+    The body is the snapshot's FeedMessage re-serialized with only the
+    matching vehicle entities (in feed order), so GTFS-realtime consumers
+    can decode it with the standard bindings.
+    """
+    vehicle_ids = None
+    if bbox is not None or near is not None:
+        vehicles = rtd_client.find_vehicles(bbox, near, radius, snapshot=snapshot)
+        if vehicles is None:
+            return None
+        vehicle_ids = {v['vehicle_id'] for v in vehicles}
+    
+    def keep(entity):
+        if not entity.HasField('vehicle'):
+            return False
+        if route_filter and entity.vehicle.trip.route_id != route_filter:
+            return False
+        return vehicle_ids is None or entity.vehicle.vehicle.id in vehicle_ids
+    
+    return SerializedResponse(snapshot.subset(keep), format='protobuf')
+
+
+def build_vehicles_response(snapshot, route_filter, include_stops, format_type, fields=None, limit=None, cursor=None,
+                            bbox=None, near=None, radius=None, output='json'):
+    """Build and serialize the /api/vehicles response for one snapshot"""
+    if bbox is not None or near is not None:
+        vehicles = rtd_client.find_vehicles(bbox, near, radius, snapshot=snapshot)
+    else:
+        vehicles = rtd_client.get_vehicle_positions(snapshot)
     if vehicles is None:
-        return jsonify({
-            'error': 'Failed to fetch vehicle data',
-            'message': 'RTD API may be temporarily unavailable'
-        }), 503
+        return None
     
     # Filter by route if specified
     if route_filter:
-        vehicles = [v for v in vehicles if v['route_id'] == route_filter.upper()]
+        vehicles = [v for v in vehicles if v['route_id'] == route_filter]
     
     # Get route statistics
     route_counts = {}
@@ -203,44 +566,35 @@ def get_vehicles():
         route = v['route_id']
         route_counts[route] = route_counts.get(route, 0) + 1
     
-    # Add closest stop information to each vehicle
-    include_stops = request.args.get('include_stops', 'true').lower() == 'true'
-    if include_stops:
-        for v in vehicles:
-            try:
-                closest_stop = find_closest_stop(v['latitude'], v['longitude'])
-                if closest_stop:
-                    v['closest_stop'] = {
-                        'stop_id': closest_stop['stop_id'],
-                        'stop_name': closest_stop['stop_name'],
-                        'stop_latitude': closest_stop['stop_lat'],
-                        'stop_longitude': closest_stop['stop_lng'],
-                        'distance_miles': closest_stop['distance_miles'],
-                        'distance_meters': closest_stop['distance_meters']
-                    }
-                else:
-                    v['closest_stop'] = None
-            except (KeyError, TypeError):
-                v['closest_stop'] = None
+    total = len(vehicles)
+    vehicles, next_cursor = page_vehicles(vehicles, limit, cursor)
+    
+    # Add closest stop information to each vehicle - only for the page, and
+    # only if the closest_stop field is wanted
+    if include_stops and (fields is None or 'closest_stop' in fields):
+        add_closest_stops(vehicles)
+    vehicle_ids = [v['vehicle_id'] for v in vehicles]
+    vehicles = project_vehicles(vehicles, fields)
+    headers = {'X-Next-Cursor': next_cursor} if next_cursor else None
     
     # Check if format=array is requested (for Zapier triggers)
-    format_type = request.args.get('format', 'json')
     if format_type == 'array':
         # Return array directly with id field for Zapier triggers
-        vehicles_with_id = []
-        for v in vehicles:
-            vehicle = v.copy()
-            vehicle['id'] = vehicle['vehicle_id']  # Add id field for Zapier
-            vehicles_with_id.append(vehicle)
-        return jsonify(vehicles_with_id)
+        for v, vehicle_id in zip(vehicles, vehicle_ids):
+            v['id'] = vehicle_id  # Add id field for Zapier
+        return SerializedResponse(vehicles, headers=headers, format=output)
     
-    return jsonify({
+    payload = {
         'success': True,
         'count': len(vehicles),
         'vehicles': vehicles,
         'route_counts': route_counts,
         'routes': sorted(route_counts.keys())
-    })
+    }
+    if limit is not None or cursor is not None:
+        payload['total'] = total
+        payload['next_cursor'] = next_cursor
+    return SerializedResponse(payload, headers=headers, format=output)
 
 
 @app.route('/api/routes', methods=['GET'])
@@ -255,10 +609,25 @@ def get_routes():
     Example:
         GET /api/routes?api_key=YOUR_KEY
     """
-    vehicles = rtd_client.get_vehicle_positions()
+    snapshot = rtd_client.get_snapshot('VehiclePosition.pb')
+    if snapshot is not None:
+        etag = feed_etag(snapshot)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        
+        body = cached_response(snapshot, ('routes',), lambda: build_routes_response(snapshot))
+        if body is not None:
+            return body.to_response(etag)
     
+    return jsonify({'error': 'Failed to fetch data'}), 503
+
+
+def build_routes_response(snapshot):
+    """Build and serialize the /api/routes response for one snapshot"""
+    vehicles = rtd_client.get_vehicle_positions(snapshot)
     if vehicles is None:
-        return jsonify({'error': 'Failed to fetch data'}), 503
+        return None
     
     routes = sorted(list(set(v['route_id'] for v in vehicles)))
     
@@ -268,7 +637,7 @@ def get_routes():
         route = v['route_id']
         route_counts[route] = route_counts.get(route, 0) + 1
     
-    return jsonify({
+    return SerializedResponse({
         'success': True,
         'routes': routes,
         'count': len(routes),
@@ -276,52 +645,701 @@ def get_routes():
     })
 
 
+@app.route('/api/vehicles.geojson', methods=['GET'])
+@require_api_key
+def get_vehicles_geojson():
+    """
+    Get active vehicles as a GeoJSON FeatureCollection
+    
+    Query Parameters:
+        route (optional): Filter by route ID
+        bbox (optional): Only vehicles inside "west,south,east,north"
+    
+    Example:
+        GET /api/vehicles.geojson?api_key=YOUR_KEY
+    """
+    route_filter = (request.args.get('route') or '').upper() or None
+    bbox = parse_bbox(request.args.get('bbox'))
+    if request.args.get('bbox') and bbox is None:
+        return jsonify({
+            'error': 'Invalid parameters',
+            'message': 'bbox must be "west,south,east,north" in degrees'
+        }), 400
+    
+    snapshot = rtd_client.get_snapshot('VehiclePosition.pb')
+    if snapshot is not None:
+        etag = feed_etag(snapshot)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        
+        def build():
+            vehicles = rtd_client.find_vehicles(bbox=bbox, snapshot=snapshot)
+            if vehicles is None:
+                return None
+            if route_filter:
+                vehicles = [v for v in vehicles if v['route_id'] == route_filter]
+            return SerializedResponse(vehicles_geojson(vehicles), mimetype='application/geo+json')
+        
+        body = build() if bbox is not None else cached_response(snapshot, ('vehicles.geojson', route_filter), build)
+        if body is not None:
+            return body.to_response(etag)
+    
+    return jsonify({
+        'error': 'Failed to fetch vehicle data',
+        'message': 'RTD API may be temporarily unavailable'
+    }), 503
+
+
+@app.route('/tiles/<int:z>/<int:x>/<int:y>', methods=['GET'])
+@require_api_key
+def get_tile(z, x, y):
+    """
+    Get an XYZ map tile of vehicles and stops
+    
+    Each layer is a GeoJSON FeatureCollection clipped to the tile. Points
+    are clustered at low zooms (features with cluster: true and point_count)
+    and coordinates are rounded to the tile resolution. Tiles are cached per
+    feed version.
+    
+    Query Parameters:
+        layers (optional): Comma-separated layers (default: vehicles,stops)
+    
+    Example:
+        GET /tiles/13/1706/3104?api_key=YOUR_KEY
+    """
+    layers = tuple(l.strip() for l in request.args.get('layers', ','.join(LAYERS)).split(',') if l.strip())
+    if not layers or any(l not in LAYERS for l in layers):
+        return jsonify({
+            'error': 'Invalid parameters',
+            'message': f"layers must be a comma-separated subset of: {', '.join(LAYERS)}"
+        }), 400
+    if not valid_tile(z, x, y):
+        return jsonify({'error': 'Tile not found'}), 404
+    
+    snapshot = rtd_client.get_snapshot('VehiclePosition.pb') if 'vehicles' in layers else None
+    static_feed = rtd_client.get_static_feed() if 'stops' in layers else None
+    etag = request_etag(snapshot.version if snapshot else None, static_feed.version if static_feed else None)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+    
+    tile = tile_builder.tile(z, x, y, layers, snapshot=snapshot)
+    if tile is None:
+        return jsonify({
+            'error': 'Failed to build tile',
+            'message': 'RTD feeds may be temporarily unavailable'
+        }), 503
+    
+    return with_etag(jsonify(tile), etag)
+
+
 @app.route('/api/vehicles/<route_id>', methods=['GET'])
 @require_api_key
 def get_vehicles_by_route(route_id):
     """
     Get vehicles for a specific route
     
+    Query Parameters:
+        include_stops (optional): Add the closest stop to each vehicle (default: true)
+        fields (optional): Comma-separated fields to return (e.g. vehicle_id,latitude,longitude)
+        limit (optional): Page size (max: 1000); pages are ordered by vehicle_id
+        cursor (optional): next_cursor from the previous page
+        format (optional): json (default), msgpack or protobuf (see /api/vehicles)
+    
     Example:
         GET /api/vehicles/A?api_key=YOUR_KEY
+        GET /api/vehicles/A?fields=vehicle_id,latitude,longitude&limit=50&api_key=YOUR_KEY
     """
-    vehicles = rtd_client.get_vehicle_positions()
+    route_id = route_id.upper()
+    include_stops = request.args.get('include_stops', 'true').lower() == 'true'
+    try:
+        output = negotiate_format()
+        fields, limit, cursor = parse_vehicle_query()
+        check_protobuf_query(output, fields, limit, cursor)
+    except ValueError as e:
+        return jsonify({'error': 'Invalid parameters', 'message': str(e)}), 400
+    
+    snapshot = rtd_client.get_snapshot('VehiclePosition.pb')
+    if snapshot is not None:
+        etag = feed_etag(snapshot, output)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        
+        def build():
+            if output == 'protobuf':
+                return build_vehicles_feed(snapshot, route_id)
+            return build_route_vehicles_response(snapshot, route_id, include_stops, fields, limit, cursor, output)
+        
+        body = cached_response(
+            snapshot, ('route_vehicles', route_id, output, include_stops, fields, limit, cursor), build
+        )
+        if body is not None:
+            return body.to_response(etag)
     
+    return jsonify({
+        'error': 'Failed to fetch vehicle data'
+    }), 503
+
+
+def build_route_vehicles_response(snapshot, route_id, include_stops, fields=None, limit=None, cursor=None,
+                                  output='json'):
+    """Build and serialize the /api/vehicles/<route_id> response for one snapshot"""
+    vehicles = rtd_client.get_vehicle_positions(snapshot)
     if vehicles is None:
-        return jsonify({
-            'error': 'Failed to fetch vehicle data'
-        }), 503
+        return None
     
-    route_vehicles = [v for v in vehicles if v['route_id'] == route_id.upper()]
+    route_vehicles = [v for v in vehicles if v['route_id'] == route_id]
+    total = len(route_vehicles)
+    route_vehicles, next_cursor = page_vehicles(route_vehicles, limit, cursor)
     
-    # Add closest stop information to each vehicle
-    include_stops = request.args.get('include_stops', 'true').lower() == 'true'
-    if include_stops:
-        for v in route_vehicles:
-            try:
-                closest_stop = find_closest_stop(v['latitude'], v['longitude'])
-                if closest_stop:
-                    v['closest_stop'] = {
-                        'stop_id': closest_stop['stop_id'],
-                        'stop_name': closest_stop['stop_name'],
-                        'stop_latitude': closest_stop['stop_lat'],
-                        'stop_longitude': closest_stop['stop_lng'],
-                        'distance_miles': closest_stop['distance_miles'],
-                        'distance_meters': closest_stop['distance_meters']
-                    }
-                else:
-                    v['closest_stop'] = None
-            except (KeyError, TypeError):
-                v['closest_stop'] = None
+    # Add closest stop information to each vehicle on the page, if wanted
+    if include_stops and (fields is None or 'closest_stop' in fields):
+        add_closest_stops(route_vehicles)
+    route_vehicles = project_vehicles(route_vehicles, fields)
     
-    return jsonify({
+    payload = {
         'success': True,
-        'route': route_id.upper(),
+        'route': route_id,
         'count': len(route_vehicles),
         'vehicles': route_vehicles
+    }
+    if limit is not None or cursor is not None:
+        payload['total'] = total
+        payload['next_cursor'] = next_cursor
+    return SerializedResponse(payload, headers={'X-Next-Cursor': next_cursor} if next_cursor else None, format=output)
+
+
+@app.route('/api/trip_updates', methods=['GET'])
+@require_api_key
+def get_trip_updates():
+    """
+    Get real-time trip updates (delays and predicted stop times)
+    
+    Query Parameters:
+        route (optional): Filter by route ID
+        format (optional): json (default), msgpack or protobuf (a GTFS-realtime
+                           FeedMessage with only the matching trip updates);
+                           without it the Accept header picks the format
+    
+    Example:
+        GET /api/trip_updates?api_key=YOUR_KEY&route=A
+        GET /api/trip_updates?api_key=YOUR_KEY&format=protobuf
+    """
+    route_filter = (request.args.get('route') or '').upper() or None
+    try:
+        output = negotiate_format()
+    except ValueError as e:
+        return jsonify({'error': 'Invalid parameters', 'message': str(e)}), 400
+    
+    snapshot = rtd_client.get_snapshot('TripUpdate.pb')
+    if snapshot is not None:
+        etag = feed_etag(snapshot, output)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        
+        body = cached_response(
+            snapshot, ('trip_updates', route_filter, output),
+            lambda: build_trip_updates_response(snapshot, route_filter, output)
+        )
+        if body is not None:
+            return body.to_response(etag)
+    
+    return jsonify({
+        'error': 'Failed to fetch trip updates',
+        'message': 'RTD API may be temporarily unavailable'
+    }), 503
+
+
+def build_trip_updates_response(snapshot, route_filter, output='json'):
+    """Build and serialize the /api/trip_updates response for one snapshot"""
+    if output == 'protobuf':
+        return SerializedResponse(snapshot.subset(lambda entity: (
+            entity.HasField('trip_update')
+            and (not route_filter or entity.trip_update.trip.route_id == route_filter)
+        )), format='protobuf')
+    
+    updates = rtd_client.get_trip_updates(snapshot)
+    if updates is None:
+        return None
+    if route_filter:
+        updates = [u for u in updates if u['route_id'] == route_filter]
+    
+    return SerializedResponse({
+        'success': True,
+        'count': len(updates),
+        'trip_updates': updates
+    }, format=output)
+
+
+@app.route('/api/alerts', methods=['GET'])
+@require_api_key
+def get_alerts():
+    """
+    Get service alerts
+    
+    Query Parameters:
+        route (optional): Only alerts affecting this route
+        format (optional): json (default), msgpack or protobuf (a GTFS-realtime
+                           FeedMessage with only the matching alerts);
+                           without it the Accept header picks the format
+    
+    Example:
+        GET /api/alerts?api_key=YOUR_KEY
+        GET /api/alerts?api_key=YOUR_KEY&route=A&format=msgpack
+    """
+    route_filter = (request.args.get('route') or '').upper() or None
+    try:
+        output = negotiate_format()
+    except ValueError as e:
+        return jsonify({'error': 'Invalid parameters', 'message': str(e)}), 400
+    
+    snapshot = rtd_client.get_snapshot('Alert.pb')
+    if snapshot is not None:
+        etag = feed_etag(snapshot, output)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        
+        body = cached_response(
+            snapshot, ('alerts', route_filter, output),
+            lambda: build_alerts_response(snapshot, route_filter, output)
+        )
+        if body is not None:
+            return body.to_response(etag)
+    
+    return jsonify({
+        'error': 'Failed to fetch alerts',
+        'message': 'RTD API may be temporarily unavailable'
+    }), 503
+
+
+def build_alerts_response(snapshot, route_filter, output='json'):
+    """Build and serialize the /api/alerts response for one snapshot"""
+    if output == 'protobuf':
+        return SerializedResponse(snapshot.subset(lambda entity: (
+            entity.HasField('alert')
+            and (not route_filter or any(e.route_id == route_filter for e in entity.alert.informed_entity))
+        )), format='protobuf')
+    
+    alerts = rtd_client.get_alerts(snapshot)
+    if alerts is None:
+        return None
+    if route_filter:
+        alerts = [a for a in alerts if route_filter in a['affected_routes']]
+    
+    return SerializedResponse({
+        'success': True,
+        'count': len(alerts),
+        'alerts': alerts
+    }, format=output)
+
+
+MAX_TRIGGER_EVENTS = 500
+
+
+@app.route('/api/triggers/<event_type>', methods=['GET'])
+@require_api_key
+def get_trigger_events(event_type):
+    """
+    Polling trigger for Zapier: only the events that are new since a cursor
+    
+    Instead of returning the whole fleet on every poll, changes between
+    feed versions are recorded in a bounded event log and a poll reads just
+    the events after the caller's cursor. Events are returned newest first,
+    each with a unique id (as Zapier expects); X-Next-Cursor holds the id to
+    pass as since= next time.
+    
+    Event types:
+        vehicle_appeared: A vehicle not in the previous feed version
+        route_started: A route with no vehicles in the previous version
+        alert_created: A service alert with a new id
+        delay_exceeded: A trip became more than 5 minutes late at its next stop
+        arrival_soon: A bus is within N minutes of a stop (see /api/arrivals)
+    
+    Query Parameters:
+        since (optional): Last event id already seen (default: the newest events)
+        limit (optional): Maximum number of events (default: 50, max: 500)
+        route (optional): Only events for this route
+        min_delay (optional): delay_exceeded only - minimum delay in seconds
+    
+    Example:
+        GET /api/triggers/vehicle_appeared?api_key=YOUR_KEY
+        GET /api/triggers/delay_exceeded?route=A&since=1042&api_key=YOUR_KEY
+    """
+    if event_type not in EVENT_TYPES:
+        return jsonify({
+            'error': 'Unknown event type',
+            'message': f"Choose one of: {', '.join(EVENT_TYPES)}"
+        }), 404
+    
+    since = request.args.get('since', type=int)
+    limit = max(1, min(request.args.get('limit', 50, type=int), MAX_TRIGGER_EVENTS))
+    route_filter = (request.args.get('route') or '').upper() or None
+    min_delay = request.args.get('min_delay', type=int) if event_type == DELAY_EXCEEDED else None
+    owner = api_key_owner()
+    
+    def match(event):
+        if not visible_to(owner, event):
+            return False
+        if route_filter and event.get('route_id') != route_filter and route_filter not in event.get('affected_routes', ()):
+            return False
+        return min_delay is None or event['delay_seconds'] >= min_delay
+    
+    # Diff the feed if it changed since the last poll (no-op otherwise)
+    event_detector.update([EVENT_FEEDS[event_type]])
+    log = event_detector.log
+    events = log.since(since, types=[event_type], limit=limit, match=match)
+    
+    headers = {'X-Next-Cursor': str(events[-1]['id'] if events else max(since or 0, log.last_id))}
+    if since is not None and since < log.oldest_id - 1:
+        # Events between the cursor and the oldest kept event were dropped
+        headers['X-Events-Dropped'] = 'true'
+    
+    response = jsonify(events[::-1])
+    response.headers.extend(headers)
+    return response
+
+
+@app.route('/api/webhooks', methods=['POST'])
+@require_api_key
+def create_webhook():
+    """
+    Register a webhook that receives events as they happen
+    
+    Events (the same as /api/triggers) are POSTed in batches as
+    {"subscription_id": "...", "events": [...]}, signed with an
+    X-RTD-Signature header (sha256 HMAC of the body using the returned
+    secret). Failed deliveries are retried with exponential backoff;
+    responding 410 Gone unsubscribes.
+    
+    Body:
+        {
+            "url": "https://hooks.zapier.com/hooks/catch/...",
+            "filters": {
+                "events": ["delay_exceeded", "alert_created"],
+                "routes": ["15", "A"],
+                "stops": ["12345"],
+                "alert_effects": ["DETOUR"],
+                "geofence": {"type": "circle", "lat": 39.7539, "lng": -105.0002, "radius": 500}
+            }
+        }
+    
+    All filters are optional and must all match; any value in a list matches.
+    """
+    body = request.get_json(silent=True) or {}
+    try:
+        subscriber = webhook_dispatcher.subscribe(api_key_owner(), body.get('url'), body.get('filters'))
+    except ValueError as e:
+        return jsonify({'error': 'Invalid webhook', 'message': str(e)}), 400
+    
+    webhook_dispatcher.start()
+    return jsonify({
+        'success': True,
+        'id': subscriber['id'],
+        'url': subscriber['url'],
+        'filters': subscriber['filters'],
+        'secret': subscriber['secret'],
+        'message': 'Store the secret to verify X-RTD-Signature - it cannot be retrieved again'
+    }), 201
+
+
+@app.route('/api/webhooks', methods=['GET'])
+@require_api_key
+def list_webhooks():
+    """
+    List your webhooks with delivery metrics
+    
+    Each webhook reports delivered batches and events, failed and dropped
+    deliveries, average delivery latency and lag (event to delivery), the
+    last error and the number of deliveries still queued.
+    """
+    owner = api_key_owner()
+    stats = webhook_dispatcher.stats(owner)
+    return jsonify({
+        'success': True,
+        'webhooks': [{
+            'id': s['id'],
+            'url': s['url'],
+            'filters': s['filters'],
+            'metrics': stats.get(s['id'])
+        } for s in webhook_dispatcher.store.subscribers(owner)]
+    })
+
+
+@app.route('/api/webhooks/<webhook_id>', methods=['DELETE'])
+@require_api_key
+def delete_webhook(webhook_id):
+    """Remove a webhook and its pending deliveries"""
+    owner = api_key_owner()
+    if not any(s['id'] == webhook_id for s in webhook_dispatcher.store.subscribers(owner)):
+        return jsonify({'error': 'Webhook not found'}), 404
+    
+    webhook_dispatcher.unsubscribe(webhook_id)
+    return jsonify({'success': True, 'id': webhook_id})
+
+
+GEOFENCE_EVENTS = (GEOFENCE_ENTER, GEOFENCE_EXIT)
+GEOFENCE_FEED_INTERVAL = 15     # Seconds between feed checks while streaming
+
+
+@app.route('/api/geofences', methods=['POST'])
+@require_api_key
+def create_geofence():
+    """
+    Register a geofence
+    
+    Every vehicle snapshot is checked against your geofences; a vehicle
+    entering or leaving one produces a geofence_enter / geofence_exit event
+    (poll /api/geofences/events, stream /api/geofences/events/stream, or
+    receive them through a webhook).
+    
+    Body:
+        {
+            "name": "Union Station",
+            "shape": {"type": "circle", "lat": 39.7539, "lng": -105.0002, "radius": 300},
+            "routes": ["15"]
+        }
+    
+    shape can also be {"type": "polygon", "coordinates": [[lng, lat], ...]}.
+    routes is optional (default: every vehicle).
+    """
+    body = request.get_json(silent=True) or {}
+    try:
+        fence = geofence_engine.add(api_key_owner(), body.get('shape'), body.get('routes'), body.get('name', ''))
+    except ValueError as e:
+        return jsonify({'error': 'Invalid geofence', 'message': str(e)}), 400
+    
+    return jsonify({'success': True, 'geofence': fence.to_dict()}), 201
+
+
+@app.route('/api/geofences', methods=['GET'])
+@require_api_key
+def list_geofences():
+    """List your geofences"""
+    fences = geofence_engine.owned(api_key_owner())
+    return jsonify({
+        'success': True,
+        'count': len(fences),
+        'geofences': [f.to_dict() for f in fences]
+    })
+
+
+@app.route('/api/geofences/<fence_id>', methods=['DELETE'])
+@require_api_key
+def delete_geofence(fence_id):
+    """Remove a geofence"""
+    if not any(f.id == fence_id for f in geofence_engine.owned(api_key_owner())):
+        return jsonify({'error': 'Geofence not found'}), 404
+    
+    geofence_engine.remove(fence_id)
+    return jsonify({'success': True, 'id': fence_id})
+
+
+def geofence_event_filter(owner, fence_id=None):
+    """Match function for the caller's geofence events (optionally one fence)"""
+    def match(event):
+        return event.get('owner') == owner and (fence_id is None or event.get('fence_id') == fence_id)
+    return match
+
+
+@app.route('/api/geofences/events', methods=['GET'])
+@require_api_key
+def get_geofence_events():
+    """
+    Poll enter/exit events for your geofences
+    
+    Query Parameters:
+        since (optional): Last event id already seen (default: the newest events)
+        fence_id (optional): Only events for this geofence
+        limit (optional): Maximum number of events (default: 100, max: 500)
+    
+    Events are oldest first; pass next_cursor back as since.
+    
+    Example:
+        GET /api/geofences/events?since=120&api_key=YOUR_KEY
+    """
+    since = request.args.get('since', type=int)
+    limit = max(1, min(request.args.get('limit', 100, type=int), MAX_TRIGGER_EVENTS))
+    match = geofence_event_filter(api_key_owner(), request.args.get('fence_id'))
+    
+    event_detector.update(['VehiclePosition.pb'])
+    log = event_detector.log
+    latest = log.last_id
+    events = log.since(since, types=GEOFENCE_EVENTS, limit=limit, match=match)
+    if len(events) == limit:
+        next_cursor = events[-1]['id']
+    else:
+        next_cursor = max([latest, since or 0] + [e['id'] for e in events[-1:]])
+    
+    return jsonify({
+        'success': True,
+        'count': len(events),
+        'events': events,
+        'next_cursor': next_cursor
     })
 
 
+@app.route('/api/geofences/events/stream', methods=['GET'])
+@require_api_key
+def stream_geofence_events():
+    """
+    Stream enter/exit events for your geofences as Server-Sent Events
+    
+    Each event is sent with its id, so a reconnecting EventSource resumes
+    from Last-Event-ID. A comment line is sent every 15 seconds to keep
+    the connection open.
+    
+    Query Parameters:
+        since (optional): Last event id already seen (default: only new events)
+        fence_id (optional): Only events for this geofence
+    
+    Example:
+        curl -N "http://localhost:8000/api/geofences/events/stream?api_key=YOUR_KEY"
+    """
+    log = event_detector.log
+    since = request.args.get('since', type=int)
+    if since is None:
+        since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = log.last_id
+    match = geofence_event_filter(api_key_owner(), request.args.get('fence_id'))
+    encode = app.json.encode
+    
+    def generate():
+        cursor = since
+        yield b'retry: 5000\n\n'
+        while True:
+            if not log.wait(cursor, GEOFENCE_FEED_INTERVAL):
+                # Shared between streams - at most one feed check per interval
+                event_detector.update(['VehiclePosition.pb'], min_interval=GEOFENCE_FEED_INTERVAL)
+                yield b': keep-alive\n\n'
+                continue
+            latest = log.last_id
+            events = log.since(cursor, types=GEOFENCE_EVENTS, limit=MAX_TRIGGER_EVENTS, match=match)
+            for event in events:
+                yield f"id: {event['id']}\nevent: {event['type']}\ndata: ".encode('utf-8') + encode(event) + b'\n\n'
+            if len(events) == MAX_TRIGGER_EVENTS:
+                cursor = events[-1]['id']
+            else:
+                cursor = max([latest] + [e['id'] for e in events[-1:]])
+    
+    return app.response_class(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+@app.route('/api/arrivals', methods=['POST'])
+@require_api_key
+def create_arrival_subscription():
+    """
+    Get notified when a bus is N minutes away from a stop
+    
+    Every trip update snapshot is checked against the predicted arrival
+    times at your stop; the first time a trip on the route is within
+    `minutes` an arrival_soon event is logged (once per trip). Read them
+    with /api/triggers/arrival_soon or a webhook.
+    
+    Body:
+        {"route": "15", "stop_id": "12345", "minutes": 5}
+    
+    minutes: 1-60
+    """
+    body = request.get_json(silent=True) or {}
+    stop_id = str(body.get('stop_id') or '').strip()
+    stops = get_stops_cache()
+    if stop_id and stops is not None and not any(s['stop_id'] == stop_id for s in stops):
+        return jsonify({'error': 'Invalid arrival subscription', 'message': f"Unknown stop_id '{stop_id}'"}), 400
+    try:
+        sub = arrival_engine.add(api_key_owner(), body.get('route'), stop_id, body.get('minutes', 5))
+    except ValueError as e:
+        return jsonify({'error': 'Invalid arrival subscription', 'message': str(e)}), 400
+    
+    return jsonify({'success': True, 'subscription': sub.to_dict()}), 201
+
+
+@app.route('/api/arrivals', methods=['GET'])
+@require_api_key
+def list_arrival_subscriptions():
+    """List your arrival subscriptions"""
+    subs = arrival_engine.owned(api_key_owner())
+    return jsonify({
+        'success': True,
+        'count': len(subs),
+        'subscriptions': [s.to_dict() for s in subs]
+    })
+
+
+@app.route('/api/arrivals/<subscription_id>', methods=['DELETE'])
+@require_api_key
+def delete_arrival_subscription(subscription_id):
+    """Remove an arrival subscription"""
+    if not any(s.id == subscription_id for s in arrival_engine.owned(api_key_owner())):
+        return jsonify({'error': 'Subscription not found'}), 404
+    
+    arrival_engine.remove(subscription_id)
+    return jsonify({'success': True, 'id': subscription_id})
+
+
+# Export name -> realtime feed file
+EXPORT_FEEDS = {
+    'vehicles': 'VehiclePosition.pb',
+    'trip_updates': 'TripUpdate.pb',
+    'alerts': 'Alert.pb',
+}
+
+
+@app.route('/api/export/<feed>.ndjson', methods=['GET'])
+@require_api_key
+def export_feed(feed):
+    """
+    Bulk export of a realtime feed as newline-delimited JSON
+    
+    One vehicle, trip update or alert per line, in the same shape as the
+    JSON endpoints. Records are converted from the feed as they are sent
+    (chunked transfer), so memory use stays flat however large the feed
+    is and the first line arrives immediately. The feed version is sent in
+    X-Feed-Version.
+    
+    Query Parameters:
+        route (optional): Only records for this route
+    
+    Example:
+        GET /api/export/trip_updates.ndjson?api_key=YOUR_KEY
+        GET /api/export/vehicles.ndjson?route=A&api_key=YOUR_KEY
+    """
+    if feed not in EXPORT_FEEDS:
+        return jsonify({
+            'error': 'Unknown export',
+            'message': f"Choose one of: {', '.join(name + '.ndjson' for name in EXPORT_FEEDS)}"
+        }), 404
+    route_filter = (request.args.get('route') or '').upper() or None
+    
+    snapshot = rtd_client.get_snapshot(EXPORT_FEEDS[feed])
+    if snapshot is None:
+        return jsonify({
+            'error': 'Failed to fetch feed',
+            'message': 'RTD API may be temporarily unavailable'
+        }), 503
+    
+    etag = request_etag(snapshot.version)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+    
+    records = rtd_client.iter_records(snapshot)
+    if route_filter:
+        if feed == 'alerts':
+            records = (r for r in records if route_filter in r['affected_routes'])
+        else:
+            records = (r for r in records if r['route_id'] == route_filter)
+    
+    return with_etag(stream_ndjson(records, headers={'X-Feed-Version': snapshot.version}), etag)
+
+
 @app.route('/api/directions', methods=['GET'])
 @require_api_key
 def get_directions():
@@ -332,18 +1350,19 @@ def get_directions():
         origin (required): Starting location
         destination (required): Ending location
         departure_time (optional): ISO format datetime
+        planner (optional): 'google' (default) or 'local' - the local planner
+                            routes over the RTD timetable without Google and
+                            accepts "lat,lng", stop names, or addresses (when
+                            Google geocoding is configured)
+        max_transfers (optional): Maximum transfers for planner=local (default: 3)
     
     Example:
         GET /api/directions?origin=Union%20Station&destination=Denver%20Airport&api_key=YOUR_KEY
+        GET /api/directions?origin=39.7539,-105.0002&destination=39.8492,-104.6731&planner=local&api_key=YOUR_KEY
     """
-    if not google_client:
-        return jsonify({
-            'error': 'Google Maps API not configured',
-            'message': 'Set GOOGLE_MAPS_API_KEY in config.py'
-        }), 503
-    
     origin = request.args.get('origin')
     destination = request.args.get('destination')
+    planner = request.args.get('planner', 'google').lower()
     
     if not origin or not destination:
         return jsonify({
@@ -351,7 +1370,26 @@ def get_directions():
             'message': 'Both origin and destination are required'
         }), 400
     
-    result = google_client.get_transit_directions(origin, destination)
+    departure_time = None
+    if request.args.get('departure_time'):
+        try:
+            departure_time = datetime.fromisoformat(request.args['departure_time'])
+        except ValueError:
+            return jsonify({
+                'error': 'Invalid departure_time',
+                'message': 'Use ISO 8601 format (e.g. 2025-01-15T08:30:00)'
+            }), 400
+    
+    if planner == 'local':
+        return get_local_directions(origin, destination, departure_time)
+    
+    if not google_client:
+        return jsonify({
+            'error': 'Google Maps API not configured',
+            'message': 'Set GOOGLE_MAPS_API_KEY in config.py, or use planner=local'
+        }), 503
+    
+    result = google_client.get_transit_directions(origin, destination, departure_time=departure_time)
     
     if not result or not result.get('routes'):
         return jsonify({
@@ -367,45 +1405,325 @@ def get_directions():
     })
 
 
+def get_local_directions(origin, destination, departure_time):
+    """Answer /api/directions with the local RAPTOR planner"""
+    max_transfers = max(0, min(request.args.get('max_transfers', 3, type=int), 5))
+    geocoder = google_client.geocode if google_client else None
+    
+    start = rtd_client.resolve_location(origin, geocoder)
+    end = rtd_client.resolve_location(destination, geocoder)
+    if not start or not end:
+        return jsonify({
+            'error': 'Location not found',
+            'message': 'Use "lat,lng" or an RTD stop name (addresses need Google Maps configured)'
+        }), 404
+    
+    result = rtd_client.plan_trip(
+        (start['lat'], start['lng']),
+        (end['lat'], end['lng']),
+        departure_time,
+        max_transfers=max_transfers,
+        origin_name=start['name'],
+        destination_name=end['name']
+    )
+    
+    if result is None:
+        return jsonify({
+            'error': 'Timetable unavailable',
+            'message': 'RTD static feed may be temporarily unavailable'
+        }), 503
+    
+    if not result['routes']:
+        return jsonify({
+            'error': 'No routes found',
+            'message': 'Could not find transit directions'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'origin': origin,
+        'destination': destination,
+        'planner': 'local',
+        'routes': result['routes']
+    })
+
+
+MAX_BATCH_DIRECTIONS = 25
+
+
+@app.route('/api/directions/batch', methods=['POST'])
+@require_api_key
+def get_directions_batch():
+    """
+    Get transit directions for many origin/destination pairs concurrently
+    
+    Body:
+        {
+            "trips": [
+                {"origin": "Union Station", "destination": "Denver Airport"},
+                {"origin": "Coors Field", "destination": "Cherry Creek",
+                 "departure_time": "2025-01-15T08:30:00", "alternatives": true}
+            ]
+        }
+    
+    Each result reports success or its own error, so one bad trip does not
+    fail the batch. At most 25 trips per request.
+    """
+    if not google_client:
+        return jsonify({
+            'error': 'Google Maps API not configured',
+            'message': 'Set GOOGLE_MAPS_API_KEY in config.py'
+        }), 503
+    
+    body = request.get_json(silent=True) or {}
+    trips = body.get('trips')
+    
+    if not isinstance(trips, list) or not trips:
+        return jsonify({
+            'error': 'Missing trips',
+            'message': 'Body must be JSON with a non-empty "trips" list'
+        }), 400
+    
+    if len(trips) > MAX_BATCH_DIRECTIONS:
+        return jsonify({
+            'error': 'Too many trips',
+            'message': f'At most {MAX_BATCH_DIRECTIONS} trips per request'
+        }), 400
+    
+    # Validate each trip; invalid ones get an error result without a request
+    results = [None] * len(trips)
+    valid = []
+    for index, trip in enumerate(trips):
+        if not isinstance(trip, dict) or not trip.get('origin') or not trip.get('destination'):
+            results[index] = {'success': False, 'error': 'Both origin and destination are required'}
+            continue
+        try:
+            parsed = {
+                'origin': trip['origin'],
+                'destination': trip['destination'],
+                'alternatives': bool(trip.get('alternatives', False))
+            }
+            for field in ('departure_time', 'arrival_time'):
+                if trip.get(field):
+                    parsed[field] = datetime.fromisoformat(trip[field])
+        except (TypeError, ValueError):
+            results[index] = {
+                'origin': trip['origin'],
+                'destination': trip['destination'],
+                'success': False,
+                'error': 'Times must be ISO 8601 (e.g. 2025-01-15T08:30:00)'
+            }
+            continue
+        valid.append((index, parsed))
+    
+    for (index, _), result in zip(valid, google_client.get_directions_batch([t for _, t in valid])):
+        results[index] = result
+    
+    for index, result in enumerate(results):
+        result['index'] = index
+    
+    return jsonify({
+        'success': True,
+        'count': len(results),
+        'succeeded': sum(1 for r in results if r['success']),
+        'results': results
+    })
+
+
 @app.route('/api/stations/nearby', methods=['GET'])
 @require_api_key
 def get_nearby_stations():
     """
-    Find nearby transit stations
+    Find nearby RTD stops
+    
+    Stops are looked up in the local stop index. Google Maps is only used
+    to geocode a free-text location.
     
     Query Parameters:
-        location (required): Address or location
-        radius (optional): Search radius in meters (default: 1000)
+        lat, lng (optional): Search center coordinates
+        location (optional): Address, place name or "lat,lng" (used when lat/lng are not given)
+        radius (optional): Search radius in meters (default: 1000, max: 5000)
+        limit (optional): Maximum number of stations, nearest first
+        include_routes (optional): Add the routes serving each stop (default: false)
     
     Example:
+        GET /api/stations/nearby?lat=39.7539&lng=-105.0002&api_key=YOUR_KEY
         GET /api/stations/nearby?location=Downtown%20Denver&api_key=YOUR_KEY
     """
-    if not google_client:
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    location = request.args.get('location')
+    radius = max(1, min(request.args.get('radius', 1000, type=int), 5000))
+    limit = request.args.get('limit', type=int)
+    include_routes = request.args.get('include_routes', 'false').lower() == 'true'
+    
+    if lat is None or lng is None:
+        if not location:
+            return jsonify({
+                'error': 'Missing location',
+                'message': 'Provide lat and lng, or a location parameter'
+            }), 400
+        
+        coords = parse_coordinates(location)
+        if coords:
+            lat, lng = coords
+        elif not google_client:
+            return jsonify({
+                'error': 'Google Maps API not configured',
+                'message': 'Pass lat and lng directly, or set GOOGLE_MAPS_API_KEY in config.py to search by address'
+            }), 503
+        else:
+            geocoded = google_client.geocode(location)
+            if not geocoded:
+                return jsonify({
+                    'error': 'Location not found',
+                    'message': f'Could not geocode "{location}"'
+                }), 404
+            lat, lng = geocoded['lat'], geocoded['lng']
+    
+    stops = rtd_client.find_stops_near(lat, lng, radius, limit=limit, include_routes=include_routes)
+    
+    if stops is None:
         return jsonify({
-            'error': 'Google Maps API not configured'
+            'error': 'Failed to find stations',
+            'message': 'RTD static feed may be temporarily unavailable'
         }), 503
     
-    location = request.args.get('location')
-    radius = request.args.get('radius', 1000, type=int)
+    stations = []
+    for stop in stops:
+        station = {
+            'stop_id': stop.get('stop_id'),
+            'name': stop.get('stop_name', ''),
+            'location': {'lat': float(stop['stop_lat']), 'lng': float(stop['stop_lon'])},
+            'distance_meters': stop['distance_meters']
+        }
+        if include_routes:
+            station['routes'] = stop['routes']
+        stations.append(station)
     
-    if not location:
+    return jsonify({
+        'success': True,
+        'location': location or f"{lat},{lng}",
+        'coordinates': {'lat': lat, 'lng': lng},
+        'radius': radius,
+        'count': len(stations),
+        'stations': stations
+    })
+
+
+@app.route('/api/reachability', methods=['GET'])
+@require_api_key
+def get_reachability():
+    """
+    Find everywhere reachable by transit within a time budget (isochrone)
+    
+    Computed from the local RTD timetable, leaving at departure_time and
+    including trips of the previous service day that run past midnight.
+    Results are cached per origin and departure time.
+    
+    Query Parameters:
+        lat, lng (required): Origin coordinates
+        minutes (optional): Travel time budget (default: 30, max: 120)
+        departure_time (optional): ISO format datetime (default: now)
+        max_transfers (optional): Maximum transfers (default: 3, max: 5)
+        window (optional): Best time over departures in the next N minutes (default: 0, max: 60)
+        grid (optional): Also return a travel time grid with cells of this many meters (min: 50)
+    
+    Example:
+        GET /api/reachability?lat=39.7539&lng=-105.0002&minutes=30&api_key=YOUR_KEY
+        GET /api/reachability?lat=39.7539&lng=-105.0002&minutes=45&grid=250&api_key=YOUR_KEY
+    """
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    minutes = max(1, min(request.args.get('minutes', 30, type=int), 120))
+    max_transfers = max(0, min(request.args.get('max_transfers', 3, type=int), 5))
+    window = max(0, min(request.args.get('window', 0, type=int), 60))
+    grid = request.args.get('grid', type=int)
+    
+    if lat is None or lng is None:
         return jsonify({
-            'error': 'Missing location parameter'
+            'error': 'Missing parameters',
+            'message': 'Both lat and lng are required'
         }), 400
     
-    stations = google_client.find_nearby_transit_stations(location, radius)
+    departure_time = None
+    if request.args.get('departure_time'):
+        try:
+            departure_time = datetime.fromisoformat(request.args['departure_time'])
+        except ValueError:
+            return jsonify({
+                'error': 'Invalid departure_time',
+                'message': 'Use ISO 8601 format (e.g. 2025-01-15T08:30:00)'
+            }), 400
+    
+    result = rtd_client.get_reachability(
+        lat, lng, minutes, departure_time,
+        max_transfers=max_transfers,
+        window_minutes=window,
+        grid_size_m=max(50, grid) if grid else None
+    )
     
-    if stations is None:
+    if result is None:
         return jsonify({
-            'error': 'Failed to find stations'
+            'error': 'Timetable unavailable',
+            'message': 'RTD static feed may be temporarily unavailable'
+        }), 503
+    
+    response = {
+        'success': True,
+        'coordinates': {'lat': lat, 'lng': lng},
+        'minutes': minutes,
+        'departure_time': result['departure_time'],
+        'count': len(result['stops'])
+    }
+    if 'grid' in result:
+        response['grid'] = result['grid']
+    response['stops'] = result['stops']
+    return jsonify(response)
+
+
+@app.route('/api/stops/search', methods=['GET'])
+@require_api_key
+def search_stops():
+    """
+    Search RTD stops by name (for autocomplete)
+    
+    Query Parameters:
+        q (required): Search text - substrings, prefixes and typos are matched
+        limit (optional): Maximum number of results (default: 10, max: 50)
+        fuzzy (optional): Include typo-tolerant matches (default: true)
+    
+    Example:
+        GET /api/stops/search?q=union&api_key=YOUR_KEY
+    """
+    query = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    fuzzy = request.args.get('fuzzy', 'true').lower() == 'true'
+    
+    if not query:
+        return jsonify({
+            'error': 'Missing q parameter'
+        }), 400
+    
+    stops = rtd_client.search_stops(query, limit=limit, fuzzy=fuzzy)
+    
+    if stops is None:
+        return jsonify({
+            'error': 'Failed to load stops',
+            'message': 'RTD static feed may be temporarily unavailable'
         }), 503
     
     return jsonify({
         'success': True,
-        'location': location,
-        'radius': radius,
-        'count': len(stations),
-        'stations': stations
+        'query': query,
+        'count': len(stops),
+        'stops': [{
+            'stop_id': stop.get('stop_id'),
+            'stop_name': stop.get('stop_name'),
+            'stop_latitude': float(stop['stop_lat']) if stop.get('stop_lat') else None,
+            'stop_longitude': float(stop['stop_lon']) if stop.get('stop_lon') else None,
+            'score': stop['score']
+        } for stop in stops]
     })
 
 
@@ -459,15 +1777,36 @@ if __name__ == '__main__':
     print("\n📚 Endpoints:")
     print("   GET  / - API documentation")
     print("   GET  /api/health - Health check")
+    print("   GET  /metrics - Prometheus metrics")
+    print("   GET  /debug/profiles - Request profiles (admin key, ?profile=1)")
+    print("   GET  /debug/traces - Recent request traces (admin key)")
+    print("   GET  /debug/memory - Memory held by feeds and caches (admin key)")
     print("   GET  /api/vehicles - All vehicles")
     print("   GET  /api/vehicles/<route> - Vehicles by route")
+    print("   GET  /api/vehicles.geojson - Vehicles as GeoJSON")
+    print("   GET  /tiles/<z>/<x>/<y> - Vehicle and stop map tiles")
+    print("   GET  /api/trip_updates - Real-time trip updates")
+    print("   GET  /api/alerts - Service alerts")
+    print("   GET  /api/export/<feed>.ndjson - Streamed bulk export")
+    print("   GET  /api/triggers/<event_type> - New events for Zapier triggers")
+    print("   POST /api/webhooks - Register a webhook (GET to list, DELETE /api/webhooks/<id>)")
+    print("   POST /api/geofences - Register a geofence (GET to list, DELETE /api/geofences/<id>)")
+    print("   GET  /api/geofences/events[/stream] - Geofence enter/exit events")
+    print("   POST /api/arrivals - Bus N minutes away alerts (GET to list, DELETE /api/arrivals/<id>)")
     print("   GET  /api/directions - Transit directions")
+    print("   POST /api/directions/batch - Batch transit directions")
     print("   GET  /api/stations/nearby - Find stations")
+    print("   GET  /api/stops/search - Stop name autocomplete")
+    print("   GET  /api/reachability - Reachable stops within N minutes")
     print("\n🔗 For Zapier:")
     print("   Webhook URL: http://localhost:5000/api/vehicles")
     print("   Add header: X-API-Key: " + list(API_KEYS.keys())[0])
     print("\n" + "="*80 + "\n")
     
+    # With the debug reloader only the child process serves requests
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        webhook_dispatcher.start()
+    
     # Run the server
     app.run(debug=True, host='0.0.0.0', port=8000)
 
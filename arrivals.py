@@ -0,0 +1,225 @@
+"""
+Arrival Alerts
+"Bus is N minutes away" subscriptions, checked against each new TripUpdate
+snapshot and logged as arrival_soon events
+
+Subscriptions are indexed by route and then stop, so a snapshot only looks
+at the subscriptions for routes that have trip updates in it, and for each
+predicted stop time only at the subscriptions for that stop.
+"""
+
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from cache_store import default_cache_dir
+from event_log import ARRIVAL_SOON
+
+MAX_MINUTES = 60
+
+
+class ArrivalSubscription:
+    """Notify owner when a vehicle on route_id is within minutes of stop_id"""
+
+    __slots__ = ('id', 'owner', 'route_id', 'stop_id', 'minutes', 'created_at')
+
+    def __init__(self, subscription_id: str, owner: str, route_id: str, stop_id: str, minutes: int,
+                 created_at: Optional[float] = None):
+        self.id = subscription_id
+        self.owner = owner
+        self.route_id = route_id
+        self.stop_id = stop_id
+        self.minutes = minutes
+        self.created_at = created_at or time.time()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'route_id': self.route_id,
+            'stop_id': self.stop_id,
+            'minutes': self.minutes,
+        }
+
+
+class ArrivalEngine:
+    """
+    Evaluates arrival subscriptions against each new TripUpdate snapshot
+
+    The ETA of a trip at a stop is its predicted arrival (or departure) time
+    in the feed minus the feed timestamp. A subscription fires once per
+    trip: the trip is remembered until it leaves the feed, so later
+    snapshots with the bus still close do not repeat the event.
+    Subscriptions are stored in SQLite so they survive restarts.
+    """
+
+    def __init__(self, detector, path: Optional[str] = None):
+        """
+        Args:
+            detector: FeedEventDetector to receive snapshots from and log events to
+            path: SQLite database file (default: arrivals.sqlite in the cache dir)
+        """
+        self.detector = detector
+        self.log = detector.log
+        self.path = path or os.path.join(default_cache_dir(), 'arrivals.sqlite')
+        self.subscriptions: Dict[str, ArrivalSubscription] = {}
+        # route_id -> stop_id -> subscriptions, largest minutes first
+        self._index: Dict[str, Dict[str, List[ArrivalSubscription]]] = {}
+        # trip_id -> ids of subscriptions already notified for it
+        self._fired: Dict[str, set] = {}
+        self._lock = threading.RLock()
+        self.evaluations = 0
+        self.last_evaluation_ms: Optional[float] = None
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS arrival_subscriptions ("
+            "id TEXT PRIMARY KEY, owner TEXT NOT NULL, route_id TEXT NOT NULL, stop_id TEXT NOT NULL, "
+            "minutes INTEGER NOT NULL, created_at REAL NOT NULL)"
+        )
+        rows = conn.execute(
+            "SELECT id, owner, route_id, stop_id, minutes, created_at FROM arrival_subscriptions"
+        ).fetchall()
+        self._insert_many(ArrivalSubscription(*row) for row in rows)
+
+        detector.add_observer('TripUpdate.pb', self.evaluate)
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections cannot be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _insert_many(self, subscriptions):
+        with self._lock:
+            touched = set()
+            for sub in subscriptions:
+                self.subscriptions[sub.id] = sub
+                self._index.setdefault(sub.route_id, {}).setdefault(sub.stop_id, []).append(sub)
+                touched.add((sub.route_id, sub.stop_id))
+            for route_id, stop_id in touched:
+                self._index[route_id][stop_id].sort(key=lambda s: s.minutes, reverse=True)
+
+    def add(self, owner: str, route_id: str, stop_id: str, minutes: int) -> ArrivalSubscription:
+        """
+        Subscribe to arrivals of a route at a stop
+
+        Args:
+            owner: Who the subscription (and its events) belongs to
+            route_id: Route ID (e.g. '15', 'A')
+            stop_id: Stop ID from the GTFS stops
+            minutes: Notify when the predicted arrival is this close
+
+        Raises:
+            ValueError: If an argument is invalid
+        """
+        route_id = str(route_id or '').strip().upper()
+        stop_id = str(stop_id or '').strip()
+        if not route_id or not stop_id:
+            raise ValueError('route and stop_id are required')
+        try:
+            minutes = int(minutes)
+        except (TypeError, ValueError):
+            raise ValueError('minutes must be a whole number')
+        if not 1 <= minutes <= MAX_MINUTES:
+            raise ValueError(f'minutes must be between 1 and {MAX_MINUTES}')
+
+        sub = ArrivalSubscription(secrets.token_urlsafe(9), owner, route_id, stop_id, minutes)
+        self._connect().execute(
+            "INSERT INTO arrival_subscriptions (id, owner, route_id, stop_id, minutes, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (sub.id, owner, route_id, stop_id, minutes, sub.created_at)
+        )
+        self._insert_many([sub])
+        return sub
+
+    def remove(self, subscription_id: str) -> bool:
+        """Delete a subscription"""
+        with self._lock:
+            sub = self.subscriptions.pop(subscription_id, None)
+            if sub is None:
+                return False
+            stops = self._index[sub.route_id]
+            stops[sub.stop_id].remove(sub)
+            if not stops[sub.stop_id]:
+                del stops[sub.stop_id]
+                if not stops:
+                    del self._index[sub.route_id]
+        self._connect().execute("DELETE FROM arrival_subscriptions WHERE id = ?", (subscription_id,))
+        return True
+
+    def owned(self, owner: str) -> List[ArrivalSubscription]:
+        """An owner's subscriptions, oldest first"""
+        with self._lock:
+            return sorted((s for s in self.subscriptions.values() if s.owner == owner), key=lambda s: s.created_at)
+
+    def evaluate(self, snapshot):
+        """Log arrival_soon events for a new TripUpdate snapshot"""
+        start = time.perf_counter()
+        now = snapshot.timestamp or snapshot.fetched_at
+        with self._lock:
+            fired = self._fired
+            trips = set()
+            events = []
+            for update in self.detector.rtd_client.iter_records(snapshot):
+                trip_id = update['trip_id']
+                stops = self._index.get(update['route_id'])
+                if stops is None or not trip_id:
+                    continue
+                trips.add(trip_id)
+                for stu in update['stop_time_updates']:
+                    subs = stops.get(stu['stop_id'])
+                    if subs is None:
+                        continue
+                    predicted = stu['arrival_time'] or stu['departure_time']
+                    if not predicted or predicted < now:
+                        continue
+                    eta = predicted - now
+                    notified = fired.get(trip_id)
+                    for sub in subs:
+                        if sub.minutes * 60 < eta:
+                            break   # Sorted by minutes, the rest are further out
+                        if notified is not None and sub.id in notified:
+                            continue
+                        if notified is None:
+                            notified = fired[trip_id] = set()
+                        notified.add(sub.id)
+                        events.append(self._event(sub, update, stu, eta))
+            # One burst, so a snapshot firing more than max_events loses none
+            self.log.extend(ARRIVAL_SOON, events, snapshot.timestamp)
+            # Forget trips that have left the feed
+            self._fired = {trip_id: ids for trip_id, ids in fired.items() if trip_id in trips}
+            self.evaluations += 1
+            self.last_evaluation_ms = round((time.perf_counter() - start) * 1000, 3)
+
+    def _event(self, sub: ArrivalSubscription, update: Dict[str, Any], stu: Dict[str, Any], eta: float) -> Dict[str, Any]:
+        return {
+            'subscription_id': sub.id,
+            'owner': sub.owner,
+            'route_id': sub.route_id,
+            'stop_id': sub.stop_id,
+            'trip_id': update['trip_id'],
+            'vehicle_id': update['vehicle_id'],
+            'minutes_away': round(eta / 60, 1),
+            'threshold_minutes': sub.minutes,
+            'predicted_arrival': stu['arrival_time'] or stu['departure_time'],
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'subscriptions': len(self.subscriptions),
+                'routes': len(self._index),
+                'trips_notified': len(self._fired),
+                'evaluations': self.evaluations,
+                'last_evaluation_ms': self.last_evaluation_ms,
+            }
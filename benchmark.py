@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+RTD API Benchmarks
+Micro-benchmarks for the response pipeline. Runs offline on synthetic data.
+
+Usage:
+    python3 benchmark.py              # run everything
+    python3 benchmark.py encoding     # JSON backends, compression, streaming
+    python3 benchmark.py formats      # JSON vs MessagePack vs GTFS-rt protobuf
+    python3 benchmark.py arrivals     # "bus N minutes away" subscriptions per snapshot
+    python3 benchmark.py memory       # stops table and snapshot size, with and without shared strings
+"""
+
+import gzip
+import io
+import json
+import random
+import sys
+import time
+import tracemalloc
+import zipfile
+
+from flask import Flask
+from google.transit import gtfs_realtime_pb2
+
+import fast_json
+import http_utils
+import memory_usage
+from arrivals import ArrivalEngine, ArrivalSubscription
+from event_log import FeedEventDetector
+from gtfs_static import StaticFeed
+from memory_usage import deep_size
+from realtime_feed import FeedSnapshot
+from rtd_client import RTDClient
+
+
+def timed(fn, repeat=20):
+    """Best-of-N wall time of fn() in milliseconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def synthetic_vehicles(count, seed=1):
+    """Vehicle dictionaries shaped like /api/vehicles?include_stops=true"""
+    rnd = random.Random(seed)
+    routes = ['A', 'B', 'D', 'E', 'H', 'R', 'W', '0', '15', '15L', '16', '20', 'FF1', 'FREE']
+    vehicles = []
+    for i in range(count):
+        lat = 39.6 + rnd.random() * 0.3
+        lng = -105.2 + rnd.random() * 0.4
+        vehicles.append({
+            'vehicle_id': f'{6000 + i}',
+            'route_id': rnd.choice(routes),
+            'trip_id': f'{115000000 + rnd.randint(0, 99999)}',
+            'latitude': lat,
+            'longitude': lng,
+            'bearing': rnd.random() * 360,
+            'speed': rnd.random() * 15,
+            'timestamp': 1700000000 + rnd.randint(0, 60),
+            'closest_stop': {
+                'stop_id': str(rnd.randint(10000, 35000)),
+                'stop_name': f'Colfax Ave & {rnd.randint(1, 200)}th St',
+                'stop_latitude': lat + 0.001,
+                'stop_longitude': lng - 0.001,
+                'distance_miles': round(rnd.random() * 0.3, 3),
+                'distance_meters': round(rnd.random() * 500, 1)
+            }
+        })
+    return vehicles
+
+
+def bench_encoding():
+    """JSON backends, compression codecs and array streaming"""
+    print("\n" + "="*80)
+    print("📦 Response encoding")
+    print("="*80)
+
+    for count in (500, 2000):
+        vehicles = synthetic_vehicles(count)
+        payload = {'success': True, 'count': count, 'vehicles': vehicles}
+
+        print(f"\n🚌 {count} vehicles")
+        body = None
+        for name, dumps in sorted(fast_json.BACKENDS.items()):
+            body = dumps(payload)
+            print(f"   {name:<8} encode: {timed(lambda: dumps(payload)):7.2f} ms   {len(body):>9,} bytes")
+        pretty = json.dumps(payload, indent=2)
+        print(f"   {'indent=2':<8} encode: {timed(lambda: json.dumps(payload, indent=2)):7.2f} ms   {len(pretty):>9,} bytes  (old debug-mode jsonify)")
+
+        for level in (1, 6, 9):
+            size = len(gzip.compress(body, level))
+            print(f"   gzip -{level}  compress: {timed(lambda: gzip.compress(body, level), 5):7.2f} ms   {size:>9,} bytes  ({size / len(body):.1%})")
+        if http_utils.brotli is not None:
+            for quality in (1, 5, 9):
+                size = len(http_utils.brotli.compress(body, quality=quality))
+                print(f"   br q{quality}     compress: {timed(lambda: http_utils.brotli.compress(body, quality=quality), 5):7.2f} ms   {size:>9,} bytes  ({size / len(body):.1%})")
+        else:
+            print("   br        (install 'brotli' to enable)")
+
+    # Serving a cached SerializedResponse vs encoding per request
+    app = Flask(__name__)
+    http_utils.setup_responses(app)
+    vehicles = synthetic_vehicles(2000)
+    payload = {'success': True, 'count': len(vehicles), 'vehicles': vehicles}
+    with app.test_request_context('/', headers={'Accept-Encoding': 'gzip'}):
+        cached = http_utils.SerializedResponse(payload)
+        cached.to_response()
+        per_request = timed(lambda: http_utils.compress(fast_json.encode_json(payload), 'gzip'), 5)
+        reuse = timed(lambda: cached.to_response(), 200)
+        streamed = timed(lambda: b''.join(http_utils.stream_json(dict(payload), 'vehicles').response), 5)
+    print("\n♻️  2000 vehicles per request")
+    print(f"   encode + gzip every request: {per_request:7.2f} ms")
+    print(f"   cached SerializedResponse:   {reuse:7.3f} ms")
+    print(f"   stream_json (uncompressed):  {streamed:7.2f} ms")
+
+
+def synthetic_vehicle_feed(vehicles):
+    """VehiclePosition FeedMessage bytes for synthetic vehicle dictionaries"""
+    message = gtfs_realtime_pb2.FeedMessage()
+    message.header.gtfs_realtime_version = '2.0'
+    message.header.timestamp = 1700000000
+    for i, v in enumerate(vehicles):
+        entity = message.entity.add()
+        entity.id = str(i)
+        entity.vehicle.vehicle.id = v['vehicle_id']
+        entity.vehicle.trip.route_id = v['route_id']
+        entity.vehicle.trip.trip_id = v['trip_id']
+        entity.vehicle.position.latitude = v['latitude']
+        entity.vehicle.position.longitude = v['longitude']
+        entity.vehicle.position.bearing = v['bearing']
+        entity.vehicle.position.speed = v['speed']
+        entity.vehicle.timestamp = v['timestamp']
+    return message.SerializeToString()
+
+
+def bench_formats():
+    """Response size and encode/decode time of the binary formats against JSON"""
+    print("\n" + "="*80)
+    print("🧮 Response formats (vehicle positions, no closest stops)")
+    print("="*80)
+
+    for count in (500, 2000):
+        vehicles = synthetic_vehicles(count)
+        for v in vehicles:
+            del v['closest_stop']
+        payload = {'success': True, 'count': count, 'vehicles': vehicles}
+        snapshot = FeedSnapshot('VehiclePosition.pb', synthetic_vehicle_feed(vehicles))
+        routes = {'A', 'B', '15'}
+
+        def subset():
+            return snapshot.subset(lambda e: e.vehicle.trip.route_id in routes).SerializeToString()
+
+        def parse_feed(data):
+            message = gtfs_realtime_pb2.FeedMessage()
+            message.ParseFromString(data)
+            return message
+
+        rows = []
+        for name, dumps in sorted(fast_json.BACKENDS.items()):
+            body = dumps(payload)
+            rows.append((f'json ({name})', timed(lambda: dumps(payload)), body, timed(lambda: json.loads(body))))
+        if http_utils.msgpack is not None:
+            msgpack = http_utils.msgpack
+            body = msgpack.packb(payload, use_bin_type=True)
+            rows.append(('msgpack', timed(lambda: msgpack.packb(payload, use_bin_type=True)), body,
+                         timed(lambda: msgpack.unpackb(body))))
+        body = snapshot.message.SerializeToString()
+        rows.append(('protobuf', timed(lambda: snapshot.message.SerializeToString()), body,
+                     timed(lambda: parse_feed(body))))
+        filtered = subset()
+        rows.append(('protobuf 3 routes', timed(subset), filtered, timed(lambda: parse_feed(filtered))))
+
+        print(f"\n🚌 {count} vehicles")
+        print(f"   {'format':<18} {'encode':>9} {'decode':>9} {'bytes':>10} {'gzip':>9}")
+        for name, encode_ms, body, decode_ms in rows:
+            print(f"   {name:<18} {encode_ms:6.2f} ms {decode_ms:6.2f} ms {len(body):>10,} {len(gzip.compress(body, 6)):>9,}")
+        if http_utils.msgpack is None:
+            print("   msgpack            (install 'msgpack' to enable)")
+
+
+def synthetic_trip_update_feed(trips, stops_per_trip=30, timestamp=1700000000, seed=1):
+    """TripUpdate FeedMessage bytes: trips on 100 routes, each predicting its next stops"""
+    rnd = random.Random(seed)
+    message = gtfs_realtime_pb2.FeedMessage()
+    message.header.gtfs_realtime_version = '2.0'
+    message.header.timestamp = timestamp
+    for i in range(trips):
+        entity = message.entity.add()
+        entity.id = str(i)
+        route = i % 100
+        entity.trip_update.trip.trip_id = f'{115000000 + i}'
+        entity.trip_update.trip.route_id = str(route)
+        entity.trip_update.vehicle.id = f'{6000 + i}'
+        first = rnd.randint(0, 200)
+        arrival = timestamp + rnd.randint(0, 300)
+        for k in range(stops_per_trip):
+            stu = entity.trip_update.stop_time_update.add()
+            stu.stop_id = str(10000 + route * 200 + first + k)
+            stu.arrival.delay = rnd.randint(-60, 600)
+            stu.arrival.time = arrival
+            arrival += rnd.randint(60, 180)
+    return message.SerializeToString()
+
+
+def bench_arrivals():
+    """Evaluating arrival subscriptions against a TripUpdate snapshot"""
+    print("\n" + "="*80)
+    print("⏰ Arrival subscriptions (1,500 trips x 30 predicted stops, 100 routes)")
+    print("="*80)
+
+    feed = synthetic_trip_update_feed(1500)
+    client = RTDClient()
+    parse = timed(lambda: list(client.iter_records(FeedSnapshot('TripUpdate.pb', feed))), 5)
+    print(f"\n   parse only:       {parse:7.2f} ms")
+    rnd = random.Random(2)
+    for count in (10000, 100000):
+        detector = FeedEventDetector(RTDClient())
+        engine = ArrivalEngine(detector, path=':memory:')
+        # Bypass SQLite: only the in-memory index matters here
+        # Stops each route's trips predict (see synthetic_trip_update_feed)
+        engine._insert_many(
+            ArrivalSubscription(str(i), 'bench', str(route), str(10000 + route * 200 + rnd.randrange(230)),
+                                rnd.randint(1, 15))
+            for i, route in ((i, rnd.randrange(100)) for i in range(count))
+        )
+
+        def evaluate():
+            # A new snapshot object each time, so parsing is included
+            engine._fired = {}
+            engine.evaluate(FeedSnapshot('TripUpdate.pb', feed))
+
+        best = timed(evaluate, 5)
+        before = detector.log.last_id
+        evaluate()
+        fired = detector.log.last_id - before
+        repeat = timed(lambda: engine.evaluate(FeedSnapshot('TripUpdate.pb', feed)), 5)
+        kept = detector.log.last_id - max(detector.log.oldest_id, before + 1) + 1
+        print(f"\n👥 {count:,} subscriptions")
+        print(f"   first snapshot:   {best:7.2f} ms   {fired:,} events "
+              f"({kept:,} kept, max_events {detector.log.max_events:,})")
+        print(f"   same trips again: {repeat:7.2f} ms   {detector.log.last_id - before - fired} events (once per trip)")
+
+
+def synthetic_static_feed(stops=8100, seed=1):
+    """google_transit.zip bytes with RTD-like stops.txt and routes.txt"""
+    rnd = random.Random(seed)
+    streets = ['Colfax Ave', 'Broadway', 'Federal Blvd', 'Colorado Blvd', 'Alameda Ave', 'Speer Blvd',
+               'Sheridan Blvd', 'Wadsworth Blvd', 'Havana St', 'Peoria St', 'Evans Ave', 'Hampden Ave']
+    lines = ['stop_id,stop_code,stop_name,stop_desc,stop_lat,stop_lon,zone_id,stop_url,location_type,'
+             'parent_station,stop_timezone,wheelchair_boarding']
+    for i in range(stops):
+        stop_id = 10000 + i
+        name = f'{rnd.choice(streets)} & {rnd.randint(1, 120)}th St'
+        direction = rnd.choice(['Northbound', 'Southbound', 'Eastbound', 'Westbound'])
+        lines.append(f'{stop_id},{stop_id},{name},Vehicles Travelling {direction},'
+                     f'{39.6 + rnd.random() * 0.3:.6f},{-105.2 + rnd.random() * 0.4:.6f},'
+                     f'{rnd.choice(["A", "B", "C"])},,0,,America/Denver,{rnd.randint(0, 1)}')
+    routes = ['route_id,agency_id,route_short_name,route_long_name,route_type']
+    routes += [f'{r},RTD,{r},Route {r},3' for r in range(100)]
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('stops.txt', '\n'.join(lines) + '\n')
+        z.writestr('routes.txt', '\n'.join(routes) + '\n')
+    return buffer.getvalue()
+
+
+def bench_memory():
+    """Size of the stops table and a parsed TripUpdate snapshot, with and without shared strings"""
+    print("\n" + "="*80)
+    print("🧠 Memory (8,100 stops; 1,500 trips x 30 predicted stops)")
+    print("="*80)
+
+    static = synthetic_static_feed()
+    trip_updates = synthetic_trip_update_feed(1500)
+
+    def traced(fn):
+        """(value, bytes left allocated by fn, ms) under tracemalloc"""
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            value = fn()
+            elapsed = (time.perf_counter() - start) * 1000
+            return value, tracemalloc.get_traced_memory()[0] - before, elapsed
+        finally:
+            tracemalloc.stop()
+
+    print(f"\n   {'':<22} {'strings':<9} {'retained':>12} {'allocated':>12} {'objects':>9} {'build':>10}")
+    results = {}
+    for shared in (False, True):
+        memory_usage.SHARE_STRINGS = shared
+        feed = StaticFeed(static)
+        stops, allocated, elapsed = traced(lambda: feed.table('stops.txt'))
+        size, count = deep_size(stops)
+        results[('stops', shared)] = size
+        label = 'shared' if shared else 'copied'
+        print(f"   {'stops table':<22} {label:<9} {size:>12,} {allocated:>12,} {count:>9,} {elapsed:7.2f} ms")
+
+        client = RTDClient()
+        client._static_feed = feed
+        snapshot = FeedSnapshot('TripUpdate.pb', trip_updates)
+        updates, allocated, elapsed = traced(lambda: client._snapshot_trip_updates(snapshot))
+        # Ids found in the stops table are not retained by the snapshot itself
+        size, count = deep_size([updates, feed.ids])
+        size -= deep_size(feed.ids)[0]
+        results[('snapshot', shared)] = size
+        print(f"   {'trip update snapshot':<22} {label:<9} {size:>12,} {allocated:>12,} {count:>9,} {elapsed:7.2f} ms")
+        parse = timed(lambda: client._parse_trip_updates(snapshot.message), 5)
+        print(f"   {'':<22} {'':<9} {'':>12} {'':>12} {'':>9} {parse:7.2f} ms best of 5")
+    memory_usage.SHARE_STRINGS = True
+    for name in ('stops', 'snapshot'):
+        before, after = results[(name, False)], results[(name, True)]
+        print(f"\n   {name}: {before:,} -> {after:,} bytes ({(before - after) / before:.0%} smaller)")
+
+
+BENCHMARKS = {
+    'encoding': bench_encoding,
+    'formats': bench_formats,
+    'arrivals': bench_arrivals,
+    'memory': bench_memory,
+}
+
+
+if __name__ == "__main__":
+    selected = sys.argv[1:] or list(BENCHMARKS)
+    for name in selected:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark '{name}'. Choose from: {', '.join(BENCHMARKS)}")
+            sys.exit(1)
+        BENCHMARKS[name]()
+    print()
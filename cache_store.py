@@ -0,0 +1,252 @@
+"""
+Cache Stores
+Small caches used by the API clients: an in-memory LRU, a persistent
+SQLite-backed store that can be shared between processes, and hit/miss
+accounting.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+def default_cache_dir() -> str:
+    """Directory for persistent caches (RTD_CACHE_DIR or ~/.cache/rtd)"""
+    return os.environ.get('RTD_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'rtd')
+
+
+def normalize_key(text: str) -> str:
+    """
+    Normalize a free-text location for use in a cache key
+
+    Case, repeated whitespace and spacing around commas are ignored, so
+    "Union Station,  Denver, CO" and "union station, denver,co" share a key.
+    Signs and decimal points are kept so coordinates stay distinct.
+    """
+    text = ' '.join((text or '').lower().split())
+    return re.sub(r'\s*,\s*', ',', text).strip(' ,.')
+
+
+class CacheStats:
+    """
+    Hit/miss counters for a cache in front of an upstream call
+
+    Upstream latency is tracked on misses so that each hit can be credited
+    with the time it saved (the running average miss latency).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.upstream_calls = 0
+        self.upstream_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def record_hit(self):
+        with self._lock:
+            self.hits += 1
+            if self.upstream_calls:
+                self.saved_seconds += self.upstream_seconds / self.upstream_calls
+
+    def record_miss(self, upstream_seconds: Optional[float] = None):
+        with self._lock:
+            self.misses += 1
+            if upstream_seconds is not None:
+                self.upstream_calls += 1
+                self.upstream_seconds += upstream_seconds
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        avg = self.upstream_seconds / self.upstream_calls if self.upstream_calls else None
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hit_ratio, 4),
+            'avg_upstream_ms': round(avg * 1000, 1) if avg is not None else None,
+            'saved_seconds': round(self.saved_seconds, 3)
+        }
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory cache with a size cap and optional TTL
+
+    The least recently used entry is evicted once max_entries is reached.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: Optional[float] = None):
+        """
+        Args:
+            max_entries: Size cap
+            ttl: Seconds before an entry expires (None = never)
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Get a cached value
+
+        Returns:
+            The stored value, or None if missing or expired
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, stored_at = entry
+            if self.ttl is not None and time.time() - stored_at > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        """Store a value, evicting the least recently used entry if full"""
+        with self._lock:
+            self._data[key] = (value, time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        """Remove an entry"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class DiskCache:
+    """
+    Persistent key/value cache stored in SQLite
+
+    Values must be JSON-serializable. Entries expire after ttl seconds and
+    the least recently used entries are evicted once max_entries is
+    exceeded. Several processes can share one file; SQLite handles the
+    locking.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        namespace: str = 'default',
+        ttl: Optional[float] = None,
+        max_entries: int = 10000
+    ):
+        """
+        Args:
+            path: SQLite database file (created if missing)
+            namespace: Table name, so several caches can share one file
+            ttl: Seconds before an entry expires (None = never)
+            max_entries: Size cap; least recently used entries are evicted
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.table = 'cache_' + ''.join(c if c.isalnum() else '_' for c in namespace)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+
+        with self._connect() as conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_accessed ON {self.table} (accessed_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections cannot be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Get a cached value
+
+        Returns:
+            The stored value, or None if missing or expired
+        """
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                f"SELECT value, created_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            now = time.time()
+            if self.ttl is not None and now - row[1] > self.ttl:
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                return None
+
+            conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+            return json.loads(row[0])
+        except sqlite3.Error as e:
+            print(f"Cache read error ({self.path}): {e}")
+            return None
+
+    def set(self, key: str, value: Any):
+        """Store a value, evicting least recently used entries if over the cap"""
+        try:
+            conn = self._connect()
+            now = time.time()
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now)
+            )
+            self._writes += 1
+            # Counting rows on every write is wasteful - check periodically
+            if self._writes % 50 == 0 or self.max_entries < 50:
+                self._evict(conn)
+        except sqlite3.Error as e:
+            print(f"Cache write error ({self.path}): {e}")
+
+    def _evict(self, conn: sqlite3.Connection):
+        if self.ttl is not None:
+            conn.execute(f"DELETE FROM {self.table} WHERE created_at < ?", (time.time() - self.ttl,))
+        count = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        if count > self.max_entries:
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f"SELECT key FROM {self.table} ORDER BY accessed_at LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def delete(self, key: str):
+        """Remove an entry"""
+        self._connect().execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def clear(self):
+        """Remove all entries"""
+        self._connect().execute(f"DELETE FROM {self.table}")
+
+    def __len__(self) -> int:
+        return self._connect().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
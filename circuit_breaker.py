@@ -0,0 +1,102 @@
+"""
+Circuit Breaker
+Stops calling an upstream that keeps failing, and probes it again after a
+cool-down
+"""
+
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open"""
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open breaker for one upstream
+
+    While closed every call is allowed. failure_threshold failures in a row
+    open the circuit: calls are refused (no request, no timeout to wait
+    out) until reset_timeout has passed. Then a single probe call is let
+    through (half-open); its success closes the circuit, its failure opens
+    it for another reset_timeout.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        """
+        Args:
+            failure_threshold: Consecutive failures that open the circuit
+            reset_timeout: Seconds the circuit stays open before a probe
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.times_opened = 0
+        self.refused = 0
+        self._lock = threading.Lock()
+
+    def ready(self) -> bool:
+        """Whether allow() would let a call through (without claiming the probe)"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            return self.state == self.OPEN and time.time() - self.opened_at >= self.reset_timeout
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go ahead now
+
+        After the cool-down the first caller gets True and becomes the probe;
+        others are refused until it reports back.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            self.refused += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self, error: Any = None):
+        with self._lock:
+            self.failures += 1
+            if error is not None:
+                self.last_error = error if isinstance(error, str) else f'{type(error).__name__}: {error}'
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self.opened_at = time.time()
+
+    def retry_in(self) -> float:
+        """Seconds until the next probe is allowed (0 when closed)"""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.opened_at + self.reset_timeout - time.time())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'times_opened': self.times_opened,
+            'refused_calls': self.refused,
+            'retry_in_seconds': round(self.retry_in(), 1),
+            'last_error': self.last_error,
+        }
@@ -0,0 +1,352 @@
+"""
+Feed Event Log
+Change events detected between realtime feed versions, kept in a bounded
+log that clients read incrementally with a cursor (the last event id seen)
+"""
+
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+VEHICLE_APPEARED = 'vehicle_appeared'
+ROUTE_STARTED = 'route_started'
+ALERT_CREATED = 'alert_created'
+DELAY_EXCEEDED = 'delay_exceeded'
+GEOFENCE_ENTER = 'geofence_enter'
+GEOFENCE_EXIT = 'geofence_exit'
+ARRIVAL_SOON = 'arrival_soon'
+
+# Feed file -> event types detected from it
+FEED_EVENTS = {
+    'VehiclePosition.pb': (VEHICLE_APPEARED, ROUTE_STARTED, GEOFENCE_ENTER, GEOFENCE_EXIT),
+    'TripUpdate.pb': (DELAY_EXCEEDED, ARRIVAL_SOON),
+    'Alert.pb': (ALERT_CREATED,),
+}
+EVENT_TYPES = tuple(t for types in FEED_EVENTS.values() for t in types)
+# Event type -> feed file it is detected from
+EVENT_FEEDS = {t: feed_file for feed_file, types in FEED_EVENTS.items() for t in types}
+
+DEFAULT_DELAY_THRESHOLD = 300   # Seconds late before a delay_exceeded event
+
+
+class EventLog:
+    """
+    Append-only log of events with increasing integer ids
+
+    Only the newest max_events are kept (more while a larger burst from
+    extend() is recent). Because ids are consecutive, the
+    position of a cursor is found by arithmetic, so reading what is new
+    costs time proportional to the events returned, not the log size.
+    """
+
+    def __init__(self, max_events: int = 10000):
+        """
+        Args:
+            max_events: Number of events kept (older ones are dropped)
+        """
+        self.max_events = max_events
+        # (first id, size) of the last burst added by extend()
+        self._burst = (0, 0)
+        self._events: List[Dict[str, Any]] = []
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def append(self, event_type: str, data: Dict[str, Any], timestamp: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Add an event
+
+        Args:
+            event_type: One of EVENT_TYPES (or any other label)
+            data: Event fields
+            timestamp: When the event happened (default: now)
+
+        Returns:
+            The stored event: data plus 'id', 'type' and ISO 'time'
+        """
+        with self._lock:
+            event = {
+                'id': self._next_id,
+                'type': event_type,
+                'time': datetime.fromtimestamp(timestamp or time.time()).isoformat(timespec='seconds'),
+            }
+            event.update(data)
+            self._next_id += 1
+            self._events.append(event)
+            self._trim()
+            self._changed.notify_all()
+        return event
+
+    def _trim(self):
+        # The newest max_events, or the whole last burst and everything after
+        # it until max_events newer events have followed it
+        keep = self.max_events
+        first, size = self._burst
+        since_burst = self._next_id - first
+        if since_burst - size < self.max_events:
+            keep = max(keep, since_burst)
+        # Trim in batches so appends stay O(1) amortized
+        if len(self._events) > keep + self.max_events // 10:
+            del self._events[:len(self._events) - keep]
+
+    def extend(self, event_type: str, items: Iterable[Dict[str, Any]],
+               timestamp: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Add a burst of events of one type together
+
+        Unlike repeated append() calls, trimming keeps the whole burst, even
+        beyond max_events, until max_events newer events have been added or
+        the next burst comes, so readers catching up after it lose none.
+
+        Args:
+            event_type: One of EVENT_TYPES (or any other label)
+            items: Event fields, one dictionary per event
+            timestamp: When the events happened (default: now)
+
+        Returns:
+            The stored events
+        """
+        stamp = datetime.fromtimestamp(timestamp or time.time()).isoformat(timespec='seconds')
+        with self._lock:
+            events = []
+            for data in items:
+                event = {'id': self._next_id, 'type': event_type, 'time': stamp}
+                event.update(data)
+                self._next_id += 1
+                events.append(event)
+            if not events:
+                return events
+            self._events.extend(events)
+            self._burst = (events[0]['id'], len(events))
+            self._trim()
+            self._changed.notify_all()
+        return events
+
+    def wait(self, cursor: int, timeout: float) -> bool:
+        """
+        Block until an event newer than cursor is added
+
+        Returns:
+            True if there are newer events, False on timeout
+        """
+        with self._changed:
+            return self._changed.wait_for(lambda: self._next_id - 1 > cursor, timeout)
+
+    @property
+    def last_id(self) -> int:
+        """Id of the newest event (0 if none yet)"""
+        return self._next_id - 1
+
+    @property
+    def oldest_id(self) -> int:
+        """Id of the oldest event still kept (last_id + 1 if empty)"""
+        with self._lock:
+            return self._events[0]['id'] if self._events else self._next_id
+
+    def since(
+        self,
+        cursor: Optional[int] = None,
+        types: Optional[Iterable[str]] = None,
+        limit: int = 100,
+        match: Optional[Callable[[Dict[str, Any]], bool]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Read events newer than a cursor
+
+        Args:
+            cursor: Last event id the caller has seen; None returns the most
+                    recent matching events
+            types: Event types to include (default: all)
+            limit: Maximum number of events
+            match: Optional extra filter function(event) -> bool
+
+        Returns:
+            Matching events, oldest first. With a cursor these are the first
+            `limit` events after it; without one, the newest `limit`.
+        """
+        types = set(types) if types is not None else None
+
+        def wanted(event):
+            return (types is None or event['type'] in types) and (match is None or match(event))
+
+        with self._lock:
+            if cursor is None:
+                found = []
+                for event in reversed(self._events):
+                    if wanted(event):
+                        found.append(event)
+                        if len(found) >= limit:
+                            break
+                return found[::-1]
+
+            start = 0
+            if self._events:
+                start = max(0, min(cursor - self._events[0]['id'] + 1, len(self._events)))
+            found = []
+            for event in self._events[start:]:
+                if wanted(event):
+                    found.append(event)
+                    if len(found) >= limit:
+                        break
+            return found
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'events': len(self._events),
+                'oldest_id': self._events[0]['id'] if self._events else self._next_id,
+                'last_id': self._next_id - 1,
+            }
+
+
+class FeedEventDetector:
+    """
+    Turns successive realtime snapshots into events
+
+    Each feed is diffed against the previous version seen: vehicles and
+    routes that appear, alerts with a new id, and trips whose delay rises
+    past delay_threshold (again after dropping back below it). The first
+    version of a feed only sets the baseline, so starting the server does
+    not emit an event for everything already running.
+    """
+
+    def __init__(self, rtd_client, log: Optional[EventLog] = None, delay_threshold: int = DEFAULT_DELAY_THRESHOLD):
+        """
+        Args:
+            rtd_client: RTDClient to read snapshots from
+            log: EventLog to append to (default: a new one)
+            delay_threshold: Seconds late that triggers delay_exceeded
+        """
+        self.rtd_client = rtd_client
+        self.log = log if log is not None else EventLog()
+        self.delay_threshold = delay_threshold
+        self._versions: Dict[str, str] = {}
+        self._state: Dict[str, Dict[str, set]] = {}
+        self._observers: Dict[str, List[Callable]] = {}
+        self._checked_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add_observer(self, feed_file: str, observer: Callable):
+        """
+        Call observer(snapshot) for each new version of a feed
+
+        Observers run after the built-in diff, baseline versions included,
+        and may append their own events to the log (e.g. geofences).
+        """
+        self._observers.setdefault(feed_file, []).append(observer)
+
+    def update(self, feed_files: Iterable[str] = tuple(FEED_EVENTS), min_interval: float = 0) -> bool:
+        """
+        Fetch the current snapshot of each feed and record any new events
+
+        Cheap when a feed has not changed since the last call.
+
+        Args:
+            feed_files: Feeds to check
+            min_interval: Skip feeds checked less than this many seconds ago
+                          (lets many long-lived clients share one download)
+
+        Returns:
+            False if any feed could not be fetched
+        """
+        ok = True
+        now = time.time()
+        for feed_file in feed_files:
+            if min_interval and now - self._checked_at.get(feed_file, 0) < min_interval:
+                continue
+            self._checked_at[feed_file] = now
+            snapshot = self.rtd_client.get_snapshot(feed_file)
+            if snapshot is None:
+                ok = False
+                continue
+            self.observe(snapshot)
+        return ok
+
+    def observe(self, snapshot):
+        """Diff a snapshot against the previous version of its feed"""
+        with self._lock:
+            if self._versions.get(snapshot.feed_file) == snapshot.version:
+                return
+            diff = {
+                'VehiclePosition.pb': self._diff_vehicles,
+                'TripUpdate.pb': self._diff_trip_updates,
+                'Alert.pb': self._diff_alerts,
+            }[snapshot.feed_file]
+            baseline = snapshot.feed_file not in self._versions
+            self._state[snapshot.feed_file] = diff(snapshot, self._state.get(snapshot.feed_file), baseline)
+            self._versions[snapshot.feed_file] = snapshot.version
+            for observer in self._observers.get(snapshot.feed_file, ()):
+                observer(snapshot)
+
+    def _diff_vehicles(self, snapshot, previous, baseline):
+        vehicles = self.rtd_client.get_vehicle_positions(snapshot) or []
+        state = {
+            'vehicles': {v['vehicle_id'] for v in vehicles if v['vehicle_id']},
+            'routes': {v['route_id'] for v in vehicles if v['route_id']},
+        }
+        if baseline:
+            return state
+
+        route_counts: Dict[str, int] = {}
+        for v in vehicles:
+            if v['route_id']:
+                route_counts[v['route_id']] = route_counts.get(v['route_id'], 0) + 1
+        for route_id in sorted(state['routes'] - previous['routes']):
+            self.log.append(ROUTE_STARTED, {
+                'route_id': route_id,
+                'vehicle_count': route_counts[route_id],
+            }, snapshot.timestamp)
+        for v in vehicles:
+            if v['vehicle_id'] and v['vehicle_id'] not in previous['vehicles']:
+                self.log.append(VEHICLE_APPEARED, v, snapshot.timestamp)
+        return state
+
+    def _diff_trip_updates(self, snapshot, previous, baseline):
+        delayed = set()
+        for update in self.rtd_client.iter_records(snapshot):
+            delay, stop_id = current_delay(update)
+            if delay is None or delay < self.delay_threshold or not update['trip_id']:
+                continue
+            delayed.add(update['trip_id'])
+            if not baseline and update['trip_id'] not in previous['delayed']:
+                self.log.append(DELAY_EXCEEDED, {
+                    'trip_id': update['trip_id'],
+                    'route_id': update['route_id'],
+                    'vehicle_id': update['vehicle_id'],
+                    'stop_id': stop_id,
+                    'delay_seconds': delay,
+                    'threshold_seconds': self.delay_threshold,
+                }, snapshot.timestamp)
+        return {'delayed': delayed}
+
+    def _diff_alerts(self, snapshot, previous, baseline):
+        alerts = self.rtd_client.get_alerts(snapshot) or []
+        state = {'alerts': {a['id'] for a in alerts}}
+        if not baseline:
+            for alert in alerts:
+                if alert['id'] not in previous['alerts']:
+                    data = dict(alert, alert_id=alert['id'])
+                    del data['id']
+                    self.log.append(ALERT_CREATED, data, snapshot.timestamp)
+        return state
+
+
+def visible_to(owner: str, event: Dict[str, Any]) -> bool:
+    """Whether an event may be shown to owner (events with an 'owner' are private to it)"""
+    return event.get('owner', owner) == owner
+
+
+def current_delay(update: Dict[str, Any]):
+    """
+    Delay of a trip at its next stop
+
+    Returns:
+        (delay_seconds, stop_id) from the first stop time update that has a
+        delay, or (None, None)
+    """
+    for stu in update['stop_time_updates']:
+        delay = stu['arrival_delay'] if stu['arrival_delay'] is not None else stu['departure_delay']
+        if delay is not None:
+            return delay, stu['stop_id']
+    return None, None
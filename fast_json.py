@@ -0,0 +1,111 @@
+"""
+Fast JSON Encoding
+Pluggable JSON backends for the Flask apps. orjson is used when installed;
+the standard library encoder is the fallback.
+"""
+
+import json
+import os
+import time
+from typing import Any, Callable, Dict, Optional
+
+from flask import current_app, g
+from flask.json.provider import DefaultJSONProvider
+
+from tracing import span
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _stdlib_dumps(obj: Any) -> bytes:
+    return json.dumps(
+        obj, default=DefaultJSONProvider.default, ensure_ascii=False,
+        separators=(',', ':'), sort_keys=True
+    ).encode('utf-8')
+
+
+def _orjson_dumps(obj: Any) -> bytes:
+    return orjson.dumps(
+        obj, default=DefaultJSONProvider.default,
+        option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+    )
+
+
+# name -> function(obj) returning UTF-8 JSON bytes. Keys are sorted so equal
+# payloads encode identically whichever backend is active.
+BACKENDS: Dict[str, Callable[[Any], bytes]] = {'json': _stdlib_dumps}
+if orjson is not None:
+    BACKENDS['orjson'] = _orjson_dumps
+
+
+def register_backend(name: str, dumps: Callable[[Any], bytes]):
+    """
+    Add a JSON backend
+
+    Args:
+        name: Backend name (selectable with RTD_JSON_BACKEND)
+        dumps: Function taking a value and returning UTF-8 JSON bytes
+    """
+    BACKENDS[name] = dumps
+
+
+def default_backend() -> str:
+    """RTD_JSON_BACKEND if set, else the fastest installed backend"""
+    name = os.environ.get('RTD_JSON_BACKEND')
+    if name in BACKENDS:
+        return name
+    return 'orjson' if 'orjson' in BACKENDS else 'json'
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider that encodes with a pluggable backend
+
+    jsonify() and Flask responses go through encode(), which falls back to
+    the standard library for values the fast backend rejects (e.g. integers
+    over 64 bits). Time spent encoding is added to g.encode_seconds so it
+    can be reported per request.
+    """
+
+    backend: Optional[str] = None
+
+    def encode(self, obj: Any) -> bytes:
+        """Encode a value to compact UTF-8 JSON bytes"""
+        dumps = BACKENDS[self.backend or default_backend()]
+        start = time.perf_counter()
+        with span('serialize', format='json') as s:
+            try:
+                data = dumps(obj)
+            except TypeError:
+                data = _stdlib_dumps(obj)
+            s.set(bytes=len(data))
+        _record_encode_time(time.perf_counter() - start)
+        return data
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.encode(obj).decode('utf-8')
+
+    def response(self, *args: Any, **kwargs: Any):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.encode(obj) + b'\n', mimetype=self.mimetype)
+
+
+def _record_encode_time(seconds: float):
+    try:
+        g.encode_seconds = g.get('encode_seconds', 0.0) + seconds
+    except RuntimeError:
+        # Outside a request (e.g. benchmarks)
+        pass
+
+
+def encode_json(obj: Any) -> bytes:
+    """Encode with the current app's JSON provider (as jsonify would)"""
+    provider = current_app.json
+    if isinstance(provider, FastJSONProvider):
+        return provider.encode(obj)
+    return provider.dumps(obj).encode('utf-8')
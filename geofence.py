@@ -0,0 +1,262 @@
+"""
+Geofences
+Circles and polygons checked against every vehicle snapshot, producing
+enter/exit events in the feed event log
+
+Fences are bucketed into a grid, so each vehicle is only tested against the
+few fences whose bounding box covers its cell: the cost of a snapshot grows
+with vehicles x nearby fences rather than vehicles x all fences.
+"""
+
+import json
+import math
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from cache_store import default_cache_dir
+from event_log import GEOFENCE_ENTER, GEOFENCE_EXIT
+from spatial_index import METERS_PER_DEGREE_LAT, Shape
+
+MAX_CELLS_PER_FENCE = 10000     # Larger fences are rejected
+
+
+class Geofence:
+    """A registered area, optionally limited to some routes"""
+
+    def __init__(self, fence_id: str, owner: str, shape: Shape, routes: Optional[Iterable[str]] = None,
+                 name: str = '', created_at: Optional[float] = None):
+        self.id = fence_id
+        self.owner = owner
+        self.shape = shape
+        self.routes: Optional[Set[str]] = set(routes) if routes else None
+        self.name = name
+        self.created_at = created_at or time.time()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'name': self.name,
+            'shape': self.shape.to_dict(),
+            'routes': sorted(self.routes) if self.routes else None,
+        }
+
+
+class FenceIndex:
+    """
+    Fences bucketed into a uniform lat/lng grid
+
+    A fence is listed in every cell its bounding box overlaps, so looking up
+    a point returns a small superset of the fences that contain it.
+    """
+
+    def __init__(self, cell_size_m: float = 1000, reference_lat: float = 39.74):
+        """
+        Args:
+            cell_size_m: Approximate cell edge length in meters
+            reference_lat: Latitude used to size cells east-west (default: Denver)
+        """
+        self.cell_lat = cell_size_m / METERS_PER_DEGREE_LAT
+        self.cell_lng = cell_size_m / (METERS_PER_DEGREE_LAT * math.cos(math.radians(reference_lat)))
+        self._cells: Dict[Tuple[int, int], Set[str]] = defaultdict(set)
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return (int(math.floor(lat / self.cell_lat)), int(math.floor(lng / self.cell_lng)))
+
+    def cell_count(self, shape: Shape) -> int:
+        """Number of grid cells cells() would return, without listing them"""
+        min_lat, min_lng, max_lat, max_lng = shape.bbox
+        row0, col0 = self._cell(min_lat, min_lng)
+        row1, col1 = self._cell(max_lat, max_lng)
+        return (row1 - row0 + 1) * (col1 - col0 + 1)
+
+    def cells(self, shape: Shape) -> List[Tuple[int, int]]:
+        """Grid cells overlapping a shape's bounding box"""
+        min_lat, min_lng, max_lat, max_lng = shape.bbox
+        row0, col0 = self._cell(min_lat, min_lng)
+        row1, col1 = self._cell(max_lat, max_lng)
+        return [(row, col) for row in range(row0, row1 + 1) for col in range(col0, col1 + 1)]
+
+    def add(self, fence_id: str, shape: Shape):
+        for cell in self.cells(shape):
+            self._cells[cell].add(fence_id)
+
+    def remove(self, fence_id: str, shape: Shape):
+        for cell in self.cells(shape):
+            members = self._cells.get(cell)
+            if members is not None:
+                members.discard(fence_id)
+                if not members:
+                    del self._cells[cell]
+
+    def candidates(self, lat: float, lng: float) -> Set[str]:
+        """Fences that may contain a point"""
+        return self._cells.get(self._cell(lat, lng), set())
+
+
+class GeofenceEngine:
+    """
+    Evaluates geofences against each new VehiclePosition snapshot
+
+    Each vehicle's set of containing fences is kept between snapshots; a
+    fence gaining a vehicle logs geofence_enter and losing one logs
+    geofence_exit. The first snapshot only records where vehicles are, and
+    vehicles that drop out of the feed are forgotten without an exit event.
+    Fences are stored in SQLite so they survive restarts.
+    """
+
+    def __init__(self, detector, path: Optional[str] = None, cell_size_m: float = 1000):
+        """
+        Args:
+            detector: FeedEventDetector to receive snapshots from and log events to
+            path: SQLite database file (default: geofences.sqlite in the cache dir)
+            cell_size_m: Fence grid cell size in meters
+        """
+        self.detector = detector
+        self.log = detector.log
+        self.path = path or os.path.join(default_cache_dir(), 'geofences.sqlite')
+        self.index = FenceIndex(cell_size_m)
+        self.fences: Dict[str, Geofence] = {}
+        self._inside: Dict[str, frozenset] = {}
+        self._lock = threading.RLock()
+        self.evaluations = 0
+        self.last_evaluation_ms: Optional[float] = None
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS geofences ("
+            "id TEXT PRIMARY KEY, owner TEXT NOT NULL, name TEXT NOT NULL, shape TEXT NOT NULL, "
+            "routes TEXT, created_at REAL NOT NULL)"
+        )
+        for fence_id, owner, name, shape, routes, created_at in conn.execute(
+            "SELECT id, owner, name, shape, routes, created_at FROM geofences"
+        ):
+            self._insert(Geofence(fence_id, owner, Shape.from_dict(json.loads(shape)),
+                                  json.loads(routes) if routes else None, name, created_at))
+
+        detector.add_observer('VehiclePosition.pb', self.evaluate)
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections cannot be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _insert(self, fence: Geofence):
+        with self._lock:
+            self.fences[fence.id] = fence
+            self.index.add(fence.id, fence.shape)
+
+    def add(self, owner: str, shape: Dict[str, Any], routes: Optional[List[str]] = None, name: str = '') -> Geofence:
+        """
+        Register a geofence
+
+        Args:
+            owner: Who the fence (and its events) belongs to
+            shape: Shape spec (see spatial_index.Shape)
+            routes: Only vehicles on these routes (default: all)
+            name: Label copied into events
+
+        Raises:
+            ValueError: If the shape or routes are invalid
+        """
+        parsed = Shape.from_dict(shape)
+        if self.index.cell_count(parsed) > MAX_CELLS_PER_FENCE:
+            raise ValueError('geofence is too large')
+        if routes is not None:
+            if isinstance(routes, str):
+                routes = [routes]
+            if not isinstance(routes, list):
+                raise ValueError('routes must be a list of route IDs')
+            routes = [str(r).strip().upper() for r in routes if str(r).strip()] or None
+
+        fence = Geofence(secrets.token_urlsafe(9), owner, parsed, routes, str(name or '')[:200])
+        self._connect().execute(
+            "INSERT INTO geofences (id, owner, name, shape, routes, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (fence.id, owner, fence.name, json.dumps(parsed.to_dict()),
+             json.dumps(sorted(fence.routes)) if fence.routes else None, fence.created_at)
+        )
+        self._insert(fence)
+        return fence
+
+    def remove(self, fence_id: str) -> bool:
+        """Delete a geofence"""
+        with self._lock:
+            fence = self.fences.pop(fence_id, None)
+            if fence is None:
+                return False
+            self.index.remove(fence_id, fence.shape)
+        self._connect().execute("DELETE FROM geofences WHERE id = ?", (fence_id,))
+        return True
+
+    def owned(self, owner: str) -> List[Geofence]:
+        """An owner's fences, oldest first"""
+        with self._lock:
+            return sorted((f for f in self.fences.values() if f.owner == owner), key=lambda f: f.created_at)
+
+    def evaluate(self, snapshot):
+        """Log enter/exit events for a new VehiclePosition snapshot"""
+        start = time.perf_counter()
+        vehicles = self.detector.rtd_client.get_vehicle_positions(snapshot) or []
+        with self._lock:
+            previous = self._inside
+            baseline = self.evaluations == 0
+            inside: Dict[str, frozenset] = {}
+            for v in vehicles:
+                vehicle_id = v['vehicle_id']
+                if not vehicle_id or v['latitude'] is None or v['longitude'] is None:
+                    continue
+                current = frozenset(
+                    fence_id for fence_id in self.index.candidates(v['latitude'], v['longitude'])
+                    if self._contains(self.fences[fence_id], v)
+                )
+                before = previous.get(vehicle_id, frozenset())
+                if current:
+                    inside[vehicle_id] = current
+                if current != before and not baseline:
+                    for fence_id in current - before:
+                        self._log(GEOFENCE_ENTER, self.fences[fence_id], v, snapshot)
+                    for fence_id in before - current:
+                        fence = self.fences.get(fence_id)
+                        if fence is not None:
+                            self._log(GEOFENCE_EXIT, fence, v, snapshot)
+            self._inside = inside
+            self.evaluations += 1
+            self.last_evaluation_ms = round((time.perf_counter() - start) * 1000, 3)
+
+    def _contains(self, fence: Geofence, vehicle: Dict[str, Any]) -> bool:
+        if fence.routes is not None and vehicle['route_id'] not in fence.routes:
+            return False
+        return fence.shape.contains(vehicle['latitude'], vehicle['longitude'])
+
+    def _log(self, event_type: str, fence: Geofence, vehicle: Dict[str, Any], snapshot):
+        self.log.append(event_type, {
+            'fence_id': fence.id,
+            'fence_name': fence.name,
+            'owner': fence.owner,
+            'vehicle_id': vehicle['vehicle_id'],
+            'route_id': vehicle['route_id'],
+            'trip_id': vehicle['trip_id'],
+            'latitude': vehicle['latitude'],
+            'longitude': vehicle['longitude'],
+        }, snapshot.timestamp)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'fences': len(self.fences),
+                'vehicles_inside': len(self._inside),
+                'evaluations': self.evaluations,
+                'last_evaluation_ms': self.last_evaluation_ms,
+            }
@@ -3,26 +3,93 @@ Google Maps Transit API Client
 Provides access to RTD transit data via Google Maps APIs
 """
 
+import copy
+import os
+from concurrent.futures import ThreadPoolExecutor
 import requests
+import time
 from datetime import datetime, timedelta
 from typing import Optional, List, Dict, Any
+from cache_store import CacheStats, DiskCache, LRUCache, default_cache_dir, normalize_key
+from metrics import GOOGLE_REQUESTS, GOOGLE_SECONDS
+from tracing import span
+from singleflight import SingleFlight
 
 
 class GoogleTransitClient:
     """Client for accessing RTD data via Google Maps APIs"""
     
-    def __init__(self, api_key: str):
+    def __init__(
+        self,
+        api_key: str,
+        cache_dir: Optional[str] = None,
+        geocode_cache_ttl: float = 30 * 24 * 3600,
+        geocode_cache_size: int = 10000,
+        directions_bucket: int = 300,
+        directions_cache_size: int = 1000,
+        directions_disk_cache: bool = False,
+        max_workers: int = 8
+    ):
         """
         Initialize the Google Maps Transit client
         
         Args:
             api_key: Your Google Maps API key
                     Get one at: https://console.cloud.google.com/google/maps-apis
+            cache_dir: Directory for persistent caches (default: RTD_CACHE_DIR
+                       or ~/.cache/rtd). Pass '' to disable on-disk caching.
+            geocode_cache_ttl: Seconds a geocoded address stays cached (default: 30 days)
+            geocode_cache_size: Maximum number of cached addresses
+            directions_bucket: Seconds that departure/arrival times are rounded
+                               to for directions caching (0 disables the cache)
+            directions_cache_size: Maximum number of in-memory directions results
+            directions_disk_cache: Also keep directions results in the on-disk
+                                   cache under cache_dir (shared by processes)
+            max_workers: Default limit on concurrent Directions API calls for
+                         get_next_departures and get_directions_batch
         """
         self.api_key = api_key
         self.directions_url = "https://maps.googleapis.com/maps/api/directions/json"
         self.geocode_url = "https://maps.googleapis.com/maps/api/geocode/json"
         self.places_url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
+        self.max_workers = max_workers
+        
+        if cache_dir is None:
+            cache_dir = default_cache_dir()
+        self.cache_dir = cache_dir
+        
+        self.geocode_stats = CacheStats()
+        self.geocode_cache = None
+        if cache_dir:
+            try:
+                self.geocode_cache = DiskCache(
+                    os.path.join(cache_dir, 'google.sqlite3'),
+                    namespace='geocode',
+                    ttl=geocode_cache_ttl,
+                    max_entries=geocode_cache_size
+                )
+            except Exception as e:
+                print(f"Warning: geocode cache disabled ({e})")
+        
+        # Concurrent identical geocode/directions requests share one API call
+        self.single_flight = SingleFlight()
+        
+        # Parsed directions, keyed by route and time bucket. Entries live for
+        # one bucket so "now" queries never serve a result older than that.
+        self.directions_bucket = directions_bucket
+        self.directions_stats = CacheStats()
+        self.directions_cache = LRUCache(directions_cache_size, ttl=directions_bucket) if directions_bucket else None
+        self.directions_disk_cache = None
+        if directions_bucket and directions_disk_cache and cache_dir:
+            try:
+                self.directions_disk_cache = DiskCache(
+                    os.path.join(cache_dir, 'google.sqlite3'),
+                    namespace='directions',
+                    ttl=directions_bucket,
+                    max_entries=directions_cache_size * 10
+                )
+            except Exception as e:
+                print(f"Warning: directions disk cache disabled ({e})")
         
     def get_transit_directions(
         self,
@@ -49,6 +116,62 @@ class GoogleTransitClient:
             - duration: Trip duration
             - arrival_time: Estimated arrival time
         """
+        # Round the requested time into a bucket so near-identical queries share a cache entry
+        if arrival_time:
+            time_key = f"arrive:{int(arrival_time.timestamp()) // max(1, self.directions_bucket)}"
+        elif departure_time:
+            time_key = f"depart:{int(departure_time.timestamp()) // max(1, self.directions_bucket)}"
+        else:
+            time_key = f"now:{int(time.time()) // max(1, self.directions_bucket)}"
+        cache_key = f"{normalize_key(origin)}|{normalize_key(destination)}|{int(bool(alternatives))}|{time_key}"
+        
+        cached = self._get_cached_directions(cache_key)
+        if cached is not None:
+            self.directions_stats.record_hit()
+            return copy.deepcopy(cached)
+        
+        result = self.single_flight.do(
+            ('directions', cache_key),
+            self._load_directions,
+            cache_key, origin, destination, departure_time, arrival_time, alternatives
+        )
+        # Coalesced callers share the result object - give each its own copy
+        return copy.deepcopy(result) if result is not None else None
+    
+    def _load_directions(self, cache_key, origin, destination, departure_time, arrival_time, alternatives):
+        """Fetch directions for a cache miss and store the parsed result"""
+        start = time.perf_counter()
+        result = self._fetch_directions(origin, destination, departure_time, arrival_time, alternatives)
+        self.directions_stats.record_miss(time.perf_counter() - start)
+        
+        if result is not None and self.directions_cache is not None:
+            self.directions_cache.set(cache_key, result)
+            if self.directions_disk_cache is not None:
+                self.directions_disk_cache.set(cache_key, result)
+        
+        return result
+    
+    def _get_cached_directions(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Look up parsed directions in the memory tier, then the disk tier"""
+        if self.directions_cache is None:
+            return None
+        
+        result = self.directions_cache.get(cache_key)
+        if result is None and self.directions_disk_cache is not None:
+            result = self.directions_disk_cache.get(cache_key)
+            if result is not None:
+                self.directions_cache.set(cache_key, result)
+        return result
+    
+    def _fetch_directions(
+        self,
+        origin: str,
+        destination: str,
+        departure_time: Optional[datetime],
+        arrival_time: Optional[datetime],
+        alternatives: bool
+    ) -> Optional[Dict[str, Any]]:
+        """Call the Directions API and parse the response"""
         params = {
             'origin': origin,
             'destination': destination,
@@ -66,7 +189,7 @@ class GoogleTransitClient:
             params['departure_time'] = 'now'
         
         try:
-            response = requests.get(self.directions_url, params=params, timeout=10)
+            response = self._get('directions', self.directions_url, params)
             response.raise_for_status()
             data = response.json()
             
@@ -79,6 +202,22 @@ class GoogleTransitClient:
             print(f"Error fetching directions: {e}")
             return None
     
+    def _get(self, api: str, url: str, params: Dict[str, Any]) -> requests.Response:
+        """requests.get() with call count and latency recorded per API"""
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            with span('google', api=api) as s:
+                response = requests.get(url, params=params, timeout=10)
+                s.set(status_code=response.status_code, bytes=len(response.content))
+                if response.status_code >= 400:
+                    s.fail(f'HTTP {response.status_code}')
+            outcome = str(response.status_code)
+            return response
+        finally:
+            GOOGLE_SECONDS.labels(api).observe(time.perf_counter() - start)
+            GOOGLE_REQUESTS.labels(api, outcome).inc()
+    
     def _parse_directions(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """Parse the Google Directions API response"""
         routes = []
@@ -161,7 +300,7 @@ class GoogleTransitClient:
         }
         
         try:
-            response = requests.get(self.places_url, params=params, timeout=10)
+            response = self._get('places', self.places_url, params)
             response.raise_for_status()
             data = response.json()
             
@@ -184,15 +323,48 @@ class GoogleTransitClient:
             print(f"Error finding stations: {e}")
             return None
     
+    def geocode(self, address: str) -> Optional[Dict[str, float]]:
+        """
+        Convert an address or place name to coordinates
+        
+        Returns:
+            Dictionary with 'lat' and 'lng', or None if not found
+        """
+        return self._geocode(address)
+    
     def _geocode(self, address: str) -> Optional[Dict[str, float]]:
-        """Convert address to coordinates"""
+        """Convert address to coordinates (served from the geocode cache when possible)"""
+        key = normalize_key(address)
+        if self.geocode_cache is not None and key:
+            cached = self.geocode_cache.get(key)
+            if cached is not None:
+                self.geocode_stats.record_hit()
+                return cached
+        
+        coords = self.single_flight.do(('geocode', key or address), self._load_geocode, key, address)
+        return dict(coords) if coords is not None else None
+    
+    def _load_geocode(self, key: str, address: str) -> Optional[Dict[str, float]]:
+        """Geocode a cache miss and store the result"""
+        start = time.perf_counter()
+        coords = self._fetch_geocode(address)
+        self.geocode_stats.record_miss(time.perf_counter() - start)
+        
+        # Only successful lookups are cached - failures may be transient
+        if coords is not None and self.geocode_cache is not None and key:
+            self.geocode_cache.set(key, coords)
+        
+        return coords
+    
+    def _fetch_geocode(self, address: str) -> Optional[Dict[str, float]]:
+        """Call the Geocoding API"""
         params = {
             'address': address,
             'key': self.api_key
         }
         
         try:
-            response = requests.get(self.geocode_url, params=params, timeout=10)
+            response = self._get('geocode', self.geocode_url, params)
             response.raise_for_status()
             data = response.json()
             
@@ -229,7 +401,9 @@ class GoogleTransitClient:
         self,
         from_location: str,
         to_location: str,
-        num_options: int = 3
+        num_options: int = 3,
+        concurrent: bool = True,
+        max_workers: Optional[int] = None
     ) -> Optional[List[Dict[str, Any]]]:
         """
         Get next few departure options
@@ -238,22 +412,32 @@ class GoogleTransitClient:
             from_location: Starting location
             to_location: Destination
             num_options: Number of departure times to check
+            concurrent: Query all departure times in parallel (default: True)
+            max_workers: Concurrency limit (default: the client's max_workers)
         
         Returns:
             List of route options at different times
         """
-        routes = []
         now = datetime.now()
+        departure_times = [now + timedelta(minutes=i * 15) for i in range(num_options)]
         
-        for i in range(num_options):
-            departure_time = now + timedelta(minutes=i * 15)
-            result = self.get_transit_directions(
+        def fetch(departure_time):
+            return self.get_transit_directions(
                 origin=from_location,
                 destination=to_location,
                 departure_time=departure_time,
                 alternatives=False
             )
-            
+        
+        workers = min(max_workers or self.max_workers, num_options)
+        if concurrent and workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(fetch, departure_times))
+        else:
+            results = [fetch(departure_time) for departure_time in departure_times]
+        
+        routes = []
+        for departure_time, result in zip(departure_times, results):
             if result and result['routes']:
                 routes.append({
                     'departure_time': departure_time.strftime('%I:%M %p'),
@@ -261,4 +445,52 @@ class GoogleTransitClient:
                 })
         
         return routes if routes else None
-
+    
+    def get_directions_batch(
+        self,
+        trips: List[Dict[str, Any]],
+        max_workers: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Get transit directions for many origin/destination pairs concurrently
+        
+        Total latency is roughly that of the slowest request rather than the
+        sum. A failure for one trip does not affect the others.
+        
+        Args:
+            trips: List of dictionaries with 'origin' and 'destination', and
+                   optionally 'departure_time', 'arrival_time' (datetime)
+                   and 'alternatives' (bool, default False)
+            max_workers: Concurrency limit (default: the client's max_workers)
+        
+        Returns:
+            List in the same order as trips. Each item has 'origin',
+            'destination' and 'success', plus 'routes' on success or
+            'error' on failure.
+        """
+        def fetch(trip):
+            item = {'origin': trip.get('origin'), 'destination': trip.get('destination')}
+            try:
+                result = self.get_transit_directions(
+                    origin=trip['origin'],
+                    destination=trip['destination'],
+                    departure_time=trip.get('departure_time'),
+                    arrival_time=trip.get('arrival_time'),
+                    alternatives=trip.get('alternatives', False)
+                )
+            except Exception as e:
+                item.update({'success': False, 'error': str(e)})
+                return item
+            
+            if result and result.get('routes'):
+                item.update({'success': True, 'routes': result['routes']})
+            else:
+                item.update({'success': False, 'error': 'No routes found'})
+            return item
+        
+        if not trips:
+            return []
+        
+        workers = min(max_workers or self.max_workers, len(trips))
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            return list(executor.map(fetch, trips))
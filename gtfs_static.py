@@ -0,0 +1,187 @@
+"""
+GTFS Static Feed
+Holds one downloaded version of the RTD static feed and the tables and
+indexes derived from it. Everything is parsed lazily and built at most once
+per feed version.
+"""
+
+import csv
+import hashlib
+import io
+import threading
+import zipfile
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from memory_usage import CacheParts, measure, share_strings
+from search_index import TrigramIndex
+from spatial_index import GridIndex
+
+
+class StaticFeed:
+    """A single version of the GTFS static feed"""
+
+    def __init__(self, content: bytes, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        """
+        Args:
+            content: Raw bytes of google_transit.zip
+            etag: ETag header from the download (used for conditional refreshes)
+            last_modified: Last-Modified header from the download
+        """
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self._zip = zipfile.ZipFile(io.BytesIO(content))
+        self._names = set(self._zip.namelist())
+        self._tables: Dict[str, List[Dict]] = {}
+        self._derived: Dict[str, object] = {}
+        # One shared copy of each stop, route, trip... id (see share_strings)
+        self.ids: Dict[str, str] = {}
+        self._lock = threading.RLock()
+        self.version = self._compute_version()
+
+    def _compute_version(self) -> str:
+        """Use feed_info.txt's feed_version when present, else a content hash"""
+        digest = hashlib.sha1(self.content).hexdigest()[:12]
+        for row in self.table('feed_info.txt'):
+            if row.get('feed_version'):
+                return f"{row['feed_version']}-{digest}"
+        return digest
+
+    def namelist(self) -> List[str]:
+        """List files in the feed"""
+        return self._zip.namelist()
+
+    def read_file(self, file_name: str) -> Optional[str]:
+        """
+        Get the decoded text of a file in the feed
+
+        Returns:
+            File contents, or None if the file is not in the feed
+        """
+        if file_name not in self._names:
+            return None
+        with self._lock:
+            return self._zip.read(file_name).decode('utf-8-sig')
+
+    def table(self, file_name: str) -> List[Dict]:
+        """
+        Get a feed file parsed into a list of row dictionaries
+
+        Returns:
+            List of rows (empty if the file is not in the feed). The list is
+            shared - callers must not modify it.
+        """
+        rows = self._tables.get(file_name)
+        if rows is None:
+            with self._lock:
+                rows = self._tables.get(file_name)
+                if rows is None:
+                    with measure(f'static:{file_name}'):
+                        text = self.read_file(file_name)
+                        rows = list(csv.DictReader(io.StringIO(text))) if text else []
+                        share_strings(rows, self.ids)
+                    self._tables[file_name] = rows
+        return rows
+
+    def iter_rows(self, file_name: str, columns: Sequence[str]) -> Iterator[List[str]]:
+        """
+        Stream selected columns of a feed file without keeping the table
+
+        Used for large files such as stop_times.txt. Missing columns come
+        back as empty strings.
+
+        Yields:
+            List of column values, in the order given by columns
+        """
+        if file_name not in self._names:
+            return
+        with self._lock:
+            raw = self._zip.open(file_name)
+        with io.TextIOWrapper(raw, encoding='utf-8-sig', newline='') as handle:
+            reader = csv.reader(handle)
+            header = next(reader, [])
+            positions = [header.index(c) if c in header else None for c in columns]
+            for row in reader:
+                yield [row[p] if p is not None and p < len(row) else '' for p in positions]
+
+    def derived(self, name: str, builder):
+        """
+        Get a value derived from this feed version, building it on first use
+
+        Args:
+            name: Cache key for the derived value
+            builder: Zero-argument callable that builds the value
+        """
+        value = self._derived.get(name)
+        if value is None:
+            with self._lock:
+                value = self._derived.get(name)
+                if value is None:
+                    with measure(f'static:{name}'):
+                        value = builder()
+                    self._derived[name] = value
+        return value
+
+    def memory_parts(self) -> CacheParts:
+        """Parsed tables and derived values, for /debug/memory"""
+        parts = CacheParts(zip=len(self.content), ids=self.ids)
+        parts.update((name, rows) for name, rows in list(self._tables.items()))
+        parts.update((name, value) for name, value in list(self._derived.items()))
+        return parts
+
+    @property
+    def stops(self) -> List[Dict]:
+        return self.table('stops.txt')
+
+    @property
+    def routes(self) -> List[Dict]:
+        return self.table('routes.txt')
+
+    @property
+    def stop_name_index(self) -> TrigramIndex:
+        """Trigram index of stop names, keyed by position in stops.txt"""
+        return self.derived('stop_name_index', lambda: TrigramIndex(
+            (i, stop.get('stop_name', '')) for i, stop in enumerate(self.stops)
+        ))
+
+    @property
+    def route_name_index(self) -> TrigramIndex:
+        """Trigram index of route short and long names, keyed by position in routes.txt"""
+        def build():
+            entries = []
+            for i, route in enumerate(self.routes):
+                entries.append((i, route.get('route_short_name', '')))
+                entries.append((i, route.get('route_long_name', '')))
+            return TrigramIndex(entries)
+        return self.derived('route_name_index', build)
+
+    @property
+    def stop_spatial_index(self) -> GridIndex:
+        """Grid index of stop locations, keyed by position in stops.txt"""
+        def build():
+            points = []
+            for i, stop in enumerate(self.stops):
+                try:
+                    lat = float(stop.get('stop_lat') or 0)
+                    lng = float(stop.get('stop_lon') or 0)
+                except ValueError:
+                    continue
+                if lat and lng:
+                    points.append((i, lat, lng))
+            return GridIndex(points)
+        return self.derived('stop_spatial_index', build)
+
+    @property
+    def routes_by_stop(self) -> Dict[str, List[str]]:
+        """Sorted route_ids serving each stop_id (from trips.txt and stop_times.txt)"""
+        def build():
+            ids = self.ids
+            route_by_trip = {trip_id: ids.get(route_id, route_id)
+                             for trip_id, route_id in self.iter_rows('trips.txt', ('trip_id', 'route_id'))}
+            served: Dict[str, set] = {}
+            for trip_id, stop_id in self.iter_rows('stop_times.txt', ('trip_id', 'stop_id')):
+                route_id = route_by_trip.get(trip_id)
+                if route_id is not None:
+                    served.setdefault(stop_id, set()).add(route_id)
+            return {ids.get(stop_id, stop_id): sorted(routes) for stop_id, routes in served.items()}
+        return self.derived('routes_by_stop', build)
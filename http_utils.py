@@ -0,0 +1,481 @@
+"""
+HTTP Helpers
+Conditional (ETag / 304) responses, pre-serialized bodies, negotiated
+compression and response formats, and per-endpoint encoding statistics
+shared by the Flask apps
+"""
+
+import gzip
+import hashlib
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from flask import Flask, Response, current_app, g, request
+
+from fast_json import FastJSONProvider, encode_json
+from realtime_feed import served_snapshots, track_served
+from tracing import span
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# Query parameters that never change the response body
+IGNORED_PARAMS = {'api_key'}
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+MIN_COMPRESS_BYTES = 1024   # Smaller bodies are sent uncompressed
+ARRAY_CHUNK = 500           # Items encoded per chunk when streaming arrays
+NDJSON_CHUNK_BYTES = 16384  # Lines buffered per chunk when streaming NDJSON
+
+# Preferred first when the client rates them equally
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+# Response format -> Content-Type it is sent with
+FORMAT_MIMETYPES = {
+    'json': 'application/json',
+    'msgpack': 'application/msgpack',
+    'protobuf': 'application/x-protobuf',
+}
+
+# Accept header media types understood for each format
+ACCEPT_FORMATS = {
+    'application/json': 'json',
+    'application/msgpack': 'msgpack',
+    'application/x-msgpack': 'msgpack',
+    'application/vnd.msgpack': 'msgpack',
+    'application/x-protobuf': 'protobuf',
+    'application/protobuf': 'protobuf',
+    'application/vnd.google.protobuf': 'protobuf',
+}
+
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/geo+json', 'application/x-ndjson',
+    'application/javascript', 'text/html', 'text/css', 'text/plain', 'text/javascript'
+}
+
+
+def make_etag(*parts) -> str:
+    """Strong ETag value (unquoted) for a tuple of version parts"""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:32]
+
+
+def request_etag(*versions) -> str:
+    """
+    ETag for the current request
+
+    Args:
+        versions: Versions of the data behind the response (e.g. the realtime
+                  feed header timestamp and the static feed version)
+
+    Returns:
+        ETag combining the versions with the path and query parameters
+    """
+    params = sorted(
+        (key, value) for key, value in request.args.items(multi=True)
+        if key not in IGNORED_PARAMS
+    )
+    return make_etag(request.path, versions, params)
+
+
+def not_modified(etag: str) -> Optional[Response]:
+    """
+    Check If-None-Match against an ETag
+
+    Returns:
+        An empty 304 response if the client already has this version,
+        otherwise None
+    """
+    if not request.if_none_match:
+        return None
+    # Compressed representations carry their own (suffixed) strong ETag
+    for candidate in (etag,) + tuple(f'{etag}-{encoding}' for encoding in ENCODINGS):
+        if request.if_none_match.contains_weak(candidate):
+            return with_etag(Response(status=304), candidate)
+    return None
+
+
+def with_etag(response: Response, etag: str) -> Response:
+    """Tag a response so clients can revalidate it with If-None-Match"""
+    response.set_etag(etag)
+    # Cacheable, but clients must revalidate before reusing it
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def negotiate_encoding() -> Optional[str]:
+    """
+    Pick a content encoding for the current request
+
+    Returns:
+        'br' or 'gzip' (the one the client rates highest), or None for identity
+    """
+    best, best_quality = None, 0
+    for encoding in ENCODINGS:
+        quality = request.accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """Compress a body with 'br' or 'gzip'"""
+    with span('compress', encoding=encoding, bytes=len(data)):
+        if encoding == 'br':
+            return brotli.compress(data, quality=BROTLI_QUALITY)
+        return gzip.compress(data, GZIP_LEVEL)
+
+
+def compress_stream(chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+    """Compress a streamed body chunk by chunk"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            data = compressor.process(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+def available_formats() -> Tuple[str, ...]:
+    """Response formats this server can produce (msgpack needs the msgpack package)"""
+    return tuple(f for f in FORMAT_MIMETYPES if f != 'msgpack' or msgpack is not None)
+
+
+def negotiate_format(formats: Iterable[str] = tuple(FORMAT_MIMETYPES)) -> str:
+    """
+    Pick the response format for the current request
+
+    An explicit format query parameter wins; otherwise the Accept header is
+    matched against ACCEPT_FORMATS. Clients that accept anything (or send
+    no Accept header) get JSON.
+
+    Args:
+        formats: Formats the endpoint supports
+
+    Returns:
+        'json', 'msgpack' or 'protobuf'
+
+    Raises:
+        ValueError: If the format parameter names an unsupported format
+    """
+    formats = [f for f in available_formats() if f in formats]
+    requested = request.args.get('format')
+    if requested:
+        if requested not in formats:
+            hint = " (install 'msgpack' on the server)" if requested == 'msgpack' and msgpack is None else ''
+            raise ValueError(f"format must be one of: {', '.join(formats)}{hint}")
+        return requested
+
+    # The body depends on Accept from here on
+    g.vary_accept = True
+    candidates = [m for m, f in ACCEPT_FORMATS.items() if f in formats]
+    best = request.accept_mimetypes.best_match(candidates)
+    return ACCEPT_FORMATS[best] if best else 'json'
+
+
+def encode_payload(payload: Any, format: str = 'json') -> bytes:
+    """
+    Serialize a response payload
+
+    Args:
+        payload: JSON-serializable value, or a protobuf message for 'protobuf'
+        format: 'json', 'msgpack' or 'protobuf'
+    """
+    if format == 'json':
+        # Timed by the JSON provider
+        return encode_json(payload) + b'\n'
+    start = time.perf_counter()
+    with span('serialize', format=format) as s:
+        if format == 'protobuf':
+            data = payload.SerializeToString()
+        else:
+            data = msgpack.packb(payload, use_bin_type=True)
+        s.set(bytes=len(data))
+    _add_encode_time(time.perf_counter() - start)
+    return data
+
+
+def _add_encode_time(seconds: float):
+    g.encode_seconds = g.get('encode_seconds', 0.0) + seconds
+
+
+class SerializedResponse:
+    """
+    A response body encoded once and reused
+
+    The plain bytes are produced up front; a compressed copy is made for
+    each content encoding the first time a client asks for it. All of them
+    are kept for the lifetime of the object (typically one feed snapshot).
+    """
+
+    def __init__(
+        self,
+        payload: Any,
+        status: int = 200,
+        headers: Optional[Dict[str, str]] = None,
+        mimetype: Optional[str] = None,
+        format: str = 'json'
+    ):
+        """
+        Args:
+            payload: JSON-serializable value (encoded like jsonify), or a
+                     protobuf message for format='protobuf'
+            status: HTTP status code to send
+            headers: Extra response headers
+            mimetype: Content type (default: the format's, e.g. application/json)
+            format: 'json', 'msgpack' or 'protobuf'
+        """
+        self.body = encode_payload(payload, format)
+        self.status = status
+        self.headers = headers or {}
+        self.mimetype = mimetype or FORMAT_MIMETYPES[format]
+        self._encoded: Dict[str, bytes] = {}
+
+    def encoded(self, encoding: str) -> bytes:
+        """The body compressed with 'br' or 'gzip' (built on first use)"""
+        data = self._encoded.get(encoding)
+        if data is None:
+            start = time.perf_counter()
+            data = self._encoded[encoding] = compress(self.body, encoding)
+            _add_encode_time(time.perf_counter() - start)
+        return data
+
+    def to_response(self, etag: Optional[str] = None) -> Response:
+        """
+        Build a response for the current request, compressed if accepted
+
+        Args:
+            etag: ETag of the uncompressed representation
+        """
+        encoding = negotiate_encoding() if len(self.body) >= MIN_COMPRESS_BYTES else None
+        if encoding:
+            response = Response(self.encoded(encoding), self.status, mimetype=self.mimetype)
+            response.headers['Content-Encoding'] = encoding
+            if etag:
+                etag = f'{etag}-{encoding}'
+        else:
+            response = Response(self.body, self.status, mimetype=self.mimetype)
+        response.headers.extend(self.headers)
+        response.vary.add('Accept-Encoding')
+        g.raw_bytes = len(self.body)
+        if etag:
+            with_etag(response, etag)
+        return response
+
+
+def stream_json(payload: Dict[str, Any], array_key: str) -> Response:
+    """
+    Stream a JSON object whose array_key member is a large list
+
+    The other members are sent first, then the array ARRAY_CHUNK items at a
+    time, so the full body is never held in memory as one string.
+    """
+    items = payload[array_key]
+    head = encode_json({key: value for key, value in payload.items() if key != array_key})
+    provider = current_app.json
+    encode = provider.encode if isinstance(provider, FastJSONProvider) else (lambda obj: provider.dumps(obj).encode('utf-8'))
+    prefix = head[:-1] + (b',' if len(head) > 2 else b'') + encode(array_key) + b':['
+
+    def generate():
+        yield prefix
+        for start in range(0, len(items), ARRAY_CHUNK):
+            chunk = b','.join(encode(item) for item in items[start:start + ARRAY_CHUNK])
+            yield (b',' + chunk) if start else chunk
+        yield b']}\n'
+
+    return Response(generate(), mimetype='application/json')
+
+
+def stream_ndjson(records: Iterable[Any], headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Stream records as newline-delimited JSON (one record per line)
+
+    Records are pulled from the iterable as the client reads, so a generator
+    over a feed is never materialized. The first line is sent on its own to
+    keep time to first byte low; after that lines are grouped into chunks of
+    about NDJSON_CHUNK_BYTES.
+
+    Args:
+        records: Iterable of JSON-serializable values
+        headers: Extra response headers
+    """
+    provider = current_app.json
+    encode = provider.encode if isinstance(provider, FastJSONProvider) else (lambda obj: provider.dumps(obj).encode('utf-8'))
+
+    def generate():
+        lines, size = [], 0
+        for i, record in enumerate(records):
+            line = encode(record) + b'\n'
+            if i == 0:
+                yield line
+                continue
+            lines.append(line)
+            size += len(line)
+            if size >= NDJSON_CHUNK_BYTES:
+                yield b''.join(lines)
+                lines, size = [], 0
+        if lines:
+            yield b''.join(lines)
+
+    return Response(generate(), mimetype='application/x-ndjson', headers=headers)
+
+
+class ResponseStats:
+    """Per-endpoint request counts, encode time and bytes before/after compression"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints: Dict[str, Dict[str, float]] = {}
+
+    def record(self, endpoint: str, encode_seconds: float, raw_bytes: Optional[int], sent_bytes: Optional[int]):
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = {
+                    'requests': 0, 'encode_seconds': 0.0, 'raw_bytes': 0, 'sent_bytes': 0
+                }
+            stats['requests'] += 1
+            stats['encode_seconds'] += encode_seconds
+            if sent_bytes is not None:
+                stats['sent_bytes'] += sent_bytes
+                stats['raw_bytes'] += raw_bytes if raw_bytes is not None else sent_bytes
+
+    def as_dict(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                endpoint: {
+                    'requests': stats['requests'],
+                    'avg_encode_ms': round(stats['encode_seconds'] / stats['requests'] * 1000, 3),
+                    'raw_bytes': stats['raw_bytes'],
+                    'sent_bytes': stats['sent_bytes'],
+                    'compression_ratio': round(stats['sent_bytes'] / stats['raw_bytes'], 3) if stats['raw_bytes'] else None
+                }
+                for endpoint, stats in sorted(self._endpoints.items())
+            }
+
+
+class _ByteCounter:
+    """Counts the bytes passing through a streamed body"""
+
+    def __init__(self):
+        self.count = 0
+
+    def wrap(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        for chunk in chunks:
+            self.count += len(chunk)
+            yield chunk
+
+
+def setup_responses(app: Flask, json_backend: Optional[str] = None) -> ResponseStats:
+    """
+    Install the fast JSON provider and response compression on an app
+
+    Responses with a compressible type are gzip/brotli encoded when the
+    client accepts it (streamed bodies are compressed on the fly). Each
+    buffered response gets a Server-Timing header with its encode time, and
+    the returned ResponseStats aggregates encode time and bytes per endpoint.
+
+    Args:
+        app: Flask application
+        json_backend: Name of a fast_json backend (default: RTD_JSON_BACKEND,
+                      else orjson if installed)
+    """
+    provider = FastJSONProvider(app)
+    provider.backend = json_backend
+    app.json = provider
+    stats = ResponseStats()
+
+    @app.after_request
+    def finish_response(response: Response) -> Response:
+        if g.get('vary_accept'):
+            response.vary.add('Accept')
+        if response.direct_passthrough or response.status_code == 304:
+            return response
+        endpoint = request.endpoint or 'unknown'
+
+        encoding = None
+        if (
+            response.mimetype in COMPRESSIBLE_TYPES
+            and 'Content-Encoding' not in response.headers
+            and (response.is_streamed or len(response.get_data()) >= MIN_COMPRESS_BYTES)
+        ):
+            encoding = negotiate_encoding()
+            response.vary.add('Accept-Encoding')
+
+        if response.is_streamed:
+            # Streamed bodies are encoded lazily, so only bytes are counted
+            raw, sent = _ByteCounter(), _ByteCounter()
+            body = raw.wrap(response.response)
+            if encoding:
+                body = compress_stream(body, encoding)
+                response.headers['Content-Encoding'] = encoding
+                response.headers.pop('Content-Length', None)
+            response.response = sent.wrap(body)
+            encode_seconds = g.get('encode_seconds', 0.0)
+            response.call_on_close(lambda: stats.record(endpoint, encode_seconds, raw.count, sent.count))
+            return response
+
+        raw_bytes = g.get('raw_bytes')
+        if encoding:
+            data = response.get_data()
+            raw_bytes = len(data)
+            start = time.perf_counter()
+            response.set_data(compress(data, encoding))
+            _add_encode_time(time.perf_counter() - start)
+            response.headers['Content-Encoding'] = encoding
+            etag, weak = response.get_etag()
+            if etag:
+                response.set_etag(f'{etag}-{encoding}', weak)
+
+        encode_seconds = g.get('encode_seconds', 0.0)
+        response.headers['Server-Timing'] = f'encode;dur={encode_seconds * 1000:.2f}'
+        stats.record(endpoint, encode_seconds, raw_bytes, response.content_length)
+        return response
+
+    return stats
+
+
+def setup_feed_age(app: Flask):
+    """
+    Tell clients how old the realtime data behind a response is
+
+    Responses built from realtime snapshots get X-Feed-Age (seconds since
+    RTD last confirmed the oldest of them). When a snapshot is being served
+    because refreshing it failed, they also get X-Feed-Stale with the feed
+    names and a Warning: 110 header. Bodies are cached per snapshot, so this
+    is only carried in headers.
+    """
+    @app.before_request
+    def start_tracking():
+        g.served_token = track_served()
+
+    @app.after_request
+    def add_feed_age(response: Response) -> Response:
+        served = served_snapshots()
+        if served:
+            now = time.time()
+            age = max(now - snapshot.checked_at for snapshot, _ in served.values())
+            response.headers['X-Feed-Age'] = f'{max(age, 0.0):.1f}'
+            stale = sorted(feed_file for feed_file, (_, is_stale) in served.items() if is_stale)
+            if stale:
+                response.headers['X-Feed-Stale'] = ', '.join(stale)
+                response.headers['Warning'] = '110 - "Response is Stale"'
+        return response
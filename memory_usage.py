@@ -0,0 +1,297 @@
+"""
+Memory Usage
+How much memory the parsed feeds and caches hold, and the string sharing
+that keeps repeated identifiers from being stored once per record
+
+Two measurements are reported at /debug/memory:
+- Retained size per cache, by walking the objects it references
+  (sys.getsizeof of every container, key and value, each object counted
+  once). Always available, costs a walk over the cache on each request.
+- Bytes allocated while each table, index and snapshot value was built,
+  from tracemalloc. Only while tracing is on (RTD_TRACEMALLOC=<frames>,
+  which slows allocation-heavy code down noticeably), together with the
+  top allocation sites.
+
+Protobuf messages are parsed into upb arenas outside the Python heap, so
+neither measurement sees them; snapshots report their wire size instead.
+"""
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import types
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from flask import Flask, jsonify, request
+
+TRACEMALLOC_ENV = 'RTD_TRACEMALLOC'
+SHARE_STRINGS_ENV = 'RTD_SHARE_STRINGS'
+TOP_ALLOCATIONS = 20
+
+# Set RTD_SHARE_STRINGS=0 to compare against unshared strings
+SHARE_STRINGS = os.environ.get(SHARE_STRINGS_ENV, '1') != '0'
+
+# GTFS columns holding identifiers that realtime feeds repeat as well
+ID_COLUMNS = frozenset((
+    'agency_id', 'block_id', 'parent_station', 'route_id', 'service_id', 'shape_id',
+    'stop_id', 'trip_id', 'zone_id', 'from_stop_id', 'to_stop_id',
+))
+
+# Not worth walking into: shared by everything, or not data
+_OPAQUE = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+           type(threading.Lock()), type(threading.RLock()), threading.Condition, threading.Thread, threading.local)
+
+
+def share_strings(rows: List[Dict[str, Any]], ids: Dict[str, str]) -> List[Dict[str, Any]]:
+    """
+    Replace repeated string values in parsed rows with one shared copy
+
+    csv returns a new string for every field, so a value such as a route_id
+    or 'America/Denver' is stored once per row. Identifier columns are
+    shared through ids, a dict kept for the lifetime of the feed version, so
+    realtime records can reuse the same objects (RTDClient looks their ids
+    up in it); other columns only within the table. A dict is used rather than sys.intern so
+    the strings of an old feed version are freed with it.
+
+    Args:
+        rows: Row dictionaries, updated in place
+        ids: Identifier pool of the feed version
+
+    Returns:
+        rows
+    """
+    if not SHARE_STRINGS:
+        return rows
+    local: Dict[str, str] = {}
+    for row in rows:
+        for key, value in row.items():
+            if value.__class__ is str and value:
+                pool = ids if key in ID_COLUMNS else local
+                row[key] = pool.setdefault(value, value)
+    return rows
+
+
+class _IdPool(dict):
+    """Ids seen so far; looking up a new one adds it"""
+
+    def __missing__(self, key):
+        self[key] = key
+        return key
+
+
+def id_sharer(ids: Dict[str, str]) -> Callable[[str], str]:
+    """
+    Function returning one shared copy of each id met while parsing a feed
+
+    Ids found in ids (the static feed's pool) come back as the static
+    feed's own string, others as the first copy seen by this sharer. Make
+    one per parsed feed, so ids that only appear in realtime data are not
+    kept after it. A lookup is a C-level dict subscript: no Python call per
+    id.
+    """
+    if not SHARE_STRINGS:
+        return str
+    return _IdPool(ids).__getitem__
+
+
+def deep_size(obj: Any) -> Tuple[int, int]:
+    """
+    Bytes retained by an object and everything it references
+
+    Returns:
+        (bytes, number of objects); objects reachable twice are counted once
+    """
+    seen = set()
+    stack = [obj]
+    total = count = 0
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, _OPAQUE):
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        count += 1
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset, deque)):
+            stack.extend(o)
+        elif not isinstance(o, (str, bytes, int, float)):
+            attributes = getattr(o, '__dict__', None)
+            if attributes is not None:
+                stack.append(attributes)
+            for cls in type(o).__mro__:
+                for slot in cls.__dict__.get('__slots__', ()):
+                    value = getattr(o, slot, None)
+                    if value is not None:
+                        stack.append(value)
+    return total, count
+
+
+class CacheParts(dict):
+    """{part name: object} of one cache, sized part by part (ints are sizes measured elsewhere)"""
+
+
+class BuildLedger:
+    """Bytes allocated while building each cached value (while tracemalloc is on)"""
+
+    def __init__(self):
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, allocated: int, seconds: float):
+        with self._lock:
+            entry = self._entries.setdefault(name, {'builds': 0, 'last_bytes': 0, 'total_bytes': 0})
+            entry['builds'] += 1
+            entry['last_bytes'] = allocated
+            entry['total_bytes'] += allocated
+            entry['last_build_ms'] = round(seconds * 1000, 3)
+
+    def as_dict(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: dict(entry) for name, entry in sorted(self._entries.items())}
+
+
+LEDGER = BuildLedger()
+
+
+@contextmanager
+def measure(name: str):
+    """
+    Record the memory a block leaves allocated under name
+
+    Free when tracemalloc is off. The figure is the change in traced memory,
+    so allocations by other threads in the meantime are included.
+    """
+    if not tracemalloc.is_tracing():
+        yield
+        return
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    yield
+    LEDGER.record(name, tracemalloc.get_traced_memory()[0] - before, time.perf_counter() - start)
+
+
+def start_tracing(frames: Optional[int] = None) -> bool:
+    """
+    Start tracemalloc when RTD_TRACEMALLOC is set (its value is the traceback depth)
+
+    Returns:
+        Whether tracemalloc is tracing
+    """
+    if frames is None:
+        value = os.environ.get(TRACEMALLOC_ENV)
+        if not value:
+            return tracemalloc.is_tracing()
+        frames = int(value) if value.isdigit() and int(value) > 0 else 1
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    return True
+
+
+def _rss_bytes() -> Optional[int]:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def memory_report(caches: Dict[str, Callable[[], Any]], top: int = TOP_ALLOCATIONS,
+                  only: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """
+    Sizes of the given caches plus tracemalloc statistics
+
+    Args:
+        caches: {name: function returning the cached object, or CacheParts to
+                 size it part by part}. Caches that share objects (the stops
+                 cache holds the static feed's strings) each count them.
+        top: Number of allocation sites to list while tracing
+        only: Names of the caches to size (default: all)
+
+    Returns:
+        Report dictionary
+    """
+    wanted = set(only) if only else None
+    sizes: Dict[str, Any] = {}
+    start = time.perf_counter()
+    for name, getter in caches.items():
+        if wanted is not None and name not in wanted:
+            continue
+        value = getter()
+        if isinstance(value, CacheParts):
+            parts = {}
+            for part, obj in value.items():
+                if isinstance(obj, int):
+                    parts[part] = {'bytes': obj, 'objects': None}
+                    continue
+                size, count = deep_size(obj)
+                parts[part] = {'bytes': size, 'objects': count}
+            sizes[name] = {'bytes': sum(p['bytes'] for p in parts.values()), 'parts': parts}
+        elif value is None:
+            sizes[name] = {'bytes': 0, 'objects': 0}
+        else:
+            size, count = deep_size(value)
+            sizes[name] = {'bytes': size, 'objects': count}
+
+    report: Dict[str, Any] = {
+        'rss_bytes': _rss_bytes(),
+        'share_strings': SHARE_STRINGS,
+        'caches': sizes,
+        'sizing_ms': round((time.perf_counter() - start) * 1000, 3),
+        'tracemalloc': {'tracing': tracemalloc.is_tracing()},
+    }
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ])
+        report['tracemalloc'].update({
+            'traced_bytes': current,
+            'peak_bytes': peak,
+            'overhead_bytes': tracemalloc.get_tracemalloc_memory(),
+            'builds': LEDGER.as_dict(),
+            'top_allocations': [{
+                'location': f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}',
+                'bytes': stat.size,
+                'blocks': stat.count,
+            } for stat in snapshot.statistics('lineno')[:top]],
+        })
+    return report
+
+
+def setup_memory(app: Flask, authorize: Callable[[], bool], caches: Dict[str, Callable[[], Any]],
+                 forbidden: str = 'Requires an API key with admin permission'):
+    """
+    Serve memory usage at /debug/memory and start tracemalloc if RTD_TRACEMALLOC is set
+
+    ?cache=name (repeatable) limits the sizing to some caches, and ?top= sets
+    the number of allocation sites listed.
+
+    Args:
+        app: Flask application
+        authorize: Function telling whether the current request may read /debug/memory
+        caches: {name: getter} as for memory_report()
+        forbidden: Message of the 403 returned when the request may not read it
+    """
+    start_tracing()
+
+    def memory():
+        if not authorize():
+            return jsonify({'error': 'Forbidden', 'message': forbidden}), 403
+        only = request.args.getlist('cache')
+        unknown = [name for name in only if name not in caches]
+        if unknown:
+            return jsonify({
+                'error': 'Invalid cache',
+                'message': f"Unknown cache '{unknown[0]}'. Choose from: {', '.join(caches)}"
+            }), 400
+        top = max(0, min(request.args.get('top', TOP_ALLOCATIONS, type=int), 200))
+        return jsonify(dict(memory_report(caches, top, only), success=True))
+
+    app.add_url_rule('/debug/memory', 'debug_memory', memory)
@@ -0,0 +1,220 @@
+"""
+Request Profiling
+Opt-in profiles of single requests: how long each step took (upstream
+fetch, protobuf parse, building derived values, closest stops, encoding)
+plus a cProfile of the whole request. The most recent profiles are kept in
+memory for inspection.
+
+A request is profiled when an admin adds ?profile=1, or at random with
+probability RTD_PROFILE_SAMPLE_RATE (e.g. 0.01). The step breakdown is the
+request's trace (see tracing.span), so setup_tracing() must run first.
+"""
+
+import cProfile
+import os
+import pstats
+import random
+import secrets
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from urllib.parse import urlencode
+
+from flask import Flask, g, jsonify, request
+
+from tracing import current_span
+
+SAMPLE_RATE_ENV = 'RTD_PROFILE_SAMPLE_RATE'
+MAX_PROFILES = 50           # Profiles kept in memory
+TOP_FUNCTIONS = 25          # cProfile rows kept per profile
+UNPROFILED_PREFIXES = ('/debug/', '/metrics')
+
+# Newer Pythons allow only one active cProfile per process
+_profiler_lock = threading.Lock()
+
+
+class Profile:
+    """Spans and cProfile statistics recorded for one request"""
+
+    def __init__(self, method: str, path: str, reason: str):
+        self.id = secrets.token_hex(6)
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.started_at = time.time()
+        self.status: Optional[int] = None
+        self.duration_ms: Optional[float] = None
+        self.encode_ms: Optional[float] = None
+        self.spans: List[Dict[str, Any]] = []
+        self.functions: List[Dict[str, Any]] = []
+        self._start = time.perf_counter()
+        self._profiler: Optional[cProfile.Profile] = None
+
+    def start(self):
+        """Start cProfile, unless another request is already being profiled (then spans only)"""
+        if _profiler_lock.acquire(blocking=False):
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def finish(self, status: Optional[int], encode_seconds: float = 0.0):
+        self.status = status
+        self.duration_ms = round((time.perf_counter() - self._start) * 1000, 3)
+        self.encode_ms = round(encode_seconds * 1000, 3)
+        request_span = current_span()
+        if request_span is not None:
+            # Finished spans below the request span, in start order
+            for s in sorted(request_span.trace.spans, key=lambda s: s._start):
+                if s.depth <= request_span.depth:
+                    continue
+                record = dict(s.attributes, name=s.name, depth=s.depth - request_span.depth - 1,
+                              start_ms=round((s._start - self._start) * 1000, 3), duration_ms=s.duration_ms)
+                if s.error:
+                    record['error'] = s.error
+                self.spans.append(record)
+        if self._profiler is None:
+            return
+        self._profiler.disable()
+        _profiler_lock.release()
+        stats = pstats.Stats(self._profiler)
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_FUNCTIONS]
+        self.functions = [{
+            'function': f'{filename}:{line}({name})',
+            'calls': calls,
+            'total_ms': round(total * 1000, 3),
+            'cumulative_ms': round(cumulative * 1000, 3),
+        } for (filename, line, name), (_, calls, total, cumulative, _) in rows]
+        self._profiler = None
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'method': self.method,
+            'path': self.path,
+            'reason': self.reason,
+            'status': self.status,
+            'time': datetime.fromtimestamp(self.started_at).isoformat(timespec='seconds'),
+            'duration_ms': self.duration_ms,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        report = self.summary()
+        report.update({
+            'encode_ms': self.encode_ms,
+            'spans': self.spans,
+            'functions': self.functions,
+        })
+        return report
+
+    def server_timing(self) -> str:
+        """Server-Timing header value with the top-level spans"""
+        totals: Dict[str, float] = {}
+        for s in self.spans:
+            if s['depth'] == 0:
+                totals[s['name']] = totals.get(s['name'], 0.0) + s['duration_ms']
+        return ', '.join(f'{name};dur={ms:.2f}' for name, ms in totals.items())
+
+
+class ProfileStore:
+    """The most recent profiles, newest last"""
+
+    def __init__(self, max_profiles: int = MAX_PROFILES):
+        self._profiles = deque(maxlen=max_profiles)
+        self._lock = threading.Lock()
+
+    def add(self, profile: Profile):
+        with self._lock:
+            self._profiles.append(profile)
+
+    def get(self, profile_id: str) -> Optional[Profile]:
+        with self._lock:
+            return next((p for p in self._profiles if p.id == profile_id), None)
+
+    def recent(self) -> List[Profile]:
+        with self._lock:
+            return list(self._profiles)
+
+
+def setup_profiling(app: Flask, authorize: Callable[[], bool], sample_rate: Optional[float] = None) -> ProfileStore:
+    """
+    Profile requests on an app and serve the reports under /debug/profiles
+
+    Register before setup_responses() so compression is included. Requested
+    profiles are returned in the X-Profile-Id and Server-Timing headers;
+    sampled ones are only stored.
+
+    Args:
+        app: Flask application
+        authorize: Function telling whether the current request may use
+                   ?profile=1 and read /debug/profiles
+        sample_rate: Fraction of requests to profile (default: RTD_PROFILE_SAMPLE_RATE or 0)
+    """
+    if sample_rate is None:
+        sample_rate = float(os.environ.get(SAMPLE_RATE_ENV) or 0)
+    store = ProfileStore()
+
+    @app.before_request
+    def start_profile():
+        if request.path.startswith(UNPROFILED_PREFIXES):
+            return None
+        if request.args.get('profile') == '1':
+            if not authorize():
+                return jsonify({
+                    'error': 'Forbidden',
+                    'message': 'profile=1 requires an API key with admin permission'
+                }), 403
+            reason = 'requested'
+        elif sample_rate and random.random() < sample_rate:
+            reason = 'sampled'
+        else:
+            return None
+        query = urlencode([(k, v) for k, v in request.args.items(multi=True) if k != 'api_key'])
+        profile = Profile(request.method, request.path + ('?' + query if query else ''), reason)
+        g.profile = profile
+        profile.start()
+        return None
+
+    @app.after_request
+    def finish_profile(response):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return response
+        profile.finish(response.status_code, g.get('encode_seconds', 0.0))
+        store.add(profile)
+        if profile.reason == 'requested':
+            response.headers['X-Profile-Id'] = profile.id
+            timing = profile.server_timing()
+            if timing:
+                response.headers.add('Server-Timing', timing)
+        return response
+
+    @app.teardown_request
+    def abandon_profile(error=None):
+        # Requests that raised never reach after_request
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profile.finish(500)
+            store.add(profile)
+
+    def forbidden():
+        return jsonify({'error': 'Forbidden', 'message': 'Requires an API key with admin permission'}), 403
+
+    def list_profiles():
+        if not authorize():
+            return forbidden()
+        profiles = store.recent()[::-1]
+        return jsonify({'success': True, 'count': len(profiles), 'profiles': [p.summary() for p in profiles]})
+
+    def get_profile(profile_id):
+        if not authorize():
+            return forbidden()
+        profile = store.get(profile_id)
+        if profile is None:
+            return jsonify({'error': 'Profile not found'}), 404
+        return jsonify(profile.to_dict())
+
+    app.add_url_rule('/debug/profiles', 'list_profiles', list_profiles)
+    app.add_url_rule('/debug/profiles/<profile_id>', 'get_profile', get_profile)
+    return store
@@ -0,0 +1,815 @@
+"""
+Local RAPTOR Trip Planner
+Round-based public transit routing over the RTD static feed, so trip
+planning works without Google Directions.
+
+The timetable is stored in flat arrays (the layout used by the RAPTOR
+paper): trips that share a stop sequence are grouped into patterns, and each
+pattern's times live in one contiguous block of arrival/departure arrays.
+Route scans then walk memory sequentially instead of chasing per-trip
+dictionaries.
+"""
+
+import bisect
+import math
+from array import array
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from spatial_index import METERS_PER_DEGREE_LAT, haversine_meters
+
+
+INFINITY = 2 ** 31 - 1
+
+WALK_SPEED_MPS = 1.1          # Straight-line walking speed (allows for street detours)
+MAX_TRANSFER_WALK_M = 400     # Longest walking transfer between stops
+MAX_ACCESS_WALK_M = 800       # Longest walk from origin/to destination
+MIN_TRANSFER_SECONDS = 60     # Time allowed to change vehicles at the same stop
+PROFILE_STEP_SECONDS = 120    # Departure spacing for windowed reachability searches
+MAX_GRID_CELLS = 40000        # Reachability grids are coarsened beyond this
+
+# GTFS route_type -> Google Directions vehicle type
+VEHICLE_TYPES = {
+    0: 'TRAM', 1: 'SUBWAY', 2: 'HEAVY_RAIL', 3: 'BUS', 4: 'FERRY',
+    5: 'CABLE_CAR', 6: 'GONDOLA_LIFT', 7: 'FUNICULAR', 11: 'TROLLEYBUS', 12: 'MONORAIL'
+}
+
+
+def parse_gtfs_time(value: str) -> Optional[int]:
+    """Convert a GTFS "HH:MM:SS" time (may exceed 24:00:00) to seconds after midnight"""
+    if not value:
+        return None
+    hours, minutes, seconds = value.strip().split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def format_clock(seconds: int) -> str:
+    """Format seconds after midnight like Google's time text (e.g. "8:05 AM")"""
+    seconds %= 24 * 3600
+    hour, minute = divmod(seconds // 60, 60)
+    suffix = 'AM' if hour < 12 else 'PM'
+    return f"{hour % 12 or 12}:{minute:02d} {suffix}"
+
+
+def format_duration(seconds: int) -> str:
+    """Format a duration like Google's text (e.g. "1 hour 5 mins")"""
+    minutes = max(1, int(round(seconds / 60)))
+    hours, minutes = divmod(minutes, 60)
+    parts = []
+    if hours:
+        parts.append(f"{hours} hour{'s' if hours != 1 else ''}")
+    if minutes or not hours:
+        parts.append(f"{minutes} min{'s' if minutes != 1 else ''}")
+    return ' '.join(parts)
+
+
+def format_distance(meters: float) -> str:
+    """Format a distance like Google's imperial text (e.g. "2.4 mi" or "500 ft")"""
+    miles = meters / 1609.34
+    if miles < 0.1:
+        return f"{int(round(meters * 3.28084))} ft"
+    return f"{miles:.1f} mi"
+
+
+class Timetable:
+    """
+    RAPTOR timetable built from one version of the static feed
+
+    Layout (all integer arrays):
+        pattern_stops         stop indexes of every pattern, pattern after pattern
+        pattern_stop_offset   start of each pattern's stops in pattern_stops
+        pattern_trip_offset   start of each pattern's trips in trip_ids
+        pattern_time_offset   start of each pattern's block in the time arrays
+        arrivals              trip-major: [trip0 stop0, trip0 stop1, ..., trip1 stop0, ...]
+                              (contiguous reads while riding a trip)
+        departures            stop-major: [stop0 trip0, stop0 trip1, ..., stop1 trip0, ...]
+                              (binary search for the first catchable trip at a stop)
+        stop_route_offset     CSR index: stop -> (pattern, position) pairs
+        transfer_offset       CSR index: stop -> walking transfers
+    """
+
+    def __init__(self, feed):
+        """
+        Args:
+            feed: StaticFeed to build from
+        """
+        self._build_stops(feed)
+        self._build_routes(feed)
+        self._build_patterns(feed)
+        self._build_services(feed)
+        self._build_transfers(feed)
+        self._active_cache: Dict[date, bytearray] = {}
+
+    # ------------------------------------------------------------------
+    # Construction
+
+    def _build_stops(self, feed):
+        self.stop_ids: List[str] = []
+        self.stop_names: List[str] = []
+        self.stop_lats = array('d')
+        self.stop_lngs = array('d')
+        self.stop_index: Dict[str, int] = {}
+
+        for stop in feed.stops:
+            try:
+                lat = float(stop.get('stop_lat') or 0)
+                lng = float(stop.get('stop_lon') or 0)
+            except ValueError:
+                continue
+            if not lat or not lng:
+                continue
+            self.stop_index[stop['stop_id']] = len(self.stop_ids)
+            self.stop_ids.append(stop['stop_id'])
+            self.stop_names.append(stop.get('stop_name', ''))
+            self.stop_lats.append(lat)
+            self.stop_lngs.append(lng)
+
+    def _build_routes(self, feed):
+        self.routes: Dict[str, Dict] = {route['route_id']: route for route in feed.routes}
+
+    def _build_patterns(self, feed):
+        trip_info = {}
+        for trip_id, route_id, service_id, headsign in feed.iter_rows(
+                'trips.txt', ('trip_id', 'route_id', 'service_id', 'trip_headsign')):
+            trip_info[trip_id] = (route_id, service_id, headsign)
+
+        # Collect stop_times into flat columns, then order them by (trip, sequence)
+        trip_numbers: Dict[str, int] = {}
+        trip_names: List[str] = []
+        rows_trip = array('i')
+        rows_seq = array('i')
+        rows_stop = array('i')
+        rows_arr = array('i')
+        rows_dep = array('i')
+        for trip_id, arrival, departure, stop_id, sequence in feed.iter_rows(
+                'stop_times.txt', ('trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence')):
+            stop = self.stop_index.get(stop_id)
+            if stop is None or trip_id not in trip_info:
+                continue
+            number = trip_numbers.get(trip_id)
+            if number is None:
+                number = trip_numbers[trip_id] = len(trip_names)
+                trip_names.append(trip_id)
+            arr = parse_gtfs_time(arrival)
+            dep = parse_gtfs_time(departure)
+            rows_trip.append(number)
+            rows_seq.append(int(sequence))
+            rows_stop.append(stop)
+            rows_arr.append(-1 if arr is None else arr)
+            rows_dep.append(-1 if dep is None else dep)
+
+        order = range(len(rows_trip))
+        if any(
+            (rows_trip[i], rows_seq[i]) > (rows_trip[i + 1], rows_seq[i + 1])
+            for i in range(len(rows_trip) - 1)
+        ):
+            order = sorted(order, key=lambda i: (rows_trip[i], rows_seq[i]))
+
+        # Group trips by (route, stop sequence)
+        groups: Dict[Tuple, List[Tuple[str, List[int], List[int]]]] = {}
+        current, stops, arrs, deps = None, [], [], []
+
+        def flush():
+            if current is None or len(stops) < 2:
+                return
+            trip_id = trip_names[current]
+            _interpolate(arrs, deps)
+            key = (trip_info[trip_id][0], tuple(stops))
+            groups.setdefault(key, []).append((trip_id, arrs, deps))
+
+        for i in order:
+            if rows_trip[i] != current:
+                flush()
+                current, stops, arrs, deps = rows_trip[i], [], [], []
+            stops.append(rows_stop[i])
+            arrs.append(rows_arr[i])
+            deps.append(rows_dep[i])
+        flush()
+
+        self.pattern_route: List[str] = []
+        self.pattern_stops = array('i')
+        self.pattern_stop_offset = array('i')
+        self.pattern_length = array('i')
+        self.pattern_trip_offset = array('i')
+        self.pattern_trip_count = array('i')
+        self.pattern_time_offset = array('i')
+        self.arrivals = array('i')
+        self.departures = array('i')
+        self.trip_ids: List[str] = []
+        self.trip_headsigns: List[str] = []
+        self.trip_service: List[str] = []
+
+        for (route_id, stop_seq), trips in groups.items():
+            trips.sort(key=lambda t: t[2][0])
+            # RAPTOR's binary search needs trips that never overtake each
+            # other; split a group into FIFO sub-patterns where they do
+            for sub_pattern in _split_overtaking(trips):
+                self._add_pattern(route_id, stop_seq, sub_pattern, trip_info)
+
+        # Latest time of day any trip leaves a stop (past 24:00 for overnight trips)
+        self.latest_departure = max(self.departures, default=0)
+
+        # stop -> [(pattern, position)] as a CSR index
+        served: List[List[Tuple[int, int]]] = [[] for _ in self.stop_ids]
+        for pattern in range(len(self.pattern_route)):
+            offset = self.pattern_stop_offset[pattern]
+            for position in range(self.pattern_length[pattern]):
+                served[self.pattern_stops[offset + position]].append((pattern, position))
+        self.stop_route_offset = array('i', [0])
+        self.stop_route_pattern = array('i')
+        self.stop_route_position = array('i')
+        for entries in served:
+            for pattern, position in entries:
+                self.stop_route_pattern.append(pattern)
+                self.stop_route_position.append(position)
+            self.stop_route_offset.append(len(self.stop_route_pattern))
+
+    def _add_pattern(self, route_id, stop_seq, trips, trip_info):
+        n_stops = len(stop_seq)
+        self.pattern_route.append(route_id)
+        self.pattern_stop_offset.append(len(self.pattern_stops))
+        self.pattern_length.append(n_stops)
+        self.pattern_stops.extend(stop_seq)
+        self.pattern_trip_offset.append(len(self.trip_ids))
+        self.pattern_trip_count.append(len(trips))
+        self.pattern_time_offset.append(len(self.arrivals))
+
+        for trip_id, arrs, _ in trips:
+            self.trip_ids.append(trip_id)
+            self.trip_service.append(trip_info[trip_id][1])
+            self.trip_headsigns.append(trip_info[trip_id][2])
+            self.arrivals.extend(arrs)
+        for position in range(n_stops):
+            self.departures.extend(deps[position] for _, _, deps in trips)
+
+    def _build_services(self, feed):
+        self.calendar = {}
+        for row in feed.table('calendar.txt'):
+            days = [row.get(day) == '1' for day in
+                    ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')]
+            self.calendar[row['service_id']] = (row.get('start_date', ''), row.get('end_date', ''), days)
+        self.calendar_dates: Dict[str, Dict[str, bool]] = {}
+        for row in feed.table('calendar_dates.txt'):
+            self.calendar_dates.setdefault(row['date'], {})[row['service_id']] = row.get('exception_type') == '1'
+
+    def _build_transfers(self, feed):
+        from spatial_index import GridIndex
+
+        grid = GridIndex(
+            ((i, self.stop_lats[i], self.stop_lngs[i]) for i in range(len(self.stop_ids))),
+            cell_size_m=MAX_TRANSFER_WALK_M
+        )
+        self.stop_grid = grid
+
+        explicit: Dict[int, Dict[int, int]] = {}
+        for row in feed.table('transfers.txt'):
+            origin = self.stop_index.get(row.get('from_stop_id'))
+            target = self.stop_index.get(row.get('to_stop_id'))
+            if origin is None or target is None or row.get('transfer_type') == '3' or origin == target:
+                continue
+            explicit.setdefault(origin, {})[target] = int(row.get('min_transfer_time') or 0)
+
+        self.transfer_offset = array('i', [0])
+        self.transfer_target = array('i')
+        self.transfer_seconds = array('i')
+        for stop in range(len(self.stop_ids)):
+            targets = dict(explicit.get(stop, {}))
+            for other, distance in grid.within(self.stop_lats[stop], self.stop_lngs[stop], MAX_TRANSFER_WALK_M):
+                if other != stop and other not in targets:
+                    targets[other] = int(distance / WALK_SPEED_MPS)
+            for other, seconds in sorted(targets.items()):
+                self.transfer_target.append(other)
+                self.transfer_seconds.append(seconds)
+            self.transfer_offset.append(len(self.transfer_target))
+
+    # ------------------------------------------------------------------
+    # Queries
+
+    def active_trips(self, service_date: date) -> bytearray:
+        """Mask over trip_ids of trips running on service_date"""
+        mask = self._active_cache.get(service_date)
+        if mask is not None:
+            return mask
+
+        day = service_date.strftime('%Y%m%d')
+        weekday = service_date.weekday()
+        exceptions = self.calendar_dates.get(day, {})
+        services = {}
+        for service_id in set(self.trip_service):
+            if service_id in exceptions:
+                services[service_id] = exceptions[service_id]
+                continue
+            start, end, days = self.calendar.get(service_id, ('', '', [False] * 7))
+            services[service_id] = days[weekday] and (not start or start <= day) and (not end or day <= end)
+
+        mask = bytearray(services[service_id] for service_id in self.trip_service)
+        if len(self._active_cache) > 7:
+            self._active_cache.clear()
+        self._active_cache[service_date] = mask
+        return mask
+
+    def nearby_stops(self, lat: float, lng: float, radius_m: float = MAX_ACCESS_WALK_M) -> Dict[int, int]:
+        """Stops within walking distance of a point, as {stop: walk_seconds}"""
+        return {stop: int(distance / WALK_SPEED_MPS) for stop, distance in self.stop_grid.within(lat, lng, radius_m)}
+
+    def earliest_arrival(
+        self,
+        access: Dict[int, int],
+        egress: Dict[int, int],
+        departure: int,
+        service_date: date,
+        max_transfers: int = 3
+    ) -> List[Dict]:
+        """
+        Run RAPTOR for one departure time
+
+        Args:
+            access: {stop: walk seconds} from the origin
+            egress: {stop: walk seconds} to the destination
+            departure: Departure time in seconds after midnight of service_date
+            service_date: Date whose trips are used
+            max_transfers: Maximum number of transfers
+
+        Returns:
+            Pareto-optimal journeys (each faster than any journey with fewer
+            transfers), fewest transfers first. Each journey is a dict with
+            'departure', 'arrival' and 'legs'.
+        """
+        _, journeys = self._raptor(access, departure, service_date, max_transfers, egress=egress)
+        return journeys
+
+    def _raptor(
+        self,
+        access: Dict[int, int],
+        departure: int,
+        service_date: date,
+        max_transfers: int,
+        egress: Optional[Dict[int, int]] = None,
+        arrival_limit: int = INFINITY
+    ) -> Tuple[List[int], List[Dict]]:
+        """
+        Core RAPTOR rounds
+
+        With egress, arrivals later than the best destination arrival found
+        so far are pruned and journeys are reconstructed. Without it this is
+        a one-to-all search bounded by arrival_limit.
+
+        Returns:
+            (best arrival time per stop, journeys)
+        """
+        n_stops = len(self.stop_ids)
+        active = self.active_trips(service_date)
+
+        best = [INFINITY] * n_stops
+        previous = [INFINITY] * n_stops
+        labels: List[Dict[int, Tuple]] = [{}]
+        marked = set()
+        for stop, seconds in access.items():
+            previous[stop] = best[stop] = departure + seconds
+            labels[0][stop] = ('access', seconds)
+            marked.add(stop)
+
+        pattern_stops = self.pattern_stops
+        stop_offset = self.pattern_stop_offset
+        lengths = self.pattern_length
+        trip_offset = self.pattern_trip_offset
+        trip_count = self.pattern_trip_count
+        time_offset = self.pattern_time_offset
+        arrivals = self.arrivals
+        departures = self.departures
+
+        target_best = arrival_limit
+        journeys = []
+        for round_number in range(1, max_transfers + 2):
+            current = list(previous)
+            round_labels: Dict[int, Tuple] = {}
+            labels.append(round_labels)
+
+            # Patterns to scan, from the earliest marked position
+            queue: Dict[int, int] = {}
+            for stop in marked:
+                for i in range(self.stop_route_offset[stop], self.stop_route_offset[stop + 1]):
+                    pattern = self.stop_route_pattern[i]
+                    position = self.stop_route_position[i]
+                    if position < queue.get(pattern, INFINITY):
+                        queue[pattern] = position
+            marked = set()
+
+            for pattern, start in queue.items():
+                length = lengths[pattern]
+                stops_base = stop_offset[pattern]
+                n_trips = trip_count[pattern]
+                times_base = time_offset[pattern]
+                first_trip = trip_offset[pattern]
+
+                trip = -1
+                trip_base = 0
+                board_position = 0
+                for position in range(start, length):
+                    stop = pattern_stops[stops_base + position]
+
+                    if trip >= 0:
+                        arrival = arrivals[trip_base + position]
+                        if arrival < best[stop] and arrival < target_best:
+                            current[stop] = best[stop] = arrival
+                            round_labels[stop] = ('ride', pattern, trip, board_position, position)
+                            marked.add(stop)
+
+                    # Can an earlier trip be caught here?
+                    ready = previous[stop]
+                    if ready == INFINITY:
+                        continue
+                    if round_number > 1 and _reached_by_ride(labels, round_number - 1, stop):
+                        ready += MIN_TRANSFER_SECONDS
+                    column = times_base + position * n_trips
+                    if trip >= 0 and departures[column + trip] < ready:
+                        continue
+                    candidate = _first_departure(departures, column, n_trips, ready)
+                    while candidate < n_trips and not active[first_trip + candidate]:
+                        candidate += 1
+                    if candidate < n_trips and (trip < 0 or candidate < trip):
+                        trip = candidate
+                        trip_base = times_base + trip * length
+                        board_position = position
+
+            # Walking transfers from stops improved by a ride this round
+            for stop in list(marked):
+                arrival = current[stop]
+                for i in range(self.transfer_offset[stop], self.transfer_offset[stop + 1]):
+                    target = self.transfer_target[i]
+                    walked = arrival + self.transfer_seconds[i]
+                    if walked < best[target] and walked < target_best:
+                        current[target] = best[target] = walked
+                        round_labels[target] = ('walk', stop, self.transfer_seconds[i])
+                        marked.add(target)
+
+            # Best way to finish at the destination with this many rides
+            finish_stop, finish = None, INFINITY
+            for stop, seconds in (egress or {}).items():
+                if current[stop] + seconds < finish:
+                    finish_stop, finish = stop, current[stop] + seconds
+            if finish_stop is not None and finish < target_best:
+                target_best = finish
+                journeys.append(self._reconstruct(labels, round_number, finish_stop, egress[finish_stop], departure))
+
+            previous = current
+            if not marked:
+                break
+
+        return best, journeys
+
+    def _reconstruct(self, labels, round_number, stop, egress_seconds, departure) -> Dict:
+        """Walk the labels back from the destination stop to build the legs"""
+        legs = [{'type': 'walk', 'from_stop': stop, 'to_stop': None, 'seconds': egress_seconds}]
+        k = round_number
+        while True:
+            while k > 0 and stop not in labels[k]:
+                k -= 1
+            label = labels[k][stop]
+            if label[0] == 'access':
+                legs.append({'type': 'walk', 'from_stop': None, 'to_stop': stop, 'seconds': label[1]})
+                break
+            if label[0] == 'walk':
+                _, origin, seconds = label
+                legs.append({'type': 'walk', 'from_stop': origin, 'to_stop': stop, 'seconds': seconds})
+                stop = origin
+                continue
+            _, pattern, trip, board, alight = label
+            stops_base = self.pattern_stop_offset[pattern]
+            n_trips = self.pattern_trip_count[pattern]
+            times_base = self.pattern_time_offset[pattern]
+            length = self.pattern_length[pattern]
+            legs.append({
+                'type': 'ride',
+                'pattern': pattern,
+                'trip_id': self.trip_ids[self.pattern_trip_offset[pattern] + trip],
+                'headsign': self.trip_headsigns[self.pattern_trip_offset[pattern] + trip],
+                'stops': [self.pattern_stops[stops_base + p] for p in range(board, alight + 1)],
+                'departure': self.departures[times_base + board * n_trips + trip],
+                'arrival': self.arrivals[times_base + trip * length + alight]
+            })
+            stop = self.pattern_stops[stops_base + board]
+            k -= 1
+
+        legs.reverse()
+        # Give walking legs absolute times by threading the clock through the journey
+        clock = departure
+        rides = [leg for leg in legs if leg['type'] == 'ride']
+        if rides:
+            # Leave just in time for the first vehicle
+            clock = rides[0]['departure'] - sum(leg['seconds'] for leg in legs[:legs.index(rides[0])])
+        for leg in legs:
+            if leg['type'] == 'ride':
+                clock = leg['arrival']
+            else:
+                leg['departure'] = clock
+                clock += leg['seconds']
+                leg['arrival'] = clock
+
+        return {'departure': legs[0]['departure'], 'arrival': legs[-1]['arrival'], 'legs': legs}
+
+    def plan(
+        self,
+        origin: Tuple[float, float],
+        destination: Tuple[float, float],
+        when: Optional[datetime] = None,
+        max_transfers: int = 3,
+        origin_name: str = '',
+        destination_name: str = ''
+    ) -> Dict:
+        """
+        Plan a trip between two coordinates
+
+        Args:
+            origin: (lat, lng) of the start
+            destination: (lat, lng) of the end
+            when: Departure time (default: now, local time)
+            max_transfers: Maximum number of transfers
+            origin_name: Label for start_address
+            destination_name: Label for end_address
+
+        Returns:
+            Dictionary shaped like GoogleTransitClient._parse_directions output:
+            {'status': 'OK' | 'ZERO_RESULTS', 'routes': [...]}
+        """
+        when = when or datetime.now()
+        departure = when.hour * 3600 + when.minute * 60 + when.second
+
+        access = self.nearby_stops(*origin)
+        egress = self.nearby_stops(*destination)
+
+        journeys = []
+        if access and egress:
+            journeys = self.earliest_arrival(access, egress, departure, when.date(), max_transfers)
+            # Trips running past midnight belong to the previous service day
+            if not journeys and departure < 6 * 3600:
+                yesterday = when.date() - timedelta(days=1)
+                journeys = self.earliest_arrival(access, egress, departure + 24 * 3600, yesterday, max_transfers)
+
+        routes = [
+            self._format_journey(journey, origin, destination, origin_name, destination_name)
+            for journey in journeys
+        ]
+        return {'status': 'OK' if routes else 'ZERO_RESULTS', 'routes': routes}
+
+    def reachability(
+        self,
+        lat: float,
+        lng: float,
+        when: Optional[datetime] = None,
+        minutes: int = 30,
+        max_transfers: int = 3,
+        window_minutes: int = 0,
+        grid_size_m: Optional[int] = None
+    ) -> Dict:
+        """
+        Find every stop reachable within a time budget (an isochrone)
+
+        Runs a one-to-all RAPTOR search from the point, leaving at when. Trips
+        of the previous service day still running at that time (GTFS times
+        past 24:00) are searched too. With window_minutes,
+        departures every PROFILE_STEP_SECONDS across the window are searched
+        (latest first) and each stop keeps its shortest travel time - a
+        sampled profile search, so a stop just missed at the exact departure
+        time still counts if a later departure gets there within budget.
+
+        Args:
+            lat: Origin latitude
+            lng: Origin longitude
+            when: Departure time (default: now)
+            minutes: Travel time budget
+            max_transfers: Maximum number of transfers
+            window_minutes: Width of the departure window (0 = leave exactly at when)
+            grid_size_m: Also return a grid of travel times with cells of this size
+
+        Returns:
+            Dictionary with 'stops' (stop_id, stop_name, lat, lng, minutes),
+            and 'grid' when grid_size_m is given
+        """
+        when = when or datetime.now()
+        departure = when.hour * 3600 + when.minute * 60 + when.second
+        budget = minutes * 60
+        n_stops = len(self.stop_ids)
+        access = self.nearby_stops(lat, lng)
+
+        # (service date, departure in that day's seconds): today, and
+        # yesterday while its after-midnight trips are still running
+        service_days = [(when.date(), departure)]
+        if departure + 24 * 3600 <= self.latest_departure:
+            service_days.append((when.date() - timedelta(days=1), departure + 24 * 3600))
+
+        travel = [INFINITY] * n_stops
+        for offset in range(window_minutes * 60, -1, -PROFILE_STEP_SECONDS):
+            for service_date, start in service_days:
+                leave = start + offset
+                best, _ = self._raptor(access, leave, service_date, max_transfers, arrival_limit=leave + budget + 1)
+                # Whole-array passes over the stops rather than per-stop lookups
+                travel = list(map(min, travel, [arrival - leave if arrival < INFINITY else INFINITY for arrival in best]))
+
+        reached = {stop: seconds for stop, seconds in enumerate(travel) if seconds <= budget}
+        stops = [
+            {
+                'stop_id': self.stop_ids[stop],
+                'stop_name': self.stop_names[stop],
+                'lat': self.stop_lats[stop],
+                'lng': self.stop_lngs[stop],
+                'minutes': round(seconds / 60, 1)
+            }
+            for stop, seconds in sorted(reached.items(), key=lambda item: item[1])
+        ]
+
+        result = {'stops': stops}
+        if grid_size_m:
+            result['grid'] = self._travel_grid(lat, lng, reached, budget, grid_size_m)
+        return result
+
+    def _travel_grid(self, lat: float, lng: float, reached: Dict[int, int], budget: int, cell_size_m: int) -> Dict:
+        """Rasterize travel times: each cell is the fastest stop arrival plus the walk to the cell"""
+        # Sources: the origin itself (walk only) and every reached stop
+        sources = [(lat, lng, 0)] + [(self.stop_lats[s], self.stop_lngs[s], t) for s, t in reached.items()]
+
+        pad_lat = MAX_ACCESS_WALK_M / METERS_PER_DEGREE_LAT
+        pad_lng = MAX_ACCESS_WALK_M / (METERS_PER_DEGREE_LAT * math.cos(math.radians(lat)))
+        south = min(s[0] for s in sources) - pad_lat
+        north = max(s[0] for s in sources) + pad_lat
+        west = min(s[1] for s in sources) - pad_lng
+        east = max(s[1] for s in sources) + pad_lng
+
+        # Coarsen the grid rather than return an unbounded number of cells
+        cell_size_m = max(cell_size_m, 50)
+        while True:
+            cell_lat = cell_size_m / METERS_PER_DEGREE_LAT
+            cell_lng = cell_size_m / (METERS_PER_DEGREE_LAT * math.cos(math.radians(lat)))
+            rows = int((north - south) / cell_lat) + 1
+            cols = int((east - west) / cell_lng) + 1
+            if rows * cols <= MAX_GRID_CELLS:
+                break
+            cell_size_m *= 2
+
+        cells = [INFINITY] * (rows * cols)
+        meters_per_lng = METERS_PER_DEGREE_LAT * math.cos(math.radians(lat))
+        for source_lat, source_lng, seconds in sources:
+            radius = min((budget - seconds) * WALK_SPEED_MPS, MAX_ACCESS_WALK_M)
+            row_min = max(0, int((source_lat - radius / METERS_PER_DEGREE_LAT - south) / cell_lat))
+            row_max = min(rows - 1, int((source_lat + radius / METERS_PER_DEGREE_LAT - south) / cell_lat))
+            col_min = max(0, int((source_lng - radius / meters_per_lng - west) / cell_lng))
+            col_max = min(cols - 1, int((source_lng + radius / meters_per_lng - west) / cell_lng))
+            for row in range(row_min, row_max + 1):
+                dy = (south + (row + 0.5) * cell_lat - source_lat) * METERS_PER_DEGREE_LAT
+                base = row * cols
+                for col in range(col_min, col_max + 1):
+                    dx = (west + (col + 0.5) * cell_lng - source_lng) * meters_per_lng
+                    distance = math.sqrt(dx * dx + dy * dy)
+                    if distance > radius:
+                        continue
+                    total = seconds + int(distance / WALK_SPEED_MPS)
+                    if total < cells[base + col]:
+                        cells[base + col] = total
+
+        return {
+            'south': south,
+            'west': west,
+            'cell_size_m': cell_size_m,
+            'cell_lat': cell_lat,
+            'cell_lng': cell_lng,
+            'rows': rows,
+            'cols': cols,
+            # Row-major from the south-west corner; None = not reachable
+            'minutes': [
+                [round(t / 60, 1) if t <= budget else None for t in cells[r * cols:(r + 1) * cols]]
+                for r in range(rows)
+            ]
+        }
+
+    def _stop_location(self, stop: int) -> Dict[str, float]:
+        return {'lat': self.stop_lats[stop], 'lng': self.stop_lngs[stop]}
+
+    def _format_journey(self, journey, origin, destination, origin_name, destination_name) -> Dict:
+        steps = []
+        total_distance = 0.0
+        summary = []
+        for leg in journey['legs']:
+            if leg['type'] == 'walk':
+                start = self._stop_location(leg['from_stop']) if leg['from_stop'] is not None else {'lat': origin[0], 'lng': origin[1]}
+                end = self._stop_location(leg['to_stop']) if leg['to_stop'] is not None else {'lat': destination[0], 'lng': destination[1]}
+                distance = haversine_meters(start['lat'], start['lng'], end['lat'], end['lng'])
+                if distance < 1:
+                    continue
+                total_distance += distance
+                target = self.stop_names[leg['to_stop']] if leg['to_stop'] is not None else (destination_name or 'destination')
+                steps.append({
+                    'travel_mode': 'WALKING',
+                    'duration': format_duration(leg['seconds']),
+                    'distance': format_distance(distance),
+                    'instructions': f"Walk to {target}",
+                    'start_location': start,
+                    'end_location': end
+                })
+                continue
+
+            route = self.routes.get(self.pattern_route[leg['pattern']], {})
+            short_name = route.get('route_short_name') or route.get('route_id', '')
+            summary.append(short_name)
+            distance = sum(
+                haversine_meters(self.stop_lats[a], self.stop_lngs[a], self.stop_lats[b], self.stop_lngs[b])
+                for a, b in zip(leg['stops'], leg['stops'][1:])
+            )
+            total_distance += distance
+            first, last = leg['stops'][0], leg['stops'][-1]
+            try:
+                route_type = int(route.get('route_type') or 3)
+            except ValueError:
+                route_type = 3
+            steps.append({
+                'travel_mode': 'TRANSIT',
+                'duration': format_duration(leg['arrival'] - leg['departure']),
+                'distance': format_distance(distance),
+                'instructions': f"{route.get('route_long_name') or short_name} towards {leg['headsign'] or self.stop_names[last]}",
+                'start_location': self._stop_location(first),
+                'end_location': self._stop_location(last),
+                'transit': {
+                    'line': route.get('route_long_name', ''),
+                    'line_short_name': short_name,
+                    'vehicle_type': VEHICLE_TYPES.get(route_type, 'BUS'),
+                    'departure_stop': self.stop_names[first],
+                    'arrival_stop': self.stop_names[last],
+                    'departure_time': format_clock(leg['departure']),
+                    'arrival_time': format_clock(leg['arrival']),
+                    'num_stops': len(leg['stops']) - 1,
+                    'headsign': leg['headsign'],
+                    'trip_id': leg['trip_id']
+                }
+            })
+
+        duration = journey['arrival'] - journey['departure']
+        return {
+            'summary': ' → '.join(summary),
+            'duration': format_duration(duration),
+            'duration_seconds': duration,
+            'distance': format_distance(total_distance),
+            'distance_meters': int(round(total_distance)),
+            'start_address': origin_name or f"{origin[0]},{origin[1]}",
+            'end_address': destination_name or f"{destination[0]},{destination[1]}",
+            'departure_time': format_clock(journey['departure']),
+            'arrival_time': format_clock(journey['arrival']),
+            'steps': steps
+        }
+
+
+def _reached_by_ride(labels, round_number, stop) -> bool:
+    """Whether the stop's latest label up to round_number is a ride (so boarding is a transfer)"""
+    for k in range(round_number, 0, -1):
+        label = labels[k].get(stop)
+        if label is not None:
+            return label[0] == 'ride'
+    return False
+
+
+def _first_departure(departures: array, column: int, n_trips: int, ready: int) -> int:
+    """Binary search one stop's departures for the first trip leaving at or after ready"""
+    lo, hi = 0, n_trips
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if departures[column + mid] < ready:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def _interpolate(arrs: List[int], deps: List[int]):
+    """Fill missing (-1) stop times by linear interpolation between timepoints"""
+    known = [i for i, value in enumerate(arrs) if value >= 0]
+    if not known:
+        return
+    for i in range(len(arrs)):
+        if arrs[i] >= 0:
+            if deps[i] < 0:
+                deps[i] = arrs[i]
+            continue
+        if deps[i] >= 0:
+            arrs[i] = deps[i]
+            continue
+        after = bisect.bisect_left(known, i)
+        if after == 0:
+            arrs[i] = deps[i] = arrs[known[0]]
+        elif after == len(known):
+            arrs[i] = deps[i] = deps[known[-1]]
+        else:
+            a, b = known[after - 1], known[after]
+            arrs[i] = deps[i] = deps[a] + (arrs[b] - deps[a]) * (i - a) // (b - a)
+
+
+def _split_overtaking(trips):
+    """Split trips (sorted by first departure) into groups where no trip overtakes another"""
+    groups: List[List] = []
+    for trip in trips:
+        deps = trip[2]
+        for group in groups:
+            last = group[-1][2]
+            if all(d >= l for d, l in zip(deps, last)):
+                group.append(trip)
+                break
+        else:
+            groups.append([trip])
+    return groups
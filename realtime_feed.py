@@ -0,0 +1,128 @@
+"""
+GTFS-realtime Feed Snapshots
+One downloaded version of a realtime feed, identified by its header timestamp
+"""
+
+import hashlib
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from google.transit import gtfs_realtime_pb2
+
+from memory_usage import CacheParts, measure
+from metrics import FEED_ENTITIES, FEED_PARSE_SECONDS, SNAPSHOT_CACHE
+from tracing import span
+
+# Snapshots handed out during the current request: feed_file -> (snapshot, stale)
+_served: ContextVar[Optional[Dict[str, Tuple['FeedSnapshot', bool]]]] = ContextVar('rtd_served', default=None)
+
+
+class FeedSnapshot:
+    """
+    A parsed GTFS-realtime feed and the values derived from it
+
+    RTD republishes each feed every few seconds, usually with the same
+    content. Snapshots with the same version are interchangeable, so the
+    client keeps the first one and anything derived from it (parsed
+    entities, serialized responses) is reused until the feed changes.
+    """
+
+    def __init__(self, feed_file: str, content: bytes):
+        """
+        Args:
+            feed_file: Feed file name (e.g., 'VehiclePosition.pb')
+            content: Raw protobuf bytes
+        """
+        self.feed_file = feed_file
+        self.message = gtfs_realtime_pb2.FeedMessage()
+        start = time.perf_counter()
+        with span('parse', feed=feed_file, bytes=len(content)) as s:
+            self.message.ParseFromString(content)
+            s.set(entities=len(self.message.entity))
+        FEED_PARSE_SECONDS.labels(feed_file).observe(time.perf_counter() - start)
+        FEED_ENTITIES.labels(feed_file).set(len(self.message.entity))
+        self.fetched_at = time.time()
+        # Last time upstream confirmed this is the current version
+        self.checked_at = self.fetched_at
+        self.size = len(content)
+        self.timestamp: Optional[int] = (
+            self.message.header.timestamp if self.message.header.HasField('timestamp') else None
+        )
+        self.version = self._compute_version(content)
+        self._derived: Dict[str, object] = {}
+        self._lock = threading.RLock()
+
+    def _compute_version(self, content: bytes) -> str:
+        """Use the header timestamp when present, else a content hash"""
+        if self.timestamp:
+            return str(self.timestamp)
+        return hashlib.sha1(content).hexdigest()[:12]
+
+    def derived(self, name, builder):
+        """
+        Get a value derived from this snapshot, building it on first use
+
+        Args:
+            name: Cache key for the derived value
+            builder: Zero-argument callable that builds the value
+        """
+        kind = name if isinstance(name, str) else name[0]
+        value = self._derived.get(name)
+        if value is None:
+            with self._lock:
+                value = self._derived.get(name)
+                if value is None:
+                    SNAPSHOT_CACHE.labels(kind, 'miss').inc()
+                    with span('build', kind=kind, feed=self.feed_file), measure(f'{self.feed_file}:{kind}'):
+                        value = builder()
+                    self._derived[name] = value
+                    return value
+        SNAPSHOT_CACHE.labels(kind, 'hit').inc()
+        return value
+
+    def memory_parts(self) -> CacheParts:
+        """Derived values (and the message's wire size), for /debug/memory"""
+        parts = CacheParts(message=self.size)
+        for name, value in list(self._derived.items()):
+            parts[name if isinstance(name, str) else ':'.join(str(n) for n in name)] = value
+        return parts
+
+    def subset(self, keep=None) -> gtfs_realtime_pb2.FeedMessage:
+        """
+        A FeedMessage with the same header and only some of the entities
+
+        Args:
+            keep: Function(FeedEntity) -> bool selecting the entities to copy
+                  (default: the whole feed)
+
+        Returns:
+            A new FeedMessage, or the snapshot's own message when keep is None
+            (treat it as read-only)
+        """
+        if keep is None:
+            return self.message
+        message = gtfs_realtime_pb2.FeedMessage()
+        message.header.CopyFrom(self.message.header)
+        for entity in self.message.entity:
+            if keep(entity):
+                message.entity.add().CopyFrom(entity)
+        return message
+
+
+def track_served():
+    """Start recording the snapshots served in this context (returns a token for _served.reset)"""
+    return _served.set({})
+
+
+def note_served(snapshot: FeedSnapshot, stale: bool):
+    """Record that a snapshot was served, and whether a refresh since it was checked failed"""
+    served = _served.get()
+    if served is not None:
+        served[snapshot.feed_file] = (snapshot, stale)
+
+
+def served_snapshots() -> Dict[str, Tuple[FeedSnapshot, bool]]:
+    """Snapshots served since track_served(): feed_file -> (snapshot, stale)"""
+    return _served.get() or {}
@@ -9,6 +9,7 @@ from datetime import datetime
 from typing import Dict, List, Optional
 from collections import defaultdict
 import math
+from tracing import span
 
 
 class RouteDetailsClient:
@@ -351,6 +352,10 @@ class RouteDetailsClient:
         Returns:
             Vehicle data enriched with stop information
         """
+        with span('enrich', route_id=route_id, vehicle_id=vehicle.get('vehicle_id')):
+            return self._enrich_vehicle(vehicle, route_id)
+    
+    def _enrich_vehicle(self, vehicle: Dict, route_id: str) -> Dict:
         route_info = self.get_route_info(route_id)
         stops = route_info['stops']
         
@@ -4,19 +4,319 @@ Provides access to RTD's GTFS static and real-time transit data
 """
 
 import requests
-from google.transit import gtfs_realtime_pb2
-import zipfile
-import io
-import csv
+import threading
+import time
+from datetime import datetime
+from cache_store import LRUCache
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from gtfs_static import StaticFeed
+from memory_usage import id_sharer
+from metrics import UPSTREAM_BYTES, UPSTREAM_CIRCUIT_OPEN, UPSTREAM_ERRORS, UPSTREAM_SECONDS
+from tracing import span
+from raptor import Timetable
+from realtime_feed import FeedSnapshot, note_served
+from spatial_index import GridIndex, parse_coordinates
+from singleflight import SingleFlight
 
 
 class RTDClient:
     """Client for accessing RTD Denver's transportation APIs"""
     
-    def __init__(self):
+    def __init__(self, static_max_age=3600, realtime_max_age=5, realtime_max_stale=60,
+                 failure_threshold=3, reset_timeout=30):
+        """
+        Args:
+            static_max_age: Seconds before the cached static feed is re-checked
+                            against the server in the background (default: 1 hour)
+            realtime_max_age: Seconds a realtime snapshot is served without
+                              re-checking; older ones are still served while a
+                              background refresh runs (default: 5)
+            realtime_max_stale: Seconds after which a served snapshot is marked
+                                stale even if no refresh has failed yet (default: 60)
+            failure_threshold: Failed downloads in a row that stop further
+                               requests to that feed (default: 3)
+            reset_timeout: Seconds before a stopped feed is probed again (default: 30)
+        """
         self.static_feed_url = "https://www.rtd-denver.com/google_sync/google_transit.zip"
         self.realtime_base_url = "https://www.rtd-denver.com/google_sync/"
+        self.static_max_age = static_max_age
+        self._static_feed = None
+        self._static_checked_at = None
+        self._snapshots = {}
+        self.realtime_max_age = realtime_max_age
+        self.realtime_max_stale = realtime_max_stale
+        # One breaker per feed; realtime failures are recorded with their time
+        self.static_breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.breakers = {
+            feed_file: CircuitBreaker(failure_threshold, reset_timeout)
+            for feed_file in ('VehiclePosition.pb', 'TripUpdate.pb', 'Alert.pb')
+        }
+        self._failed_at = {}
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+        # Concurrent identical upstream requests share one download
+        self.single_flight = SingleFlight()
+        # Reachability results per (origin, parameters, departure time)
+        self.reachability_cache = LRUCache(256)
+    
+    def get_static_feed(self):
+        """
+        Get the GTFS static feed, downloading it only when needed
+        
+        The feed is cached in memory and returned right away; once
+        static_max_age has passed it is re-validated with a conditional
+        request in the background. Only the first call waits for the
+        download, and after failure_threshold failed downloads the static
+        circuit opens, so even that returns None at once until reset_timeout
+        has passed. Parsed tables and search indexes live on the returned
+        StaticFeed, so they are built once per feed version.
+        
+        Returns:
+            StaticFeed instance, or None if no feed could be downloaded
+        """
+        feed = self._static_feed
+        if feed is not None:
+            self._revalidate_static_feed()
+            return feed
+        
+        return self.single_flight.do('static_feed', self._refresh_static_feed)
+    
+    def current_static_feed(self):
+        """
+        The loaded static feed, without ever waiting for a download
+        
+        Used for ETags and response cache keys of realtime endpoints.
+        Returns None until a feed has been loaded (a background download is
+        started), and re-validates like get_static_feed().
+        """
+        if self._static_feed is None:
+            self._refresh_in_background('static_feed', self.static_breaker, self._refresh_static_feed)
+        else:
+            self._revalidate_static_feed()
+        return self._static_feed
+    
+    def _revalidate_static_feed(self):
+        if time.time() - self._static_checked_at >= self.static_max_age:
+            self._refresh_in_background('static_feed', self.static_breaker, self._refresh_static_feed)
+    
+    def _refresh_static_feed(self):
+        """Download (or re-validate) the static feed through its circuit breaker"""
+        if not self.static_breaker.allow():
+            return self._static_feed
+        now = time.time()
+        headers = {}
+        if self._static_feed is not None:
+            if self._static_feed.etag:
+                headers['If-None-Match'] = self._static_feed.etag
+            if self._static_feed.last_modified:
+                headers['If-Modified-Since'] = self._static_feed.last_modified
+        
+        try:
+            response = self._get('google_transit.zip', self.static_feed_url, headers=headers, timeout=30)
+            if response.status_code == 304 and self._static_feed is not None:
+                self._static_checked_at = now
+                self.static_breaker.record_success()
+                return self._static_feed
+            response.raise_for_status()
+            
+            feed = StaticFeed(
+                response.content,
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified')
+            )
+            # Set first: other threads read it as soon as a feed is visible
+            self._static_checked_at = now
+            # Keep the old object (and its indexes) if nothing changed
+            if self._static_feed is None or feed.version != self._static_feed.version:
+                self._static_feed = feed
+            self.static_breaker.record_success()
+        except Exception as e:
+            print(f"Error downloading static data: {e}")
+            self.static_breaker.record_failure(e)
+            self._failed_at['google_transit.zip'] = now
+            if self._static_feed is not None:
+                # Serve the old version and retry after another interval
+                self._static_checked_at = now
+        
+        return self._static_feed
+    
+    def get_snapshot(self, feed_file):
+        """
+        Get the current version of a GTFS-realtime feed
+        
+        Stale-while-revalidate: the last good snapshot is returned right
+        away, and once it is older than realtime_max_age a background
+        download replaces it. Only the first call, when there is no snapshot
+        at all, waits for RTD; a snapshot older than realtime_max_stale is
+        still served, marked stale. While the header timestamp is unchanged the previously
+        returned FeedSnapshot - and everything derived from it - is reused.
+        
+        After failure_threshold failed downloads the feed's circuit opens:
+        RTD is not called (and its timeout not waited out) until a
+        background probe after reset_timeout succeeds. Meanwhile the last
+        good snapshot is served, marked stale (see feed_status()).
+        
+        Args:
+            feed_file: Feed file name (e.g., 'VehiclePosition.pb')
+        
+        Returns:
+            FeedSnapshot instance, or None if there is no snapshot to serve
+        """
+        try:
+            return self._fetch_snapshot(feed_file)
+        except Exception as e:
+            print(f"Error fetching {feed_file}: {e}")
+            return None
+    
+    def _fetch_snapshot(self, feed_file):
+        """Like get_snapshot(), but raises when there is no snapshot to serve"""
+        snapshot = self._snapshots.get(feed_file)
+        if snapshot is None:
+            snapshot = self.single_flight.do(('realtime', feed_file), self._refresh_feed, feed_file)
+            note_served(snapshot, self.is_stale(snapshot))
+            return snapshot
+        
+        age = time.time() - snapshot.checked_at
+        if age >= self.realtime_max_age:
+            self._refresh_in_background(('realtime', feed_file), self.breakers[feed_file],
+                                        self._refresh_feed, feed_file)
+        note_served(snapshot, self.is_stale(snapshot) or age >= self.realtime_max_stale)
+        return snapshot
+    
+    def _refresh_feed(self, feed_file):
+        """Download a feed through its circuit breaker"""
+        breaker = self.breakers[feed_file]
+        if not breaker.allow():
+            raise CircuitOpenError(f"{feed_file} is failing, next attempt in {breaker.retry_in():.0f}s")
+        try:
+            snapshot = self._download_feed(feed_file)
+        except Exception as e:
+            self._failed_at[feed_file] = time.time()
+            breaker.record_failure(e)
+            UPSTREAM_CIRCUIT_OPEN.labels(feed_file).set(1 if breaker.state == CircuitBreaker.OPEN else 0)
+            raise
+        breaker.record_success()
+        UPSTREAM_CIRCUIT_OPEN.labels(feed_file).set(0)
+        return snapshot
+    
+    def _refresh_in_background(self, key, breaker, refresh, *args):
+        """Run refresh(*args) in a background thread, unless one is running for key or the circuit is open"""
+        if not breaker.ready():
+            return
+        with self._refresh_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        threading.Thread(target=self._background_refresh, args=(key, refresh) + args,
+                         name=f'refresh-{key}', daemon=True).start()
+    
+    def _background_refresh(self, key, refresh, *args):
+        try:
+            self.single_flight.do(key, refresh, *args)
+        except CircuitOpenError:
+            pass
+        except Exception as e:
+            print(f"Error refreshing {key}: {e}")
+        finally:
+            with self._refresh_lock:
+                self._refreshing.discard(key)
+    
+    def is_stale(self, snapshot):
+        """Whether a download of the snapshot's feed has failed since the snapshot was last confirmed"""
+        return self._failed_at.get(snapshot.feed_file, 0) > snapshot.checked_at
+    
+    def feed_status(self):
+        """
+        Age, staleness and circuit state of each realtime feed and the static feed
+        
+        Returns:
+            Dictionary keyed by feed file name
+        """
+        now = time.time()
+        status = {}
+        for feed_file, breaker in self.breakers.items():
+            snapshot = self._snapshots.get(feed_file)
+            status[feed_file] = {
+                'age_seconds': round(now - snapshot.checked_at, 1) if snapshot else None,
+                'stale': (self.is_stale(snapshot) or now - snapshot.checked_at >= self.realtime_max_stale)
+                         if snapshot else None,
+                'refreshing': ('realtime', feed_file) in self._refreshing,
+                'circuit': breaker.stats(),
+            }
+        status['google_transit.zip'] = {
+            'age_seconds': round(now - self._static_checked_at, 1) if self._static_feed else None,
+            'stale': self._failed_at.get('google_transit.zip', 0) >= self._static_checked_at if self._static_feed else None,
+            'refreshing': 'static_feed' in self._refreshing,
+            'circuit': self.static_breaker.stats(),
+        }
+        return status
+    
+    def _fetch_feed(self, feed_file):
+        """
+        Download and parse a GTFS-realtime feed
+        
+        The returned FeedMessage may be shared, so treat it as read-only.
         
+        Args:
+            feed_file: Feed file name (e.g., 'VehiclePosition.pb')
+        
+        Returns:
+            Parsed FeedMessage (raises on network or parse errors)
+        """
+        return self._fetch_snapshot(feed_file).message
+    
+    def _download_feed(self, feed_file):
+        response = self._get(feed_file, f"{self.realtime_base_url}{feed_file}", timeout=10)
+        response.raise_for_status()
+        
+        snapshot = FeedSnapshot(feed_file, response.content)
+        previous = self._snapshots.get(feed_file)
+        if previous is not None and previous.version == snapshot.version:
+            previous.checked_at = snapshot.fetched_at
+            return previous
+        self._snapshots[feed_file] = snapshot
+        return snapshot
+        
+    def memory_caches(self):
+        """
+        Getters for what this client keeps in memory, for /debug/memory
+        
+        Nothing is fetched: feeds that have not been loaded size as empty.
+        """
+        def static_feed():
+            feed = self._static_feed
+            return feed.memory_parts() if feed is not None else None
+        
+        def snapshot(feed_file):
+            return lambda: self._snapshots[feed_file].memory_parts() if feed_file in self._snapshots else None
+        
+        return {
+            'static_feed': static_feed,
+            'vehicle_positions': snapshot('VehiclePosition.pb'),
+            'trip_updates': snapshot('TripUpdate.pb'),
+            'alerts': snapshot('Alert.pb'),
+            'reachability': lambda: self.reachability_cache,
+        }
+    
+    def _get(self, feed, url, **kwargs):
+        """requests.get() with download time, bytes and errors recorded per feed"""
+        start = time.perf_counter()
+        try:
+            with span('upstream', feed=feed) as s:
+                response = requests.get(url, **kwargs)
+                s.set(status_code=response.status_code, bytes=len(response.content))
+                if response.status_code >= 400:
+                    s.fail(f'HTTP {response.status_code}')
+        except Exception:
+            UPSTREAM_ERRORS.labels(feed).inc()
+            raise
+        finally:
+            UPSTREAM_SECONDS.labels(feed).observe(time.perf_counter() - start)
+        if response.status_code >= 400:
+            UPSTREAM_ERRORS.labels(feed).inc()
+        UPSTREAM_BYTES.labels(feed).inc(len(response.content))
+        return response
+    
     def get_static_data(self, extract_files=None):
         """
         Download GTFS static feed
@@ -28,194 +328,269 @@ class RTDClient:
         Returns:
             Dictionary with file names as keys and content as values
         """
-        try:
-            response = requests.get(self.static_feed_url, timeout=30)
-            response.raise_for_status()
-            
-            data = {}
-            with zipfile.ZipFile(io.BytesIO(response.content)) as zip_file:
-                files_to_extract = extract_files or zip_file.namelist()
-                
-                for file_name in files_to_extract:
-                    if file_name in zip_file.namelist():
-                        data[file_name] = zip_file.read(file_name).decode('utf-8')
-                    else:
-                        print(f"Warning: {file_name} not found in ZIP")
-            
-            return data
-        except Exception as e:
-            print(f"Error downloading static data: {e}")
+        feed = self.get_static_feed()
+        if feed is None:
             return None
+        
+        data = {}
+        for file_name in extract_files or feed.namelist():
+            content = feed.read_file(file_name)
+            if content is not None:
+                data[file_name] = content
+            else:
+                print(f"Warning: {file_name} not found in ZIP")
+        
+        return data
     
     def parse_stops(self):
         """
         Get all RTD stops
         
         Returns:
-            List of dictionaries containing stop information
+            List of dictionaries containing stop information (copies, so
+            callers may change them without touching the feed's table)
         """
-        data = self.get_static_data(['stops.txt'])
-        if not data or 'stops.txt' not in data:
+        feed = self.get_static_feed()
+        if feed is None or not feed.stops:
             return None
         
-        stops = []
-        reader = csv.DictReader(io.StringIO(data['stops.txt']))
-        for row in reader:
-            stops.append(row)
-        
-        return stops
+        return [dict(stop) for stop in feed.stops]
     
     def parse_routes(self):
         """
         Get all RTD routes
         
         Returns:
-            List of dictionaries containing route information
+            List of dictionaries containing route information (copies)
         """
-        data = self.get_static_data(['routes.txt'])
-        if not data or 'routes.txt' not in data:
+        feed = self.get_static_feed()
+        if feed is None or not feed.routes:
             return None
         
-        routes = []
-        reader = csv.DictReader(io.StringIO(data['routes.txt']))
-        for row in reader:
-            routes.append(row)
-        
-        return routes
+        return [dict(route) for route in feed.routes]
     
-    def get_vehicle_positions(self):
+    def get_vehicle_positions(self, snapshot=None):
         """
         Get real-time vehicle positions
         
+        Args:
+            snapshot: VehiclePosition FeedSnapshot to read (default: fetch the current one)
+        
         Returns:
             List of dictionaries containing vehicle position data
         """
-        url = f"{self.realtime_base_url}VehiclePosition.pb"
+        try:
+            if snapshot is None:
+                snapshot = self._fetch_snapshot('VehiclePosition.pb')
+            # Parsed once per snapshot; callers get their own copies to modify
+            return [dict(v) for v in self._snapshot_vehicles(snapshot)]
+        except Exception as e:
+            print(f"Error fetching vehicle positions: {e}")
+            return None
+    
+    def _snapshot_vehicles(self, snapshot):
+        return snapshot.derived('vehicles', lambda: self._parse_vehicles(snapshot.message))
+    
+    def _parse_vehicles(self, feed):
+        return list(self._iter_vehicles(feed))
+    
+    def _shared_ids(self):
+        """Sharer for the ids of one parsed feed, reusing the static feed's strings (see memory_usage)"""
+        feed = self._static_feed
+        return id_sharer(feed.ids if feed is not None else {})
+    
+    def _iter_vehicles(self, feed):
+        share = self._shared_ids()
+        for entity in feed.entity:
+            if entity.HasField('vehicle'):
+                yield {
+                    'vehicle_id': entity.vehicle.vehicle.id if entity.vehicle.vehicle.HasField('id') else None,
+                    'route_id': share(entity.vehicle.trip.route_id) if entity.vehicle.trip.HasField('route_id') else None,
+                    'trip_id': share(entity.vehicle.trip.trip_id) if entity.vehicle.trip.HasField('trip_id') else None,
+                    'latitude': entity.vehicle.position.latitude if entity.vehicle.position.HasField('latitude') else None,
+                    'longitude': entity.vehicle.position.longitude if entity.vehicle.position.HasField('longitude') else None,
+                    'bearing': entity.vehicle.position.bearing if entity.vehicle.position.HasField('bearing') else None,
+                    'speed': entity.vehicle.position.speed if entity.vehicle.position.HasField('speed') else None,
+                    'timestamp': entity.vehicle.timestamp if entity.vehicle.HasField('timestamp') else None
+                }
+    
+    def iter_records(self, snapshot):
+        """
+        Yield the records of a realtime snapshot one at a time
+        
+        Each entity is converted as it is reached and nothing is kept, so
+        memory use does not grow with the size of the feed (unlike
+        get_vehicle_positions() and friends, which build and cache the whole
+        list). Used for bulk exports.
+        
+        Args:
+            snapshot: VehiclePosition, TripUpdate or Alert FeedSnapshot
+        
+        Returns:
+            Iterator of vehicle, trip update or alert dictionaries (same
+            shape as the get_* methods)
+        """
+        parsers = {
+            'VehiclePosition.pb': self._iter_vehicles,
+            'TripUpdate.pb': self._iter_trip_updates,
+            'Alert.pb': self._iter_alerts,
+        }
+        return parsers[snapshot.feed_file](snapshot.message)
+    
+    def find_vehicles(self, bbox=None, near=None, radius=1000, snapshot=None):
+        """
+        Find vehicles inside a bounding box and/or near a point
+        
+        Served from a grid index built once per snapshot, so the cost
+        depends on the number of vehicles in the area, not the fleet size.
         
+        Args:
+            bbox: (min_lat, min_lng, max_lat, max_lng) tuple
+            near: (lat, lng) tuple of a search center
+            radius: Search radius around near in meters (default: 1000)
+            snapshot: VehiclePosition FeedSnapshot to read (default: fetch the current one)
+        
+        Returns:
+            List of vehicle dictionaries (feed order for bbox; nearest first
+            with an added 'distance_meters' for near), or None if the feed
+            is unavailable
+        """
         try:
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            
-            feed = gtfs_realtime_pb2.FeedMessage()
-            feed.ParseFromString(response.content)
-            
-            vehicles = []
-            for entity in feed.entity:
-                if entity.HasField('vehicle'):
-                    vehicle_data = {
-                        'vehicle_id': entity.vehicle.vehicle.id if entity.vehicle.vehicle.HasField('id') else None,
-                        'route_id': entity.vehicle.trip.route_id if entity.vehicle.trip.HasField('route_id') else None,
-                        'trip_id': entity.vehicle.trip.trip_id if entity.vehicle.trip.HasField('trip_id') else None,
-                        'latitude': entity.vehicle.position.latitude if entity.vehicle.position.HasField('latitude') else None,
-                        'longitude': entity.vehicle.position.longitude if entity.vehicle.position.HasField('longitude') else None,
-                        'bearing': entity.vehicle.position.bearing if entity.vehicle.position.HasField('bearing') else None,
-                        'speed': entity.vehicle.position.speed if entity.vehicle.position.HasField('speed') else None,
-                        'timestamp': entity.vehicle.timestamp if entity.vehicle.HasField('timestamp') else None
-                    }
-                    vehicles.append(vehicle_data)
-            
-            return vehicles
+            if snapshot is None:
+                snapshot = self._fetch_snapshot('VehiclePosition.pb')
+            vehicles = self._snapshot_vehicles(snapshot)
+            grid = snapshot.derived('vehicle_grid', lambda: GridIndex(
+                (i, v['latitude'], v['longitude'])
+                for i, v in enumerate(vehicles)
+                if v['latitude'] is not None and v['longitude'] is not None
+            ))
         except Exception as e:
             print(f"Error fetching vehicle positions: {e}")
             return None
+        
+        if near is not None:
+            results = []
+            for i, distance in grid.within(near[0], near[1], radius):
+                vehicle = vehicles[i]
+                if bbox is not None and not (bbox[0] <= vehicle['latitude'] <= bbox[2] and bbox[1] <= vehicle['longitude'] <= bbox[3]):
+                    continue
+                vehicle = dict(vehicle)
+                vehicle['distance_meters'] = round(distance, 1)
+                results.append(vehicle)
+            return results
+        
+        if bbox is not None:
+            return [dict(vehicles[i]) for i in sorted(grid.in_bbox(*bbox))]
+        
+        return [dict(v) for v in vehicles]
     
-    def get_trip_updates(self):
+    def get_trip_updates(self, snapshot=None):
         """
         Get real-time trip updates (delays, cancellations, etc.)
         
+        Args:
+            snapshot: TripUpdate FeedSnapshot to read (default: fetch the current one)
+        
         Returns:
             List of dictionaries containing trip update data
         """
-        url = f"{self.realtime_base_url}TripUpdate.pb"
-        
         try:
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            
-            feed = gtfs_realtime_pb2.FeedMessage()
-            feed.ParseFromString(response.content)
-            
-            updates = []
-            for entity in feed.entity:
-                if entity.HasField('trip_update'):
-                    trip_update = entity.trip_update
-                    
-                    stop_time_updates = []
-                    for stu in trip_update.stop_time_update:
-                        stop_update = {
-                            'stop_id': stu.stop_id if stu.HasField('stop_id') else None,
-                            'arrival_delay': stu.arrival.delay if stu.HasField('arrival') and stu.arrival.HasField('delay') else None,
-                            'arrival_time': stu.arrival.time if stu.HasField('arrival') and stu.arrival.HasField('time') else None,
-                            'departure_delay': stu.departure.delay if stu.HasField('departure') and stu.departure.HasField('delay') else None,
-                            'departure_time': stu.departure.time if stu.HasField('departure') and stu.departure.HasField('time') else None,
-                        }
-                        stop_time_updates.append(stop_update)
-                    
-                    update_data = {
-                        'trip_id': trip_update.trip.trip_id if trip_update.trip.HasField('trip_id') else None,
-                        'route_id': trip_update.trip.route_id if trip_update.trip.HasField('route_id') else None,
-                        'vehicle_id': trip_update.vehicle.id if trip_update.HasField('vehicle') and trip_update.vehicle.HasField('id') else None,
-                        'stop_time_updates': stop_time_updates
-                    }
-                    updates.append(update_data)
-            
-            return updates
+            if snapshot is None:
+                snapshot = self._fetch_snapshot('TripUpdate.pb')
+            return [dict(u) for u in self._snapshot_trip_updates(snapshot)]
         except Exception as e:
             print(f"Error fetching trip updates: {e}")
             return None
     
-    def get_alerts(self):
+    def _snapshot_trip_updates(self, snapshot):
+        return snapshot.derived('trip_updates', lambda: self._parse_trip_updates(snapshot.message))
+    
+    def _parse_trip_updates(self, feed):
+        return list(self._iter_trip_updates(feed))
+    
+    def _iter_trip_updates(self, feed):
+        share = self._shared_ids()
+        for entity in feed.entity:
+            if entity.HasField('trip_update'):
+                yield self._trip_update_dict(entity.trip_update, share)
+    
+    def _trip_update_dict(self, trip_update, share):
+        stop_time_updates = []
+        for stu in trip_update.stop_time_update:
+            stop_update = {
+                'stop_id': share(stu.stop_id) if stu.HasField('stop_id') else None,
+                'arrival_delay': stu.arrival.delay if stu.HasField('arrival') and stu.arrival.HasField('delay') else None,
+                'arrival_time': stu.arrival.time if stu.HasField('arrival') and stu.arrival.HasField('time') else None,
+                'departure_delay': stu.departure.delay if stu.HasField('departure') and stu.departure.HasField('delay') else None,
+                'departure_time': stu.departure.time if stu.HasField('departure') and stu.departure.HasField('time') else None,
+            }
+            stop_time_updates.append(stop_update)
+        
+        return {
+            'trip_id': share(trip_update.trip.trip_id) if trip_update.trip.HasField('trip_id') else None,
+            'route_id': share(trip_update.trip.route_id) if trip_update.trip.HasField('route_id') else None,
+            'vehicle_id': trip_update.vehicle.id if trip_update.HasField('vehicle') and trip_update.vehicle.HasField('id') else None,
+            'stop_time_updates': stop_time_updates
+        }
+    
+    def get_alerts(self, snapshot=None):
         """
         Get service alerts
         
+        Args:
+            snapshot: Alert FeedSnapshot to read (default: fetch the current one)
+        
         Returns:
             List of dictionaries containing alert information
         """
-        url = f"{self.realtime_base_url}Alert.pb"
-        
         try:
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            
-            feed = gtfs_realtime_pb2.FeedMessage()
-            feed.ParseFromString(response.content)
-            
-            alerts = []
-            for entity in feed.entity:
-                if entity.HasField('alert'):
-                    alert = entity.alert
-                    
-                    # Extract header text
-                    header = ''
-                    if alert.HasField('header_text') and len(alert.header_text.translation) > 0:
-                        header = alert.header_text.translation[0].text
-                    
-                    # Extract description text
-                    description = ''
-                    if alert.HasField('description_text') and len(alert.description_text.translation) > 0:
-                        description = alert.description_text.translation[0].text
-                    
-                    # Extract affected routes
-                    affected_routes = []
-                    for informed_entity in alert.informed_entity:
-                        if informed_entity.HasField('route_id'):
-                            affected_routes.append(informed_entity.route_id)
-                    
-                    alert_data = {
-                        'id': entity.id,
-                        'header': header,
-                        'description': description,
-                        'affected_routes': list(set(affected_routes)),  # Remove duplicates
-                        'cause': alert.cause if alert.HasField('cause') else None,
-                        'effect': alert.effect if alert.HasField('effect') else None,
-                    }
-                    alerts.append(alert_data)
-            
-            return alerts
+            if snapshot is None:
+                snapshot = self._fetch_snapshot('Alert.pb')
+            return [dict(a) for a in self._snapshot_alerts(snapshot)]
         except Exception as e:
             print(f"Error fetching alerts: {e}")
             return None
     
+    def _snapshot_alerts(self, snapshot):
+        return snapshot.derived('alerts', lambda: self._parse_alerts(snapshot.message))
+    
+    def _parse_alerts(self, feed):
+        return list(self._iter_alerts(feed))
+    
+    def _iter_alerts(self, feed):
+        share = self._shared_ids()
+        for entity in feed.entity:
+            if entity.HasField('alert'):
+                yield self._alert_dict(entity, share)
+    
+    def _alert_dict(self, entity, share):
+        alert = entity.alert
+        
+        # Extract header text
+        header = ''
+        if alert.HasField('header_text') and len(alert.header_text.translation) > 0:
+            header = alert.header_text.translation[0].text
+        
+        # Extract description text
+        description = ''
+        if alert.HasField('description_text') and len(alert.description_text.translation) > 0:
+            description = alert.description_text.translation[0].text
+        
+        # Extract affected routes
+        affected_routes = []
+        for informed_entity in alert.informed_entity:
+            if informed_entity.HasField('route_id'):
+                affected_routes.append(share(informed_entity.route_id))
+        
+        return {
+            'id': entity.id,
+            'header': header,
+            'description': description,
+            'affected_routes': list(set(affected_routes)),  # Remove duplicates
+            'cause': alert.cause if alert.HasField('cause') else None,
+            'effect': alert.effect if alert.HasField('effect') else None,
+        }
+    
     def find_stops_by_name(self, search_term):
         """
         Search for stops by name
@@ -224,19 +599,14 @@ class RTDClient:
             search_term: String to search for in stop names
         
         Returns:
-            List of matching stops
+            List of matching stops, best matches first
         """
-        stops = self.parse_stops()
-        if not stops:
+        feed = self.get_static_feed()
+        if feed is None or not feed.stops:
             return None
         
-        search_term = search_term.lower()
-        matching_stops = [
-            stop for stop in stops 
-            if search_term in stop.get('stop_name', '').lower()
-        ]
-        
-        return matching_stops
+        matches = feed.stop_name_index.search(search_term, limit=None, fuzzy=False)
+        return [dict(feed.stops[i]) for i, _ in matches]
     
     def find_route_by_name(self, search_term):
         """
@@ -246,18 +616,217 @@ class RTDClient:
             search_term: String to search for in route names
         
         Returns:
-            List of matching routes
+            List of matching routes, best matches first
+        """
+        feed = self.get_static_feed()
+        if feed is None or not feed.routes:
+            return None
+        
+        matches = feed.route_name_index.search(search_term, limit=None, fuzzy=False)
+        return [dict(feed.routes[i]) for i, _ in matches]
+    
+    def search_stops(self, query, limit=10, fuzzy=True):
+        """
+        Ranked stop search for autocomplete
+        
+        Matches substrings and prefixes of stop names and, when fuzzy is
+        enabled, tolerates typos (e.g. "untion staton").
+        
+        Args:
+            query: Search text
+            limit: Maximum number of results (default: 10)
+            fuzzy: Include typo-tolerant matches (default: True)
+        
+        Returns:
+            List of stop dictionaries with an added 'score' (1.0 = exact match)
+        """
+        feed = self.get_static_feed()
+        if feed is None or not feed.stops:
+            return None
+        
+        results = []
+        for i, score in feed.stop_name_index.search(query, limit=limit, fuzzy=fuzzy):
+            stop = dict(feed.stops[i])
+            stop['score'] = score
+            results.append(stop)
+        
+        return results
+    
+    def find_stops_near(self, lat, lng, radius=1000, limit=None, include_routes=False):
+        """
+        Find stops within a radius of a point
+        
+        Uses the local stop grid index, so no network call is made once the
+        static feed is cached.
+        
+        Args:
+            lat: Latitude of the search center
+            lng: Longitude of the search center
+            radius: Search radius in meters (default: 1000)
+            limit: Maximum number of stops, nearest first (default: all)
+            include_routes: Add the route_ids serving each stop (parses
+                            stop_times.txt once per feed version)
+        
+        Returns:
+            List of stop dictionaries with an added 'distance_meters',
+            sorted by distance
+        """
+        feed = self.get_static_feed()
+        if feed is None or not feed.stops:
+            return None
+        
+        routes_by_stop = feed.routes_by_stop if include_routes else None
+        
+        results = []
+        for i, distance in feed.stop_spatial_index.within(lat, lng, radius, limit=limit):
+            stop = dict(feed.stops[i])
+            stop['distance_meters'] = round(distance, 1)
+            if routes_by_stop is not None:
+                stop['routes'] = routes_by_stop.get(stop.get('stop_id'), [])
+            results.append(stop)
+        
+        return results
+    
+    def get_timetable(self):
+        """
+        Get the RAPTOR timetable for the current static feed
+        
+        Built on first use (parses stop_times.txt) and then reused until the
+        feed version changes.
+        
+        Returns:
+            Timetable instance, or None if the static feed is unavailable
+        """
+        feed = self.get_static_feed()
+        if feed is None:
+            return None
+        return feed.derived('timetable', lambda: Timetable(feed))
+    
+    def resolve_location(self, location, geocoder=None):
+        """
+        Turn a location string into coordinates without a network call when possible
+        
+        Tries, in order: a "lat,lng" pair, an RTD stop name (exact or prefix
+        match), then the optional geocoder.
+        
+        Args:
+            location: "lat,lng", stop name or free-text address
+            geocoder: Optional callable(address) -> {'lat', 'lng'} or None
+                      (e.g. GoogleTransitClient.geocode)
+        
+        Returns:
+            Dictionary with 'lat', 'lng' and 'name', or None if unresolved
+        """
+        coords = parse_coordinates(location)
+        if coords:
+            return {'lat': coords[0], 'lng': coords[1], 'name': location}
+        
+        matches = self.search_stops(location, limit=1, fuzzy=False)
+        if matches and matches[0]['score'] >= 0.9:
+            stop = matches[0]
+            return {'lat': float(stop['stop_lat']), 'lng': float(stop['stop_lon']), 'name': stop['stop_name']}
+        
+        if geocoder is not None:
+            geocoded = geocoder(location)
+            if geocoded:
+                return {'lat': geocoded['lat'], 'lng': geocoded['lng'], 'name': location}
+        
+        return None
+    
+    def plan_trip(self, origin, destination, departure_time=None, max_transfers=3,
+                  origin_name='', destination_name=''):
+        """
+        Plan a transit trip locally with RAPTOR (no Google API needed)
+        
+        Args:
+            origin: (lat, lng) tuple for the start
+            destination: (lat, lng) tuple for the end
+            departure_time: datetime to leave at (default: now)
+            max_transfers: Maximum number of transfers (default: 3)
+            origin_name: Label used for start_address
+            destination_name: Label used for end_address
+        
+        Returns:
+            Dictionary in the same shape as GoogleTransitClient.get_transit_directions
+            ({'status', 'routes'}), or None if the static feed is unavailable.
+            Routes are the fastest option for each number of transfers.
+        """
+        timetable = self.get_timetable()
+        if timetable is None:
+            return None
+        
+        return timetable.plan(
+            origin, destination, departure_time,
+            max_transfers=max_transfers,
+            origin_name=origin_name,
+            destination_name=destination_name
+        )
+    
+    def get_reachability(self, lat, lng, minutes=30, departure_time=None, max_transfers=3,
+                         window_minutes=0, grid_size_m=None):
+        """
+        Find every stop reachable by transit and walking within a time budget
+        
+        Results are cached per origin (rounded to ~100 m), parameters and
+        departure time (to the second), so repeated queries from popular
+        origins are served from memory. The search leaves at departure_time
+        itself; just after midnight it also rides the previous service
+        day's trips that run past 24:00.
+        
+        Args:
+            lat: Origin latitude
+            lng: Origin longitude
+            minutes: Travel time budget (default: 30)
+            departure_time: datetime to leave at (default: now)
+            max_transfers: Maximum number of transfers (default: 3)
+            window_minutes: Keep the best time over departures in this window
+            grid_size_m: Also return a travel time grid with cells of this size
+        
+        Returns:
+            Dictionary with 'stops' (sorted by travel time), 'departure_time'
+            and optionally 'grid', or None if the static feed is unavailable
+        """
+        timetable = self.get_timetable()
+        if timetable is None:
+            return None
+        
+        when = (departure_time or datetime.now()).replace(microsecond=0)
+        key = (
+            self._static_feed.version, round(lat, 3), round(lng, 3), minutes,
+            when, max_transfers, window_minutes, grid_size_m
+        )
+        
+        result = self.reachability_cache.get(key)
+        if result is None:
+            result = self.single_flight.do(('reachability', key), timetable.reachability,
+                                           round(lat, 3), round(lng, 3), when, minutes,
+                                           max_transfers, window_minutes, grid_size_m)
+            result['departure_time'] = when.isoformat()
+            self.reachability_cache.set(key, result)
+        
+        return result
+    
+    def search_routes(self, query, limit=10, fuzzy=True):
+        """
+        Ranked route search by short or long name
+        
+        Args:
+            query: Search text
+            limit: Maximum number of results (default: 10)
+            fuzzy: Include typo-tolerant matches (default: True)
+        
+        Returns:
+            List of route dictionaries with an added 'score' (1.0 = exact match)
         """
-        routes = self.parse_routes()
-        if not routes:
+        feed = self.get_static_feed()
+        if feed is None or not feed.routes:
             return None
         
-        search_term = search_term.lower()
-        matching_routes = [
-            route for route in routes 
-            if search_term in route.get('route_short_name', '').lower() 
-            or search_term in route.get('route_long_name', '').lower()
-        ]
+        results = []
+        for i, score in feed.route_name_index.search(query, limit=limit, fuzzy=fuzzy):
+            route = dict(feed.routes[i])
+            route['score'] = score
+            results.append(route)
         
-        return matching_routes
+        return results
 
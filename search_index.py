@@ -0,0 +1,222 @@
+"""
+Trigram Search Index
+In-memory name index for fast substring, prefix and typo-tolerant lookups
+"""
+
+import bisect
+import heapq
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+
+# Ranking tiers (lower is better)
+EXACT = 0
+PREFIX = 1
+WORD_PREFIX = 2
+SUBSTRING = 3
+FUZZY = 4
+
+_NON_ALNUM = re.compile(r'[^a-z0-9]+')
+
+
+def normalize(text: str) -> str:
+    """
+    Normalize text for searching
+
+    Lowercases, strips accents and collapses punctuation to single spaces,
+    so "61st & Peña Station" becomes "61st pena station".
+    """
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return _NON_ALNUM.sub(' ', text.lower()).strip()
+
+
+def trigrams(text: str) -> Set[str]:
+    """Get the set of trigrams of an already normalized string"""
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """
+    Trigram and prefix index over a set of named items
+
+    Each item is identified by a key and may be indexed under several texts
+    (e.g. a route's short and long names). Searches return keys ranked by
+    match quality: exact, prefix, word prefix, substring, then fuzzy.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[Any, str]] = ()):
+        """
+        Build the index
+
+        Args:
+            entries: Iterable of (key, text) pairs
+        """
+        self._keys: List[Any] = []
+        self._texts: List[str] = []
+        self._grams: List[Set[str]] = []
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        self._words: List[Tuple[str, int]] = []
+
+        for key, text in entries:
+            normalized = normalize(text)
+            if not normalized:
+                continue
+            doc_id = len(self._keys)
+            self._keys.append(key)
+            self._texts.append(normalized)
+            grams = trigrams(normalized)
+            self._grams.append(grams)
+            for gram in grams:
+                self._postings[gram].append(doc_id)
+            for word in normalized.split(' '):
+                self._words.append((word, doc_id))
+
+        self._postings = dict(self._postings)
+        self._words.sort()
+
+        # Tie-break rank: shorter, then alphabetical texts first
+        self._order = [0] * len(self._texts)
+        for rank, doc_id in enumerate(sorted(range(len(self._texts)), key=lambda d: (len(self._texts[d]), self._texts[d]))):
+            self._order[doc_id] = rank
+
+        # Upper bound on docs per key, so a limited search knows how many
+        # ranked docs it needs to fill `limit` distinct keys
+        texts_per_key: Dict[Any, int] = defaultdict(int)
+        for key in self._keys:
+            texts_per_key[key] += 1
+        self._max_texts_per_key = max(texts_per_key.values(), default=1)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def search(
+        self,
+        query: str,
+        limit: Optional[int] = 10,
+        fuzzy: bool = True,
+        min_similarity: float = 0.3
+    ) -> List[Tuple[Any, float]]:
+        """
+        Search the index
+
+        Args:
+            query: Search text (any case, punctuation ignored)
+            limit: Maximum number of results (None for all matches)
+            fuzzy: Include typo-tolerant trigram matches when there are
+                   not enough substring matches to fill the limit
+            min_similarity: Minimum trigram similarity for fuzzy matches
+
+        Returns:
+            List of (key, score) tuples, best first. Scores are in (0, 1],
+            with 1.0 for an exact match.
+        """
+        q = normalize(query)
+        if not q:
+            return []
+
+        # doc_id -> (tier, similarity)
+        matches: Dict[int, Tuple[int, float]] = {}
+
+        if len(q) < 3:
+            # Too short for trigrams - use the sorted word list
+            for doc_id in self._word_prefix_docs(q):
+                matches[doc_id] = (self._tier(q, self._texts[doc_id]), 1.0)
+            if limit is None or self._distinct_keys(matches) < limit:
+                # Fall back to a plain scan for mid-word matches
+                for doc_id, text in enumerate(self._texts):
+                    if doc_id not in matches and q in text:
+                        matches[doc_id] = (SUBSTRING, 1.0)
+        else:
+            for doc_id in self._substring_candidates(q):
+                text = self._texts[doc_id]
+                if q in text:
+                    matches[doc_id] = (self._tier(q, text), 1.0)
+
+        if fuzzy and len(q) >= 3 and (limit is None or self._distinct_keys(matches) < limit):
+            query_grams = trigrams(q)
+            counts: Dict[int, int] = defaultdict(int)
+            for gram in query_grams:
+                for doc_id in self._postings.get(gram, ()):
+                    counts[doc_id] += 1
+            for doc_id, shared in counts.items():
+                if doc_id in matches:
+                    continue
+                union = len(query_grams) + len(self._grams[doc_id]) - shared
+                similarity = shared / union
+                if similarity >= min_similarity:
+                    matches[doc_id] = (FUZZY, similarity)
+
+        order = self._order
+        rank_key = lambda item: (item[1][0], -item[1][1], order[item[0]])
+        if limit is None:
+            ranked = sorted(matches.items(), key=rank_key)
+        else:
+            ranked = heapq.nsmallest(limit * self._max_texts_per_key, matches.items(), key=rank_key)
+
+        results = []
+        seen = set()
+        for doc_id, (tier, similarity) in ranked:
+            key = self._keys[doc_id]
+            if key in seen:
+                continue
+            seen.add(key)
+            results.append((key, self._score(tier, similarity)))
+            if limit is not None and len(results) >= limit:
+                break
+
+        return results
+
+    def _substring_candidates(self, q: str) -> List[int]:
+        """Docs containing every trigram of q, intersected rarest first"""
+        grams = {q[i:i + 3] for i in range(len(q) - 2)}
+        postings = []
+        for gram in grams:
+            docs = self._postings.get(gram)
+            if not docs:
+                return []
+            postings.append(docs)
+        postings.sort(key=len)
+
+        candidates = postings[0]
+        for docs in postings[1:]:
+            if len(candidates) < 8:
+                break  # Cheaper to verify the few remaining candidates directly
+            doc_set = set(docs)
+            candidates = [d for d in candidates if d in doc_set]
+        return candidates
+
+    def _word_prefix_docs(self, q: str) -> Set[int]:
+        """Docs having a word that starts with q"""
+        docs = set()
+        words = self._words
+        for i in range(bisect.bisect_left(words, (q,)), len(words)):
+            word, doc_id = words[i]
+            if not word.startswith(q):
+                break
+            docs.add(doc_id)
+        return docs
+
+    def _distinct_keys(self, matches: Dict[int, Tuple[int, float]]) -> int:
+        return len({self._keys[doc_id] for doc_id in matches})
+
+    @staticmethod
+    def _tier(q: str, text: str) -> int:
+        if text == q:
+            return EXACT
+        if text.startswith(q):
+            return PREFIX
+        if text.find(' ' + q) != -1:
+            return WORD_PREFIX
+        return SUBSTRING
+
+    @staticmethod
+    def _score(tier: int, similarity: float) -> float:
+        if tier == FUZZY:
+            return round(similarity * 0.5, 3)
+        return {EXACT: 1.0, PREFIX: 0.9, WORD_PREFIX: 0.8, SUBSTRING: 0.7}[tier]
@@ -0,0 +1,307 @@
+"""
+Spatial Grid Index
+Uniform lat/lng grid for radius, nearest-neighbour and bounding-box lookups
+"""
+
+import math
+from array import array
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+EARTH_RADIUS_METERS = 6371008.8
+METERS_PER_DEGREE_LAT = 111320.0
+
+
+def haversine_meters(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance between two coordinates in meters"""
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    delta_lat = math.radians(lat2 - lat1)
+    delta_lng = math.radians(lng2 - lng1)
+
+    a = math.sin(delta_lat / 2) ** 2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lng / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridIndex:
+    """
+    Points bucketed into a uniform grid of roughly square cells
+
+    Queries only visit the cells overlapping the search area, so their cost
+    is proportional to the number of nearby points, not the total.
+    """
+
+    def __init__(
+        self,
+        points: Iterable[Tuple[Any, float, float]],
+        cell_size_m: float = 500,
+        reference_lat: float = 39.74
+    ):
+        """
+        Build the index
+
+        Args:
+            points: Iterable of (key, lat, lng) tuples
+            cell_size_m: Approximate cell edge length in meters
+            reference_lat: Latitude used to size cells east-west
+                           (default: Denver)
+        """
+        self.cell_lat = cell_size_m / METERS_PER_DEGREE_LAT
+        self.cell_lng = cell_size_m / (METERS_PER_DEGREE_LAT * math.cos(math.radians(reference_lat)))
+        self.keys: List[Any] = []
+        self.lats = array('d')
+        self.lngs = array('d')
+        cells: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+
+        for key, lat, lng in points:
+            idx = len(self.keys)
+            self.keys.append(key)
+            self.lats.append(lat)
+            self.lngs.append(lng)
+            cells[self._cell(lat, lng)].append(idx)
+
+        self._cells = {cell: array('i', members) for cell, members in cells.items()}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return (int(math.floor(lat / self.cell_lat)), int(math.floor(lng / self.cell_lng)))
+
+    def _cells_in_bbox(self, min_lat: float, min_lng: float, max_lat: float, max_lng: float):
+        row_min, col_min = self._cell(min_lat, min_lng)
+        row_max, col_max = self._cell(max_lat, max_lng)
+        cells = self._cells
+        if (row_max - row_min + 1) * (col_max - col_min + 1) > len(cells):
+            # Query area is larger than the populated grid - walk the cells instead
+            for (row, col), members in cells.items():
+                if row_min <= row <= row_max and col_min <= col <= col_max:
+                    yield members
+            return
+        for row in range(row_min, row_max + 1):
+            for col in range(col_min, col_max + 1):
+                members = cells.get((row, col))
+                if members is not None:
+                    yield members
+
+    def within(
+        self,
+        lat: float,
+        lng: float,
+        radius_m: float,
+        limit: Optional[int] = None
+    ) -> List[Tuple[Any, float]]:
+        """
+        Find points within a radius
+
+        Args:
+            lat: Center latitude
+            lng: Center longitude
+            radius_m: Search radius in meters
+            limit: Maximum number of results (nearest first)
+
+        Returns:
+            List of (key, distance_meters) tuples sorted by distance
+        """
+        dlat = radius_m / METERS_PER_DEGREE_LAT
+        dlng = radius_m / (METERS_PER_DEGREE_LAT * max(0.01, math.cos(math.radians(lat))))
+        lats, lngs = self.lats, self.lngs
+
+        found = []
+        for members in self._cells_in_bbox(lat - dlat, lng - dlng, lat + dlat, lng + dlng):
+            for idx in members:
+                # Cheap box check before the exact distance
+                if abs(lats[idx] - lat) > dlat or abs(lngs[idx] - lng) > dlng:
+                    continue
+                distance = haversine_meters(lat, lng, lats[idx], lngs[idx])
+                if distance <= radius_m:
+                    found.append((distance, idx))
+
+        found.sort()
+        if limit is not None:
+            found = found[:limit]
+        return [(self.keys[idx], distance) for distance, idx in found]
+
+    def nearest(
+        self,
+        lat: float,
+        lng: float,
+        max_distance_m: float = 5000
+    ) -> Optional[Tuple[Any, float]]:
+        """
+        Find the closest point
+
+        Searches outward in growing rings until a point is found or
+        max_distance_m is exceeded.
+
+        Returns:
+            (key, distance_meters) tuple, or None if nothing is in range
+        """
+        radius = max(self.cell_lat, self.cell_lng) * METERS_PER_DEGREE_LAT
+        while True:
+            radius = min(radius, max_distance_m)
+            found = self.within(lat, lng, radius, limit=1)
+            if found or radius >= max_distance_m:
+                return found[0] if found else None
+            radius *= 2
+
+    def in_bbox(self, min_lat: float, min_lng: float, max_lat: float, max_lng: float) -> List[Any]:
+        """
+        Find points inside a bounding box
+
+        Returns:
+            List of keys (unordered)
+        """
+        lats, lngs = self.lats, self.lngs
+        keys = self.keys
+        return [
+            keys[idx]
+            for members in self._cells_in_bbox(min_lat, min_lng, max_lat, max_lng)
+            for idx in members
+            if min_lat <= lats[idx] <= max_lat and min_lng <= lngs[idx] <= max_lng
+        ]
+
+
+def parse_coordinates(text: Optional[str]) -> Optional[Tuple[float, float]]:
+    """
+    Parse a "lat,lng" string
+
+    Returns:
+        (lat, lng) tuple, or None if text is not a valid coordinate pair
+    """
+    if not text:
+        return None
+    parts = text.split(',')
+    if len(parts) != 2:
+        return None
+    try:
+        lat, lng = float(parts[0]), float(parts[1])
+    except ValueError:
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+
+def parse_bbox(text: Optional[str]) -> Optional[Tuple[float, float, float, float]]:
+    """
+    Parse a "west,south,east,north" bounding box (GeoJSON order)
+
+    Returns:
+        (min_lat, min_lng, max_lat, max_lng) tuple, or None if text is not
+        a valid bounding box
+    """
+    if not text:
+        return None
+    parts = text.split(',')
+    if len(parts) != 4:
+        return None
+    try:
+        west, south, east, north = (float(p) for p in parts)
+    except ValueError:
+        return None
+    if not (-90 <= south <= north <= 90 and -180 <= west <= east <= 180):
+        return None
+    return south, west, north, east
+
+
+MAX_CIRCLE_RADIUS_M = 50000    # Larger circles are rejected (metro Denver fits well inside)
+
+
+class Shape:
+    """
+    A circle or polygon area (e.g. a geofence)
+
+    Built from a JSON spec with from_dict():
+        {"type": "circle", "lat": 39.7539, "lng": -105.0002, "radius": 300}
+        {"type": "polygon", "coordinates": [[lng, lat], [lng, lat], ...]}
+    A GeoJSON Polygon geometry ({"type": "Polygon", "coordinates": [ring]})
+    is accepted too; only its outer ring is used.
+    """
+
+    def __init__(self, kind: str, center: Optional[Tuple[float, float]] = None, radius: float = 0,
+                 ring: Optional[List[Tuple[float, float]]] = None):
+        """
+        Args:
+            kind: 'circle' or 'polygon'
+            center: (lat, lng) of a circle
+            radius: Circle radius in meters
+            ring: Polygon vertices as (lat, lng) tuples
+        """
+        self.kind = kind
+        self.center = center
+        self.radius = radius
+        self.ring = ring or []
+        if kind == 'circle':
+            lat, lng = center
+            dlat = radius / METERS_PER_DEGREE_LAT
+            dlng = radius / (METERS_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 1e-6))
+            self.bbox = (lat - dlat, lng - dlng, lat + dlat, lng + dlng)
+        else:
+            lats = [p[0] for p in self.ring]
+            lngs = [p[1] for p in self.ring]
+            self.bbox = (min(lats), min(lngs), max(lats), max(lngs))
+
+    @classmethod
+    def from_dict(cls, spec: Dict[str, Any]) -> 'Shape':
+        """
+        Parse a shape spec
+
+        Raises:
+            ValueError: If the spec is not a valid circle or polygon
+        """
+        if not isinstance(spec, dict):
+            raise ValueError('shape must be an object')
+        kind = str(spec.get('type', '')).lower()
+        try:
+            if kind == 'circle':
+                lat, lng, radius = float(spec['lat']), float(spec['lng']), float(spec['radius'])
+                if not (-90 <= lat <= 90 and -180 <= lng <= 180) or not 0 < radius <= MAX_CIRCLE_RADIUS_M:
+                    raise ValueError
+                return cls('circle', center=(lat, lng), radius=radius)
+            if kind == 'polygon':
+                coordinates = spec['coordinates']
+                if spec['type'] == 'Polygon':
+                    coordinates = coordinates[0]
+                ring = [(float(lat), float(lng)) for lng, lat in coordinates]
+                if ring and ring[0] == ring[-1]:
+                    ring.pop()
+                if len(ring) < 3 or not all(-90 <= lat <= 90 and -180 <= lng <= 180 for lat, lng in ring):
+                    raise ValueError
+                return cls('polygon', ring=ring)
+        except (KeyError, IndexError, TypeError, ValueError):
+            pass
+        raise ValueError(
+            f'shape must be {{"type": "circle", "lat", "lng", "radius"}} (radius up to {MAX_CIRCLE_RADIUS_M} m) or '
+            '{"type": "polygon", "coordinates": [[lng, lat], ...]} with at least 3 points'
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The shape as a JSON spec (inverse of from_dict)"""
+        if self.kind == 'circle':
+            return {'type': 'circle', 'lat': self.center[0], 'lng': self.center[1], 'radius': self.radius}
+        return {'type': 'polygon', 'coordinates': [[lng, lat] for lat, lng in self.ring]}
+
+    def contains(self, lat: float, lng: float) -> bool:
+        """Whether a point lies inside the shape"""
+        min_lat, min_lng, max_lat, max_lng = self.bbox
+        if not (min_lat <= lat <= max_lat and min_lng <= lng <= max_lng):
+            return False
+        if self.kind == 'circle':
+            return haversine_meters(lat, lng, self.center[0], self.center[1]) <= self.radius
+        return point_in_polygon(lat, lng, self.ring)
+
+
+def point_in_polygon(lat: float, lng: float, ring: List[Tuple[float, float]]) -> bool:
+    """Ray casting test for a point inside a polygon of (lat, lng) vertices"""
+    inside = False
+    j = len(ring) - 1
+    for i in range(len(ring)):
+        lat_i, lng_i = ring[i]
+        lat_j, lng_j = ring[j]
+        if (lat_i > lat) != (lat_j > lat):
+            if lng < (lng_j - lng_i) * (lat - lat_i) / (lat_j - lat_i) + lng_i:
+                inside = not inside
+        j = i
+    return inside
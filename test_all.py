@@ -154,6 +154,397 @@ def test_api_server_imports():
         return False
 
 
+class LocalWebhookReceiver:
+    """Local HTTP stand-in for a webhook endpoint that records what it receives"""
+    
+    def __init__(self, fail_first=0):
+        import json
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        
+        receiver = self
+        self.received = []
+        self.fail_first = fail_first
+        self.attempts = 0
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                receiver.attempts += 1
+                if receiver.attempts <= receiver.fail_first:
+                    self.send_response(503)
+                else:
+                    receiver.received.append((dict(self.headers), body, json.loads(body)))
+                    self.send_response(204)
+                self.end_headers()
+            
+            def log_message(self, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/hook"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    
+    def close(self):
+        self.server.shutdown()
+
+
+def test_webhook_delivery():
+    """Test webhook filtering, batching and retries against a local receiver (no network)"""
+    print_test(6, "Webhook Delivery")
+    
+    import os
+    import tempfile
+    import time
+    import webhooks
+    from event_log import FeedEventDetector
+    
+    receiver = LocalWebhookReceiver(fail_first=1)
+    original_backoff = webhooks.BACKOFF_BASE
+    webhooks.BACKOFF_BASE = 0.05
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            detector = FeedEventDetector(RTDClient())
+            store = webhooks.WebhookStore(os.path.join(tmp, 'webhooks.sqlite'))
+            dispatcher = webhooks.WebhookDispatcher(detector, store, max_workers=2, allow_private_urls=True)
+            subscriber = dispatcher.subscribe('test', receiver.url, {'routes': ['15']})
+            
+            detector.log.append('vehicle_appeared', {'vehicle_id': '1', 'route_id': '15'})
+            detector.log.append('vehicle_appeared', {'vehicle_id': '2', 'route_id': 'A'})
+            detector.log.append('delay_exceeded', {'trip_id': 't', 'route_id': '15', 'delay_seconds': 400})
+            
+            deadline = time.time() + 5
+            while not receiver.received and time.time() < deadline:
+                dispatcher.run_once(update_feeds=False)
+                time.sleep(0.05)
+            dispatcher.stop()
+            
+            if not receiver.received:
+                print("❌ FAILED: No delivery received")
+                return False
+            
+            headers, body, payload = receiver.received[0]
+            events = [e['vehicle_id'] if e['type'] == 'vehicle_appeared' else e['trip_id'] for e in payload['events']]
+            signed = headers.get('X-RTD-Signature') == webhooks.sign(subscriber['secret'], body)
+            stats = dispatcher.stats()[subscriber['id']]
+            
+            if events != ['1', 't'] or not signed or stats['failed_attempts'] != 1 or stats['queue_depth'] != 0:
+                print(f"❌ FAILED: Unexpected delivery {events}, signed={signed}, stats={stats}")
+                return False
+            
+            print("✅ SUCCESS! Filtered batch delivered after one retry")
+            print(f"   Events: {events}, latency {stats['avg_latency_ms']} ms")
+            return True
+    except Exception as e:
+        print(f"❌ ERROR: {e}")
+        return False
+    finally:
+        webhooks.BACKOFF_BASE = original_backoff
+        receiver.close()
+
+
+def synthetic_gtfs_feed():
+    """
+    A tiny GTFS static feed (no network)
+    
+    Stops A, B, C and D lie about 5.5 km apart on a north-south line. Route
+    1 runs A -> B -> C at 08:00, route 2 runs B -> D at 08:15, and a night
+    trip of route 1 (service-day times past 24:00) leaves A at 00:10.
+    """
+    import io
+    import zipfile
+    from gtfs_static import StaticFeed
+    
+    files = {
+        'stops.txt': ['stop_id,stop_name,stop_lat,stop_lon',
+                      'A,Stop A,39.70,-105.00', 'B,Stop B,39.75,-105.00',
+                      'C,Stop C,39.80,-105.00', 'D,Stop D,39.75,-104.93'],
+        'routes.txt': ['route_id,route_short_name,route_long_name,route_type',
+                       '1,1,Route 1,3', '2,2,Route 2,3'],
+        'calendar.txt': ['service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date',
+                         'WK,1,1,1,1,1,1,1,20200101,20301231'],
+        'trips.txt': ['route_id,service_id,trip_id,trip_headsign',
+                      '1,WK,DAY1,North', '1,WK,NIGHT1,North', '2,WK,DAY2,East'],
+        'stop_times.txt': ['trip_id,arrival_time,departure_time,stop_id,stop_sequence',
+                           'DAY1,08:00:00,08:00:00,A,1', 'DAY1,08:10:00,08:10:00,B,2', 'DAY1,08:20:00,08:20:00,C,3',
+                           'NIGHT1,24:10:00,24:10:00,A,1', 'NIGHT1,24:20:00,24:20:00,B,2', 'NIGHT1,24:30:00,24:30:00,C,3',
+                           'DAY2,08:15:00,08:15:00,B,1', 'DAY2,08:30:00,08:30:00,D,2'],
+    }
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as z:
+        for name, rows in files.items():
+            z.writestr(name, '\n'.join(rows) + '\n')
+    return StaticFeed(buffer.getvalue())
+
+
+def synthetic_realtime_feed(feed_file, timestamp, vehicles=(), trip_updates=()):
+    """
+    A GTFS-realtime FeedSnapshot (no network)
+    
+    Args:
+        feed_file: 'VehiclePosition.pb' or 'TripUpdate.pb'
+        timestamp: Feed header timestamp
+        vehicles: (vehicle_id, route_id, lat, lng) tuples
+        trip_updates: (trip_id, route_id, stop_id, arrival_time) tuples
+    """
+    from google.transit import gtfs_realtime_pb2
+    from realtime_feed import FeedSnapshot
+    
+    message = gtfs_realtime_pb2.FeedMessage()
+    message.header.gtfs_realtime_version = '2.0'
+    message.header.timestamp = timestamp
+    for vehicle_id, route_id, lat, lng in vehicles:
+        entity = message.entity.add()
+        entity.id = vehicle_id
+        entity.vehicle.vehicle.id = vehicle_id
+        entity.vehicle.trip.route_id = route_id
+        entity.vehicle.trip.trip_id = f'trip-{vehicle_id}'
+        entity.vehicle.position.latitude = lat
+        entity.vehicle.position.longitude = lng
+    for trip_id, route_id, stop_id, arrival_time in trip_updates:
+        entity = message.entity.add()
+        entity.id = trip_id
+        entity.trip_update.trip.trip_id = trip_id
+        entity.trip_update.trip.route_id = route_id
+        stu = entity.trip_update.stop_time_update.add()
+        stu.stop_id = stop_id
+        stu.arrival.time = arrival_time
+    return FeedSnapshot(feed_file, message.SerializeToString())
+
+
+def test_trip_planner():
+    """Test RAPTOR trip planning on a synthetic feed (no network)"""
+    print_test(7, "Trip Planner")
+    
+    from datetime import datetime
+    from raptor import Timetable
+    
+    try:
+        timetable = Timetable(synthetic_gtfs_feed())
+        day = datetime(2024, 3, 5)
+        
+        plan = timetable.plan((39.70, -105.00), (39.75, -104.93), day.replace(hour=7, minute=55))
+        if plan['status'] != 'OK':
+            print(f"❌ FAILED: No journey from A to D, got {plan['status']}")
+            return False
+        journey = plan['routes'][0]
+        rides = [step['transit']['line'] for step in journey['steps'] if step['travel_mode'] == 'TRANSIT']
+        if journey['arrival_time'] != '8:30 AM' or len(rides) != 2:
+            print(f"❌ FAILED: Expected two rides arriving 8:30 AM, got {rides} arriving {journey['arrival_time']}")
+            return False
+        
+        missed = timetable.plan((39.70, -105.00), (39.75, -104.93), day.replace(hour=8, minute=5))
+        if missed['status'] != 'ZERO_RESULTS':
+            print(f"❌ FAILED: Journey found after the last connection: {missed['routes'][0]['arrival_time']}")
+            return False
+        
+        print("✅ SUCCESS! A -> D with one transfer at B, arriving 8:30 AM")
+        return True
+    except Exception as e:
+        print(f"❌ ERROR: {e}")
+        return False
+
+
+def test_reachability():
+    """Test reachability from an exact departure time, overnight trips included (no network)"""
+    print_test(8, "Reachability")
+    
+    from datetime import datetime
+    from raptor import Timetable
+    
+    try:
+        timetable = Timetable(synthetic_gtfs_feed())
+        
+        def reached(hour, minute, second=0):
+            when = datetime(2024, 3, 5, hour, minute, second)
+            stops = timetable.reachability(39.70, -105.00, when, minutes=20)['stops']
+            return {stop['stop_id']: stop['minutes'] for stop in stops}
+        
+        just_in_time = reached(7, 59, 30)
+        too_late = reached(8, 0, 1)
+        overnight = reached(0, 5)
+        
+        if just_in_time.get('B') != 10.5 or 'D' in just_in_time:
+            print(f"❌ FAILED: Leaving 07:59:30 should reach B in 10.5 min, got {just_in_time}")
+            return False
+        if 'B' in too_late:
+            print(f"❌ FAILED: Leaving 08:00:01 should miss the 08:00 trip, got {too_late}")
+            return False
+        if overnight.get('B') != 15.0:
+            print(f"❌ FAILED: Leaving 00:05 should reach B on the night trip, got {overnight}")
+            return False
+        
+        print("✅ SUCCESS! Exact departures and the previous day's night trip are searched")
+        return True
+    except Exception as e:
+        print(f"❌ ERROR: {e}")
+        return False
+
+
+def test_geofence_events():
+    """Test geofence enter/exit events across snapshots (no network)"""
+    print_test(9, "Geofence Events")
+    
+    import os
+    import tempfile
+    from event_log import FeedEventDetector
+    from event_log import GEOFENCE_ENTER, GEOFENCE_EXIT
+    from geofence import GeofenceEngine
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            detector = FeedEventDetector(RTDClient())
+            engine = GeofenceEngine(detector, os.path.join(tmp, 'geofences.sqlite'))
+            fence = engine.add('test', {'type': 'circle', 'lat': 39.75, 'lng': -105.00, 'radius': 500}, routes=['15'])
+            
+            for shape in ({'type': 'circle', 'lat': 39.75, 'lng': -105.00, 'radius': 50001},
+                          {'type': 'polygon', 'coordinates': [[-106, 39], [-104, 39], [-104, 41], [-106, 41]]}):
+                try:
+                    engine.add('test', shape)
+                    print(f"❌ FAILED: Oversized fence accepted: {shape}")
+                    return False
+                except ValueError:
+                    pass
+            
+            inside, outside = (39.75, -105.00), (39.80, -105.00)
+            # The first snapshot is the baseline: no events for vehicles already inside
+            engine.evaluate(synthetic_realtime_feed('VehiclePosition.pb', 1700000000,
+                                                    vehicles=[('1', '15', *inside), ('2', '15', *outside)]))
+            engine.evaluate(synthetic_realtime_feed('VehiclePosition.pb', 1700000030,
+                                                    vehicles=[('1', '15', *outside), ('2', '15', *inside),
+                                                              ('3', 'A', *inside)]))
+            engine.evaluate(synthetic_realtime_feed('VehiclePosition.pb', 1700000060,
+                                                    vehicles=[('1', '15', *outside), ('2', '15', *inside),
+                                                              ('3', 'A', *inside)]))
+            
+            events = [(e['type'], e['vehicle_id']) for e in detector.log.since(0)]
+            expected = [(GEOFENCE_ENTER, '2'), (GEOFENCE_EXIT, '1')]
+            if sorted(events) != sorted(expected) or any(e['fence_id'] != fence.id for e in detector.log.since(0)):
+                print(f"❌ FAILED: Expected {expected}, got {events}")
+                return False
+            
+            print("✅ SUCCESS! One enter and one exit, route filter and size limits applied")
+            return True
+    except Exception as e:
+        print(f"❌ ERROR: {e}")
+        return False
+
+
+def test_arrival_events():
+    """Test arrival notifications fire once per trip and survive a burst (no network)"""
+    print_test(10, "Arrival Events")
+    
+    import os
+    import tempfile
+    from arrivals import ArrivalEngine
+    from event_log import ARRIVAL_SOON, EventLog, FeedEventDetector
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            detector = FeedEventDetector(RTDClient(), log=EventLog(max_events=5))
+            engine = ArrivalEngine(detector, os.path.join(tmp, 'arrivals.sqlite'))
+            engine.add('test', '15', 'S1', 5)
+            
+            now = 1700000000
+            # Eight trips two minutes out (more than the log keeps), one ten minutes out
+            updates = [(f'T{i}', '15', 'S1', now + 120) for i in range(8)] + [('FAR', '15', 'S1', now + 600)]
+            engine.evaluate(synthetic_realtime_feed('TripUpdate.pb', now, trip_updates=updates))
+            first = [e['trip_id'] for e in detector.log.since(0, types=[ARRIVAL_SOON])]
+            
+            engine.evaluate(synthetic_realtime_feed('TripUpdate.pb', now + 30, trip_updates=updates))
+            repeated = detector.log.last_id - len(first)
+            
+            for i in range(4):
+                detector.log.append('vehicle_appeared', {'vehicle_id': str(i), 'route_id': '15'})
+            kept = [e['trip_id'] for e in detector.log.since(0, types=[ARRIVAL_SOON])]
+            
+            if sorted(first) != [f'T{i}' for i in range(8)]:
+                print(f"❌ FAILED: Expected T0-T7 to fire, got {first}")
+                return False
+            if repeated:
+                print(f"❌ FAILED: {repeated} events repeated for trips already notified")
+                return False
+            if kept != first:
+                print(f"❌ FAILED: Burst trimmed by later events, {len(kept)} of {len(first)} kept")
+                return False
+            
+            print(f"✅ SUCCESS! {len(first)} trips notified once, burst kept past max_events")
+            return True
+    except Exception as e:
+        print(f"❌ ERROR: {e}")
+        return False
+
+
+def test_feed_outage():
+    """Test stale-while-revalidate and the circuit breaker against a failing upstream (no network)"""
+    print_test(11, "Feed Outage")
+    
+    import time
+    from circuit_breaker import CircuitBreaker
+    
+    class Response:
+        status_code = 200
+        headers = {}
+        
+        def __init__(self, content):
+            self.content = content
+        
+        def raise_for_status(self):
+            pass
+    
+    calls = []
+    
+    def healthy(feed, url, **kwargs):
+        calls.append(feed)
+        return Response(synthetic_realtime_feed(feed, 1700000000, vehicles=[('1', '15', 39.75, -105.0)]).message
+                        .SerializeToString())
+    
+    def slow_failure(feed, url, **kwargs):
+        calls.append(feed)
+        time.sleep(0.3)
+        raise TimeoutError('read timed out')
+    
+    try:
+        client = RTDClient(realtime_max_age=0, failure_threshold=3, reset_timeout=60)
+        client._get = healthy
+        snapshot = client.get_snapshot('VehiclePosition.pb')
+        
+        client._get = slow_failure
+        slowest = 0
+        for _ in range(3):
+            start = time.perf_counter()
+            served = client.get_snapshot('VehiclePosition.pb')
+            slowest = max(slowest, time.perf_counter() - start)
+            if served is not snapshot:
+                print("❌ FAILED: Cached snapshot not served while refreshing")
+                return False
+            # Let the background refresh fail before the next request
+            deadline = time.time() + 5
+            while client.feed_status()['VehiclePosition.pb']['refreshing'] and time.time() < deadline:
+                time.sleep(0.02)
+        
+        breaker = client.breakers['VehiclePosition.pb']
+        attempts = len(calls)
+        served = client.get_snapshot('VehiclePosition.pb')
+        status = client.feed_status()['VehiclePosition.pb']
+        
+        if slowest > 0.1:
+            print(f"❌ FAILED: A request waited {slowest * 1000:.0f} ms for the upstream")
+            return False
+        if breaker.state != CircuitBreaker.OPEN or len(calls) != attempts or served is not snapshot:
+            print(f"❌ FAILED: Circuit {breaker.state} after {attempts} calls, {len(calls) - attempts} more made")
+            return False
+        if not status['stale']:
+            print(f"❌ FAILED: Snapshot not marked stale: {status}")
+            return False
+        
+        print(f"✅ SUCCESS! Stale snapshot served in at most {slowest * 1000:.1f} ms, circuit open")
+        return True
+    except Exception as e:
+        print(f"❌ ERROR: {e}")
+        return False
+
+
 def main():
     print_header("RTD API - Comprehensive Test Suite")
     
@@ -181,6 +572,30 @@ def main():
     results.append(("API Server", test_api_server_imports()))
     print()
     
+    # Test 6: Webhook delivery (offline)
+    results.append(("Webhook Delivery", test_webhook_delivery()))
+    print()
+    
+    # Test 7: Trip planner (offline)
+    results.append(("Trip Planner", test_trip_planner()))
+    print()
+    
+    # Test 8: Reachability (offline)
+    results.append(("Reachability", test_reachability()))
+    print()
+    
+    # Test 9: Geofence events (offline)
+    results.append(("Geofence Events", test_geofence_events()))
+    print()
+    
+    # Test 10: Arrival events (offline)
+    results.append(("Arrival Events", test_arrival_events()))
+    print()
+    
+    # Test 11: Feed outage (offline)
+    results.append(("Feed Outage", test_feed_outage()))
+    print()
+    
     # Summary
     print_header("Test Summary")
     
@@ -0,0 +1,239 @@
+"""
+Map Tiles
+GeoJSON output and XYZ (Web Mercator) tiles for vehicles and stops
+
+Tiles hold only the features inside the tile (plus a small buffer so markers
+on the edge aren't cut off), with coordinates rounded to the tile's pixel
+resolution. At low zooms nearby features are merged into clusters, so a
+tile's size is bounded by its pixel area rather than the number of features.
+"""
+
+import math
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from cache_store import LRUCache
+
+
+TILE_SIZE = 256              # Pixels per tile edge
+BUFFER_PX = 16               # Features this close outside the edge are kept
+CLUSTER_RADIUS_PX = 40       # Cluster cell size in pixels
+MAX_ZOOM = 22
+
+# Zoom levels below these are clustered
+VEHICLE_CLUSTER_ZOOM = 12
+STOP_CLUSTER_ZOOM = 14
+# Full properties from this zoom level on; below it only the essentials
+DETAIL_ZOOM = 15
+
+LAYERS = ('vehicles', 'stops')
+
+
+def valid_tile(z: int, x: int, y: int) -> bool:
+    """Whether z/x/y names an existing tile"""
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def tile_bounds(z: int, x: int, y: int, buffer_px: float = 0) -> Tuple[float, float, float, float]:
+    """
+    Geographic bounds of an XYZ tile
+
+    Returns:
+        (min_lat, min_lng, max_lat, max_lng) tuple
+    """
+    n = 2 ** z
+    pad = buffer_px / TILE_SIZE
+    min_lng = (x - pad) / n * 360.0 - 180.0
+    max_lng = (x + 1 + pad) / n * 360.0 - 180.0
+    max_lat = _tile_y_to_lat(y - pad, n)
+    min_lat = _tile_y_to_lat(y + 1 + pad, n)
+    return min_lat, min_lng, max_lat, max_lng
+
+
+def _tile_y_to_lat(ty: float, n: int) -> float:
+    ty = min(max(ty, 0), n)
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+
+def world_pixel(lat: float, lng: float, z: int) -> Tuple[float, float]:
+    """Web Mercator pixel coordinates of a point at zoom z"""
+    scale = TILE_SIZE * 2 ** z
+    lat = max(min(lat, 85.0511), -85.0511)
+    siny = math.sin(math.radians(lat))
+    px = (lng + 180.0) / 360.0 * scale
+    py = (0.5 - math.log((1 + siny) / (1 - siny)) / (4 * math.pi)) * scale
+    return px, py
+
+
+def coordinate_precision(z: int) -> int:
+    """Decimal places needed to place a point to within one pixel at zoom z"""
+    pixel_degrees = 360.0 / (TILE_SIZE * 2 ** z)
+    return max(1, min(6, math.ceil(-math.log10(pixel_degrees))))
+
+
+def point_feature(lat: float, lng: float, properties: Dict[str, Any], precision: int = 6) -> Dict:
+    """GeoJSON Point feature"""
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [round(lng, precision), round(lat, precision)]},
+        'properties': properties
+    }
+
+
+def vehicles_geojson(vehicles: Iterable[Dict]) -> Dict:
+    """
+    Convert vehicle dictionaries to a GeoJSON FeatureCollection
+
+    Every field other than latitude/longitude becomes a property; vehicles
+    without a position are skipped.
+    """
+    features = []
+    for v in vehicles:
+        if v.get('latitude') is None or v.get('longitude') is None:
+            continue
+        properties = {key: value for key, value in v.items() if key not in ('latitude', 'longitude')}
+        features.append(point_feature(v['latitude'], v['longitude'], properties))
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def cluster_points(
+    points: List[Tuple[float, float, Dict]],
+    z: int,
+    precision: int,
+    summarize=None
+) -> List[Dict]:
+    """
+    Merge points that share a CLUSTER_RADIUS_PX grid cell at zoom z
+
+    Single points are kept as they are. Each cluster becomes one feature at
+    the mean position of its members with 'cluster': True and 'point_count'.
+
+    Args:
+        points: (lat, lng, properties) tuples
+        z: Zoom level
+        precision: Decimal places for coordinates
+        summarize: Optional function(list of member properties) returning
+                   extra cluster properties
+    """
+    cells: Dict[Tuple[int, int], List[Tuple[float, float, Dict]]] = {}
+    for point in points:
+        px, py = world_pixel(point[0], point[1], z)
+        cells.setdefault((int(px // CLUSTER_RADIUS_PX), int(py // CLUSTER_RADIUS_PX)), []).append(point)
+
+    features = []
+    for members in cells.values():
+        if len(members) == 1:
+            lat, lng, properties = members[0]
+            features.append(point_feature(lat, lng, properties, precision))
+            continue
+        properties = {'cluster': True, 'point_count': len(members)}
+        if summarize is not None:
+            properties.update(summarize([m[2] for m in members]))
+        lat = sum(m[0] for m in members) / len(members)
+        lng = sum(m[1] for m in members) / len(members)
+        features.append(point_feature(lat, lng, properties, precision))
+    return features
+
+
+def _summarize_vehicles(members: List[Dict]) -> Dict:
+    routes = sorted({m['route_id'] for m in members if m.get('route_id')})
+    return {'routes': routes[:10]}
+
+
+def vehicle_layer(vehicles: List[Dict], z: int) -> Dict:
+    """Tile layer for vehicles already limited to the tile's bounds"""
+    precision = coordinate_precision(z)
+    points = []
+    for v in vehicles:
+        if z >= DETAIL_ZOOM:
+            properties = {key: value for key, value in v.items() if key not in ('latitude', 'longitude')}
+        else:
+            properties = {'vehicle_id': v['vehicle_id'], 'route_id': v['route_id'], 'bearing': v['bearing']}
+        points.append((v['latitude'], v['longitude'], properties))
+
+    if z < VEHICLE_CLUSTER_ZOOM:
+        features = cluster_points(points, z, precision, _summarize_vehicles)
+    else:
+        features = [point_feature(lat, lng, properties, precision) for lat, lng, properties in points]
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def stop_layer(stops: List[Dict], z: int) -> Dict:
+    """Tile layer for stops already limited to the tile's bounds"""
+    precision = coordinate_precision(z)
+    points = []
+    for stop in stops:
+        if z >= DETAIL_ZOOM:
+            properties = {key: value for key, value in stop.items() if key not in ('stop_lat', 'stop_lon') and value}
+        else:
+            properties = {'stop_id': stop.get('stop_id'), 'stop_name': stop.get('stop_name')}
+        points.append((float(stop['stop_lat']), float(stop['stop_lon']), properties))
+
+    if z < STOP_CLUSTER_ZOOM:
+        features = cluster_points(points, z, precision)
+    else:
+        features = [point_feature(lat, lng, properties, precision) for lat, lng, properties in points]
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+class TileBuilder:
+    """
+    Builds vehicle and stop tiles from an RTDClient
+
+    Finished tiles are cached per (layer, tile, data version): the
+    realtime snapshot version for vehicles and the static feed version for
+    stops. A new feed version simply misses the cache and old entries age
+    out of the LRU.
+    """
+
+    def __init__(self, rtd_client, max_tiles: int = 4096):
+        """
+        Args:
+            rtd_client: RTDClient to read vehicles and stops from
+            max_tiles: Number of tile layers kept in memory
+        """
+        self.rtd_client = rtd_client
+        self.cache = LRUCache(max_tiles)
+
+    def tile(self, z: int, x: int, y: int, layers: Iterable[str] = LAYERS, snapshot=None) -> Optional[Dict]:
+        """
+        Build (or fetch from cache) an XYZ tile
+
+        Args:
+            z, x, y: Tile coordinates
+            layers: Layers to include ('vehicles', 'stops')
+            snapshot: VehiclePosition FeedSnapshot (default: fetch the current one)
+
+        Returns:
+            Dictionary with z, x, y and a FeatureCollection per layer, or
+            None if a requested layer's feed is unavailable
+        """
+        bounds = tile_bounds(z, x, y, BUFFER_PX)
+        result = {'z': z, 'x': x, 'y': y, 'layers': {}}
+
+        for layer in layers:
+            if layer == 'vehicles':
+                if snapshot is None:
+                    snapshot = self.rtd_client.get_snapshot('VehiclePosition.pb')
+                if snapshot is None:
+                    return None
+                key = ('vehicles', snapshot.version, z, x, y)
+                data = self.cache.get(key)
+                if data is None:
+                    vehicles = self.rtd_client.find_vehicles(bbox=bounds, snapshot=snapshot)
+                    if vehicles is None:
+                        return None
+                    data = vehicle_layer(vehicles, z)
+                    self.cache.set(key, data)
+            else:
+                feed = self.rtd_client.get_static_feed()
+                if feed is None:
+                    return None
+                key = ('stops', feed.version, z, x, y)
+                data = self.cache.get(key)
+                if data is None:
+                    stops = [feed.stops[i] for i in sorted(feed.stop_spatial_index.in_bbox(*bounds))]
+                    data = stop_layer(stops, z)
+                    self.cache.set(key, data)
+            result['layers'][layer] = data
+
+        return result
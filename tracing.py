@@ -0,0 +1,306 @@
+"""
+Tracing
+Lightweight spans around upstream requests, parsing, enrichment and
+serialization, linked into one trace per request
+
+The current span is kept in a context variable, so a span opened anywhere
+below a Flask handler (RTDClient, RouteDetailsClient, the JSON encoder)
+becomes a child of the request's span without passing anything around.
+Exceptions leaving a span mark it as failed, so errors that the clients
+catch and print still show up in the trace. Spans opened outside a
+request are not recorded. Finished traces go to
+pluggable exporters: an in-memory ring buffer (served at /debug/traces)
+and, with RTD_TRACE_FILE set, a JSON-lines file.
+"""
+
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from flask import Flask, g, jsonify, request
+
+TRACE_FILE_ENV = 'RTD_TRACE_FILE'
+MAX_TRACES = 500            # Traces kept by the ring buffer
+MAX_SPANS_PER_TRACE = 1000  # Later spans are counted but not recorded
+TRACEPARENT = re.compile(r'^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+_current: ContextVar[Optional['Span']] = ContextVar('rtd_span', default=None)
+
+
+class _Trace:
+    """Spans of one trace; exported when its root span ends"""
+
+    __slots__ = ('trace_id', 'spans', 'dropped')
+
+    def __init__(self, trace_id: Optional[str] = None):
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.spans: List['Span'] = []
+        self.dropped = 0
+
+
+class Span:
+    """A timed step with attributes; use as a context manager"""
+
+    __slots__ = ('trace', 'name', 'span_id', 'parent_id', 'depth', 'attributes', 'start_time',
+                 '_start', 'duration_ms', 'status', 'error', '_token')
+
+    def __init__(self, name: str, attributes: Dict[str, Any], parent: Optional['Span'] = None,
+                 trace_id: Optional[str] = None, parent_id: Optional[str] = None):
+        self.trace = parent.trace if parent is not None else _Trace(trace_id)
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent is not None else parent_id
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.attributes = attributes
+        self.duration_ms: Optional[float] = None
+        self.status = 'ok'
+        self.error: Optional[str] = None
+
+    def set(self, **attributes):
+        """Add or update attributes (e.g. bytes once the body has arrived)"""
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration_ms = round((time.perf_counter() - self._start) * 1000, 3)
+        if exc is not None:
+            self.fail(exc)
+        _current.reset(self._token)
+        trace = self.trace
+        if len(trace.spans) < MAX_SPANS_PER_TRACE or self.depth == 0:
+            trace.spans.append(self)
+        else:
+            trace.dropped += 1
+        if self.depth == 0:
+            TRACER.export(trace)
+
+    def fail(self, error):
+        """Mark the span as failed (error: an exception or a message)"""
+        self.status = 'error'
+        self.error = error if isinstance(error, str) else f'{type(error).__name__}: {error}'
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'trace_id': self.trace.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': datetime.fromtimestamp(self.start_time).isoformat(timespec='milliseconds'),
+            'duration_ms': self.duration_ms,
+            'status': self.status,
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+
+class _UntracedSpan:
+    """Stands in for a span opened outside any trace; records nothing"""
+
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def fail(self, error):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+_UNTRACED = _UntracedSpan()
+
+
+def span(name: str, **attributes) -> Span:
+    """
+    Start a span as a child of the current one
+
+    Outside a trace (background threads, response bodies streamed after the
+    request span ended) nothing is recorded, so work there never becomes a
+    root trace of its own and crowds requests out of the ring buffer. Only
+    request spans (setup_tracing()) start traces.
+
+    Example:
+        with span('upstream', feed='VehiclePosition.pb') as s:
+            response = requests.get(url)
+            s.set(bytes=len(response.content))
+    """
+    parent = _current.get()
+    if parent is None:
+        return _UNTRACED
+    return Span(name, attributes, parent)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+class RingBufferExporter:
+    """Keeps the most recent traces in memory"""
+
+    def __init__(self, max_traces: int = MAX_TRACES):
+        self._traces = deque(maxlen=max_traces)
+        self._lock = threading.Lock()
+
+    def export(self, trace: _Trace):
+        with self._lock:
+            self._traces.append(trace)
+
+    def traces(self, limit: int = 50, min_ms: float = 0, name: Optional[str] = None,
+               errors_only: bool = False) -> List[Dict[str, Any]]:
+        """
+        Recent traces, newest first
+
+        Args:
+            limit: Maximum number of traces
+            min_ms: Only traces whose root span took at least this long
+            name: Only traces whose root span name contains this (e.g. '/api/vehicles')
+            errors_only: Only traces with a failed span
+        """
+        with self._lock:
+            traces = list(self._traces)
+        found = []
+        for trace in reversed(traces):
+            root = trace.spans[-1]
+            if root.duration_ms < min_ms or (name and name not in root.name):
+                continue
+            if errors_only and all(s.status == 'ok' for s in trace.spans):
+                continue
+            found.append({
+                'trace_id': trace.trace_id,
+                'name': root.name,
+                'start': datetime.fromtimestamp(root.start_time).isoformat(timespec='milliseconds'),
+                'duration_ms': root.duration_ms,
+                'status': 'error' if any(s.status != 'ok' for s in trace.spans) else 'ok',
+                'attributes': root.attributes,
+                'dropped_spans': trace.dropped,
+                'spans': [s.to_dict() for s in sorted(trace.spans, key=lambda s: s.start_time)],
+            })
+            if len(found) >= limit:
+                break
+        return found
+
+
+class JsonLinesExporter:
+    """Appends every span to a file, one JSON object per line"""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def export(self, trace: _Trace):
+        lines = ''.join(json.dumps(s.to_dict(), default=str) + '\n' for s in trace.spans)
+        with self._lock:
+            self._file.write(lines)
+            self._file.flush()
+
+
+class Tracer:
+    """Sends finished traces to the registered exporters"""
+
+    def __init__(self):
+        self.exporters: List[Any] = []
+
+    def add_exporter(self, exporter):
+        """Register an object with an export(trace) method"""
+        self.exporters.append(exporter)
+
+    def export(self, trace: _Trace):
+        for exporter in self.exporters:
+            try:
+                exporter.export(trace)
+            except Exception as e:
+                print(f"Error exporting trace: {e}")
+
+
+TRACER = Tracer()
+
+
+def setup_tracing(app: Flask, authorize: Callable[[], bool],
+                  forbidden: str = 'Requires an API key with admin permission') -> RingBufferExporter:
+    """
+    Trace every request on an app and serve recent traces at /debug/traces
+
+    Each request is the root span of a trace (continuing a W3C traceparent
+    header when one is sent), and its id is returned in X-Trace-Id. The
+    request span ends when the handler returns, so encoding a streamed body
+    is not traced. Register before
+    setup_profiling() and setup_responses() so they run inside the request
+    span.
+
+    Args:
+        app: Flask application
+        authorize: Function telling whether the current request may read /debug/traces
+        forbidden: Message of the 403 returned when it may not
+
+    Returns:
+        The ring buffer the traces are kept in
+    """
+    buffer = RingBufferExporter()
+    TRACER.add_exporter(buffer)
+    path = os.environ.get(TRACE_FILE_ENV)
+    if path and not any(isinstance(e, JsonLinesExporter) and e.path == path for e in TRACER.exporters):
+        TRACER.add_exporter(JsonLinesExporter(path))
+
+    @app.before_request
+    def start_request_span():
+        trace_id = parent_id = None
+        match = TRACEPARENT.match(request.headers.get('traceparent', ''))
+        if match:
+            trace_id, parent_id = match.groups()
+        rule = request.url_rule.rule if request.url_rule is not None else request.path
+        root = Span(f'{request.method} {rule}', {'path': request.path, 'endpoint': request.endpoint},
+                    _current.get(), trace_id, parent_id)
+        g.trace_span = root.__enter__()
+
+    @app.after_request
+    def end_request_span(response):
+        root = g.pop('trace_span', None)
+        if root is not None:
+            root.set(status_code=response.status_code)
+            if response.status_code >= 500:
+                root.status = 'error'
+            response.headers['X-Trace-Id'] = root.trace.trace_id
+            root.__exit__(None, None, None)
+        return response
+
+    @app.teardown_request
+    def abandon_request_span(error=None):
+        # Requests that raised never reach after_request
+        root = g.pop('trace_span', None)
+        if root is not None:
+            root.set(status_code=500)
+            root.__exit__(None, error, None)
+
+    def list_traces():
+        if not authorize():
+            return jsonify({'error': 'Forbidden', 'message': forbidden}), 403
+        traces = buffer.traces(
+            limit=max(1, min(request.args.get('limit', 50, type=int), MAX_TRACES)),
+            min_ms=request.args.get('min_ms', 0, type=float),
+            name=request.args.get('name'),
+            errors_only=request.args.get('errors') == '1'
+        )
+        return jsonify({'success': True, 'count': len(traces), 'traces': traces})
+
+    app.add_url_rule('/debug/traces', 'list_traces', list_traces)
+    return buffer
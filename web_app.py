@@ -4,18 +4,64 @@ RTD Transit Web Frontend
 Beautiful, interactive web interface for RTD transit data
 """
 
+import os
+import secrets
 from flask import Flask, render_template, jsonify, request
+from datetime import datetime
 from rtd_client import RTDClient
 from google_transit_client import GoogleTransitClient
 from route_details import RouteDetailsClient
+from spatial_index import parse_bbox, parse_coordinates
+from tiles import LAYERS, TileBuilder, valid_tile, vehicles_geojson
+from http_utils import (
+    SerializedResponse, not_modified, request_etag, setup_feed_age, setup_responses, with_etag
+)
+from memory_usage import setup_memory
+from metrics import ENRICH_SECONDS, ENRICHED_VEHICLES, cache_collector, setup_metrics
+from tracing import setup_tracing, span
 from config import GOOGLE_MAPS_API_KEY, validate_google_api_key, COMMON_LOCATIONS
 
 app = Flask(__name__)
 
+# The web app has no API keys: debug endpoints are off unless a token is set
+DEBUG_TOKEN_ENV = 'RTD_DEBUG_TOKEN'
+DEBUG_FORBIDDEN = f'Set {DEBUG_TOKEN_ENV} on the server and send it in X-Debug-Token'
+
+
+def debug_authorized():
+    """Whether the request carries the RTD_DEBUG_TOKEN (always False when it is unset)"""
+    token = os.environ.get(DEBUG_TOKEN_ENV)
+    return bool(token) and secrets.compare_digest(request.headers.get('X-Debug-Token', '').encode(), token.encode())
+
+
+# Prometheus metrics at /metrics (registered first so request time includes compression)
+setup_metrics(app, [cache_collector(lambda: {
+    'geocode': google_client.geocode_stats if google_client else None,
+    'directions': google_client.directions_stats if google_client else None,
+})])
+# Request traces (X-Trace-Id, /debug/traces with the debug token, RTD_TRACE_FILE)
+trace_buffer = setup_tracing(app, debug_authorized, DEBUG_FORBIDDEN)
+# Fast JSON encoding, gzip/brotli compression and per-endpoint encode stats
+response_stats = setup_responses(app)
+# X-Feed-Age / X-Feed-Stale headers on responses built from realtime feeds
+setup_feed_age(app)
+
 # Initialize clients
 rtd_client = RTDClient()
 google_client = GoogleTransitClient(GOOGLE_MAPS_API_KEY) if validate_google_api_key() else None
 route_details_client = RouteDetailsClient()
+tile_builder = TileBuilder(rtd_client)
+# Sizes of the feeds and caches at /debug/memory (with the debug token; tracemalloc with RTD_TRACEMALLOC)
+setup_memory(app, debug_authorized, dict(
+    rtd_client.memory_caches(),
+    tiles=lambda: tile_builder.cache,
+), DEBUG_FORBIDDEN)
+
+
+def feed_etag(snapshot, *extra):
+    """ETag for a response built from a realtime snapshot"""
+    static_feed = rtd_client.current_static_feed()
+    return request_etag(snapshot.version, static_feed.version if static_feed else None, *extra)
 
 
 @app.route('/')
@@ -28,17 +74,50 @@ def index():
 
 @app.route('/api/vehicles')
 def get_vehicles():
-    """Get all active vehicles"""
-    route_filter = request.args.get('route')
+    """
+    Get all active vehicles (serialized once per feed update, ETag / 304 while unchanged)
+    
+    bbox=west,south,east,north or near=lat,lng&radius=meters limit the
+    results to an area, looked up in the per-snapshot vehicle grid.
+    """
+    route_filter = (request.args.get('route') or '').upper() or None
+    bbox = parse_bbox(request.args.get('bbox'))
+    near = parse_coordinates(request.args.get('near'))
+    radius = max(1, min(request.args.get('radius', 1000, type=int), 10000))
     
-    vehicles = rtd_client.get_vehicle_positions()
+    if (request.args.get('bbox') and bbox is None) or (request.args.get('near') and near is None):
+        return jsonify({'error': 'bbox must be west,south,east,north and near must be lat,lng'}), 400
     
+    snapshot = rtd_client.get_snapshot('VehiclePosition.pb')
+    if snapshot is not None:
+        etag = feed_etag(snapshot)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        
+        if bbox is not None or near is not None:
+            body = build_vehicles_response(snapshot, route_filter, bbox, near, radius)
+        else:
+            body = snapshot.derived(('response', 'vehicles', route_filter),
+                                    lambda: build_vehicles_response(snapshot, route_filter))
+        if body is not None:
+            return body.to_response(etag)
+    
+    return jsonify({'error': 'Failed to fetch vehicle data'}), 503
+
+
+def build_vehicles_response(snapshot, route_filter, bbox=None, near=None, radius=None):
+    """Build and serialize the /api/vehicles response for one snapshot"""
+    if bbox is not None or near is not None:
+        vehicles = rtd_client.find_vehicles(bbox, near, radius, snapshot=snapshot)
+    else:
+        vehicles = rtd_client.get_vehicle_positions(snapshot)
     if vehicles is None:
-        return jsonify({'error': 'Failed to fetch vehicle data'}), 503
+        return None
     
     # Filter by route if specified
     if route_filter:
-        vehicles = [v for v in vehicles if v['route_id'] == route_filter.upper()]
+        vehicles = [v for v in vehicles if v['route_id'] == route_filter]
     
     # Get route statistics
     route_counts = {}
@@ -46,7 +125,7 @@ def get_vehicles():
         route = v['route_id']
         route_counts[route] = route_counts.get(route, 0) + 1
     
-    return jsonify({
+    return SerializedResponse({
         'success': True,
         'count': len(vehicles),
         'vehicles': vehicles,
@@ -55,38 +134,118 @@ def get_vehicles():
     })
 
 
+@app.route('/api/vehicles.geojson')
+def get_vehicles_geojson():
+    """Get active vehicles as a GeoJSON FeatureCollection"""
+    route_filter = (request.args.get('route') or '').upper() or None
+    
+    snapshot = rtd_client.get_snapshot('VehiclePosition.pb')
+    if snapshot is not None:
+        etag = feed_etag(snapshot)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        
+        def build():
+            vehicles = rtd_client.get_vehicle_positions(snapshot)
+            if vehicles is None:
+                return None
+            if route_filter:
+                vehicles = [v for v in vehicles if v['route_id'] == route_filter]
+            return SerializedResponse(vehicles_geojson(vehicles), mimetype='application/geo+json')
+        
+        body = snapshot.derived(('response', 'vehicles.geojson', route_filter), build)
+        if body is not None:
+            return body.to_response(etag)
+    
+    return jsonify({'error': 'Failed to fetch vehicle data'}), 503
+
+
+@app.route('/tiles/<int:z>/<int:x>/<int:y>')
+def get_tile(z, x, y):
+    """XYZ map tile with vehicles and stops layers (layers=vehicles,stops)"""
+    layers = tuple(l.strip() for l in request.args.get('layers', ','.join(LAYERS)).split(',') if l.strip())
+    if not layers or any(l not in LAYERS for l in layers):
+        return jsonify({'error': f"layers must be a subset of: {', '.join(LAYERS)}"}), 400
+    if not valid_tile(z, x, y):
+        return jsonify({'error': 'Tile not found'}), 404
+    
+    snapshot = rtd_client.get_snapshot('VehiclePosition.pb') if 'vehicles' in layers else None
+    static_feed = rtd_client.get_static_feed() if 'stops' in layers else None
+    etag = request_etag(snapshot.version if snapshot else None, static_feed.version if static_feed else None)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+    
+    tile = tile_builder.tile(z, x, y, layers, snapshot=snapshot)
+    if tile is None:
+        return jsonify({'error': 'Failed to build tile'}), 503
+    
+    return with_etag(jsonify(tile), etag)
+
+
 @app.route('/api/routes')
 def get_routes():
     """Get unique route list"""
-    vehicles = rtd_client.get_vehicle_positions()
+    snapshot = rtd_client.get_snapshot('VehiclePosition.pb')
+    if snapshot is not None:
+        etag = feed_etag(snapshot)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        
+        body = snapshot.derived(('response', 'routes'), lambda: build_routes_response(snapshot))
+        if body is not None:
+            return body.to_response(etag)
     
+    return jsonify({'error': 'Failed to fetch data'}), 503
+
+
+def build_routes_response(snapshot):
+    """Build and serialize the /api/routes response for one snapshot"""
+    vehicles = rtd_client.get_vehicle_positions(snapshot)
     if vehicles is None:
-        return jsonify({'error': 'Failed to fetch data'}), 503
+        return None
     
     routes = sorted(list(set(v['route_id'] for v in vehicles)))
-    return jsonify({'routes': routes})
+    return SerializedResponse({'routes': routes})
 
 
 @app.route('/api/directions')
 def get_directions():
-    """Get transit directions"""
-    if not google_client:
-        return jsonify({
-            'error': 'Google Maps API not configured',
-            'message': 'Add your API key to config.py'
-        }), 503
-    
+    """Get transit directions (planner=local uses the offline RTD timetable)"""
     origin = request.args.get('origin')
     destination = request.args.get('destination')
+    planner = request.args.get('planner', 'google').lower()
     
     if not origin or not destination:
         return jsonify({'error': 'Both origin and destination required'}), 400
     
-    result = google_client.get_transit_directions(
-        origin=origin,
-        destination=destination,
-        alternatives=True
-    )
+    if planner == 'local':
+        geocoder = google_client.geocode if google_client else None
+        start = rtd_client.resolve_location(origin, geocoder)
+        end = rtd_client.resolve_location(destination, geocoder)
+        if not start or not end:
+            return jsonify({'error': 'Location not found'}), 404
+        
+        result = rtd_client.plan_trip(
+            (start['lat'], start['lng']),
+            (end['lat'], end['lng']),
+            origin_name=start['name'],
+            destination_name=end['name']
+        )
+    else:
+        if not google_client:
+            return jsonify({
+                'error': 'Google Maps API not configured',
+                'message': 'Add your API key to config.py, or use planner=local'
+            }), 503
+        
+        result = google_client.get_transit_directions(
+            origin=origin,
+            destination=destination,
+            alternatives=True
+        )
     
     if not result or not result.get('routes'):
         return jsonify({'error': 'No routes found'}), 404
@@ -101,21 +260,45 @@ def get_directions():
 
 @app.route('/api/nearby-stations')
 def get_nearby_stations():
-    """Find nearby transit stations"""
-    if not google_client:
-        return jsonify({'error': 'Google Maps API not configured'}), 503
-    
+    """Find nearby RTD stops (geocodes through Google only for free-text locations)"""
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
     location = request.args.get('location')
-    radius = request.args.get('radius', 1000, type=int)
+    radius = max(1, min(request.args.get('radius', 1000, type=int), 5000))
+    include_routes = request.args.get('include_routes', 'false').lower() == 'true'
     
-    if not location:
-        return jsonify({'error': 'Location required'}), 400
+    if lat is None or lng is None:
+        if not location:
+            return jsonify({'error': 'Location required'}), 400
+        
+        coords = parse_coordinates(location)
+        if coords:
+            lat, lng = coords
+        elif not google_client:
+            return jsonify({'error': 'Google Maps API not configured'}), 503
+        else:
+            geocoded = google_client.geocode(location)
+            if not geocoded:
+                return jsonify({'error': 'Location not found'}), 404
+            lat, lng = geocoded['lat'], geocoded['lng']
     
-    stations = google_client.find_nearby_transit_stations(location, radius)
+    stops = rtd_client.find_stops_near(lat, lng, radius, include_routes=include_routes)
     
-    if stations is None:
+    if stops is None:
         return jsonify({'error': 'Failed to find stations'}), 503
     
+    stations = []
+    for stop in stops:
+        station = {
+            'stop_id': stop.get('stop_id'),
+            'name': stop.get('stop_name', ''),
+            'location': {'lat': float(stop['stop_lat']), 'lng': float(stop['stop_lon'])},
+            'distance_meters': stop['distance_meters']
+        }
+        if include_routes:
+            station['routes'] = stop['routes']
+        stations.append(station)
+    
     return jsonify({
         'success': True,
         'count': len(stations),
@@ -123,6 +306,57 @@ def get_nearby_stations():
     })
 
 
+@app.route('/api/stops/search')
+def search_stops():
+    """Search stops by name (autocomplete)"""
+    query = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    
+    if not query:
+        return jsonify({'error': 'Search text required'}), 400
+    
+    stops = rtd_client.search_stops(query, limit=limit)
+    
+    if stops is None:
+        return jsonify({'error': 'Failed to load stops'}), 503
+    
+    return jsonify({
+        'success': True,
+        'count': len(stops),
+        'stops': [{
+            'stop_id': stop.get('stop_id'),
+            'stop_name': stop.get('stop_name'),
+            'stop_lat': stop.get('stop_lat'),
+            'stop_lon': stop.get('stop_lon'),
+            'score': stop['score']
+        } for stop in stops]
+    })
+
+
+@app.route('/api/reachability')
+def get_reachability():
+    """Stops reachable by transit within a time budget (for isochrone maps)"""
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    minutes = max(1, min(request.args.get('minutes', 30, type=int), 120))
+    grid = request.args.get('grid', type=int)
+    
+    if lat is None or lng is None:
+        return jsonify({'error': 'lat and lng required'}), 400
+    
+    result = rtd_client.get_reachability(lat, lng, minutes, grid_size_m=max(50, grid) if grid else None)
+    
+    if result is None:
+        return jsonify({'error': 'Timetable unavailable'}), 503
+    
+    return jsonify({
+        'success': True,
+        'minutes': minutes,
+        'count': len(result['stops']),
+        **result
+    })
+
+
 @app.route('/map')
 def map_view():
     """Live vehicle map view"""
@@ -153,25 +387,36 @@ def route_detail(route_id):
 @app.route('/api/route/<route_id>')
 def get_route_detail(route_id):
     """Get detailed route information"""
+    snapshot = rtd_client.get_snapshot('VehiclePosition.pb')
+    # The simulated schedule is relative to the current minute
+    etag = feed_etag(snapshot, datetime.now().strftime('%Y-%m-%dT%H:%M')) if snapshot is not None else None
+    if etag:
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+    
     route_info = route_details_client.get_route_info(route_id)
     
     # Add current vehicles on this route
-    vehicles = rtd_client.get_vehicle_positions()
+    vehicles = rtd_client.get_vehicle_positions(snapshot) if snapshot is not None else None
     if vehicles:
         route_vehicles = [v for v in vehicles if v['route_id'] == route_id.upper()]
         
         # Enrich each vehicle with stop information
         enriched_vehicles = []
-        for vehicle in route_vehicles:
-            try:
-                enriched_vehicle = route_details_client.enrich_vehicle_with_stop_info(
-                    vehicle, route_id
-                )
-                enriched_vehicles.append(enriched_vehicle)
-            except Exception as e:
-                # If enrichment fails, use basic vehicle info
-                print(f"Error enriching vehicle: {e}")
-                enriched_vehicles.append(vehicle)
+        with ENRICH_SECONDS.labels('route_stops').time(), span('enrich_route', route_id=route_id.upper(),
+                                                                vehicles=len(route_vehicles)):
+            for vehicle in route_vehicles:
+                try:
+                    enriched_vehicle = route_details_client.enrich_vehicle_with_stop_info(
+                        vehicle, route_id
+                    )
+                    enriched_vehicles.append(enriched_vehicle)
+                except Exception as e:
+                    # If enrichment fails, use basic vehicle info
+                    print(f"Error enriching vehicle: {e}")
+                    enriched_vehicles.append(vehicle)
+        ENRICHED_VEHICLES.labels('route_stops').inc(len(route_vehicles))
         
         route_info['current_vehicles'] = enriched_vehicles
         route_info['vehicle_count'] = len(enriched_vehicles)
@@ -179,9 +424,22 @@ def get_route_detail(route_id):
         route_info['current_vehicles'] = []
         route_info['vehicle_count'] = 0
     
+    if etag:
+        return with_etag(jsonify(route_info), etag)
     return jsonify(route_info)
 
 
+@app.route('/api/health')
+def health():
+    """Health check with per-endpoint encode time and bytes on the wire"""
+    return jsonify({
+        'status': 'healthy',
+        'google_maps_api': 'configured' if google_client else 'not configured',
+        'responses': response_stats.as_dict(),
+        'realtime_feeds': rtd_client.feed_status()
+    })
+
+
 @app.route('/api/routes/all')
 def get_all_routes():
     """Get summary of all routes"""
@@ -0,0 +1,655 @@
+"""
+Webhook Delivery
+Pushes feed events to subscriber URLs instead of waiting to be polled.
+New events are matched against each subscriber's filters, batched per
+subscriber, written to a persistent SQLite queue and sent by a bounded pool
+of workers with exponential-backoff retries.
+"""
+
+import hashlib
+import hmac
+import ipaddress
+import json
+import os
+import random
+import secrets
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+from google.transit import gtfs_realtime_pb2
+
+from cache_store import default_cache_dir
+from event_log import EVENT_TYPES
+from spatial_index import Shape
+
+MAX_BATCH_EVENTS = 100      # Events per delivery
+MAX_ATTEMPTS = 8            # Deliveries are dropped after this many failures
+BACKOFF_BASE = 2.0          # Seconds before the first retry (doubles each time)
+BACKOFF_MAX = 600.0
+DELIVERY_TIMEOUT = 10
+FEED_INTERVAL = 15          # Seconds between feed checks in the background loop
+TICK_INTERVAL = 0.5         # Seconds between queue scans
+LEASE_SECONDS = 45          # Leadership lapses if not renewed for this long
+CLAIM_SECONDS = DELIVERY_TIMEOUT * 3  # A claimed delivery is offered again after this long
+
+FILTER_KEYS = ('events', 'routes', 'stops', 'alert_effects', 'geofence', 'fences')
+
+
+def parse_filters(filters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Validate and normalize subscription filters
+
+    All filters are optional and must all match. Within a list any value
+    matches.
+
+        events: Event types to receive (default: all)
+        routes: Route IDs (matches route_id or an alert's affected_routes)
+        stops: Stop IDs (events with a stop_id, e.g. delay_exceeded)
+        alert_effects: Alert effects, by name (e.g. "DETOUR") or number
+        geofence: Shape spec (see spatial_index.Shape) the event position
+                  must fall in
+        fences: Registered geofence IDs (geofence_enter/geofence_exit events)
+
+    Returns:
+        Normalized filters (alert effects as numbers, IDs upper/stripped)
+
+    Raises:
+        ValueError: With a message for the client
+    """
+    filters = filters or {}
+    if not isinstance(filters, dict):
+        raise ValueError('filters must be an object')
+    unknown = [key for key in filters if key not in FILTER_KEYS]
+    if unknown:
+        raise ValueError(f"Unknown filters: {', '.join(unknown)}. Valid filters: {', '.join(FILTER_KEYS)}")
+
+    normalized: Dict[str, Any] = {}
+    for key in ('events', 'routes', 'stops', 'alert_effects', 'fences'):
+        values = filters.get(key)
+        if values is None:
+            continue
+        if isinstance(values, (str, int)):
+            values = [values]
+        if not isinstance(values, list) or not values:
+            raise ValueError(f'{key} must be a non-empty list')
+        normalized[key] = values
+
+    if 'events' in normalized:
+        bad = [e for e in normalized['events'] if e not in EVENT_TYPES]
+        if bad:
+            raise ValueError(f"Unknown events: {', '.join(map(str, bad))}. Valid events: {', '.join(EVENT_TYPES)}")
+    if 'routes' in normalized:
+        normalized['routes'] = [str(r).strip().upper() for r in normalized['routes']]
+    if 'stops' in normalized:
+        normalized['stops'] = [str(s).strip() for s in normalized['stops']]
+    if 'fences' in normalized:
+        normalized['fences'] = [str(f).strip() for f in normalized['fences']]
+    if 'alert_effects' in normalized:
+        effects = []
+        for effect in normalized['alert_effects']:
+            try:
+                effects.append(int(effect) if str(effect).isdigit() else gtfs_realtime_pb2.Alert.Effect.Value(str(effect).upper()))
+            except ValueError:
+                raise ValueError(f'Unknown alert effect: {effect}')
+        normalized['alert_effects'] = effects
+    if filters.get('geofence') is not None:
+        normalized['geofence'] = Shape.from_dict(filters['geofence']).to_dict()
+    return normalized
+
+
+def compile_filters(filters: Dict[str, Any]) -> Callable[[Dict[str, Any]], bool]:
+    """Turn normalized filters into a function(event) -> bool"""
+    events = set(filters['events']) if 'events' in filters else None
+    routes = set(filters['routes']) if 'routes' in filters else None
+    stops = set(filters['stops']) if 'stops' in filters else None
+    effects = set(filters['alert_effects']) if 'alert_effects' in filters else None
+    fences = set(filters['fences']) if 'fences' in filters else None
+    shape = Shape.from_dict(filters['geofence']) if 'geofence' in filters else None
+
+    def match(event):
+        if events is not None and event['type'] not in events:
+            return False
+        if routes is not None and event.get('route_id') not in routes and not routes.intersection(event.get('affected_routes', ())):
+            return False
+        if stops is not None and event.get('stop_id') not in stops:
+            return False
+        if effects is not None and event.get('effect') not in effects:
+            return False
+        if fences is not None and event.get('fence_id') not in fences:
+            return False
+        if shape is not None:
+            if event.get('latitude') is None or event.get('longitude') is None:
+                return False
+            if not shape.contains(event['latitude'], event['longitude']):
+                return False
+        return True
+
+    return match
+
+
+def check_url(url: Any, allow_private: bool = False) -> str:
+    """
+    Make sure a webhook URL points at a public host
+
+    The host is resolved and every address it has must be globally
+    routable: loopback, private (RFC 1918), link-local (including the
+    169.254.169.254 metadata address), shared and reserved ranges are
+    refused, so a webhook cannot make the server POST to its own network.
+
+    Args:
+        url: URL to check
+        allow_private: Skip the address check (local development and tests)
+
+    Returns:
+        The URL
+
+    Raises:
+        ValueError: With a message for the client
+    """
+    if not isinstance(url, str) or not url.startswith(('http://', 'https://')):
+        raise ValueError('url must be an http:// or https:// URL')
+    try:
+        parts = urlsplit(url)
+        host, port = parts.hostname, parts.port
+    except ValueError:
+        raise ValueError('url is not a valid URL')
+    if not host:
+        raise ValueError('url must include a host')
+    if allow_private:
+        return url
+    try:
+        infos = socket.getaddrinfo(host, port or (443 if parts.scheme == 'https' else 80), proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError):
+        raise ValueError(f'url host {host} could not be resolved')
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split('%')[0])
+        if getattr(address, 'ipv4_mapped', None):
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            raise ValueError(f'url host {host} resolves to a non-public address ({address})')
+    return url
+
+
+def sign(secret: str, body: bytes) -> str:
+    """X-RTD-Signature value: HMAC-SHA256 of the body with the subscriber's secret"""
+    return 'sha256=' + hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+
+class WebhookStore:
+    """
+    Subscribers and pending deliveries in SQLite
+
+    Pending deliveries survive restarts. Like DiskCache, each thread uses
+    its own connection and several processes can share the file: a
+    delivery is claimed by one process before it is sent, and a lease row
+    elects the one process that queues new events.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Args:
+            path: SQLite database file (default: webhooks.sqlite in the cache dir)
+        """
+        self.path = path or os.path.join(default_cache_dir(), 'webhooks.sqlite')
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS webhook_subscribers ("
+            "id TEXT PRIMARY KEY, owner TEXT NOT NULL, url TEXT NOT NULL, secret TEXT NOT NULL, "
+            "filters TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS webhook_queue ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, subscriber_id TEXT NOT NULL, body TEXT NOT NULL, "
+            "events INTEGER NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "next_attempt_at REAL NOT NULL, created_at REAL NOT NULL, last_error TEXT)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS webhook_queue_subscriber ON webhook_queue (subscriber_id, id)")
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(webhook_queue)")}
+        for column in ('claimed_by TEXT', 'claimed_at REAL'):
+            if column.split()[0] not in columns:
+                try:
+                    conn.execute(f"ALTER TABLE webhook_queue ADD COLUMN {column}")
+                except sqlite3.OperationalError:
+                    pass    # Added by another process meanwhile
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS webhook_lease ("
+            "name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections cannot be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def add_subscriber(self, owner: str, url: str, filters: Dict[str, Any]) -> Dict[str, Any]:
+        """Register a subscriber; returns it including its signing secret"""
+        subscriber = {
+            'id': secrets.token_urlsafe(12),
+            'owner': owner,
+            'url': url,
+            'secret': secrets.token_urlsafe(24),
+            'filters': filters,
+            'created_at': time.time(),
+        }
+        self._connect().execute(
+            "INSERT INTO webhook_subscribers (id, owner, url, secret, filters, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (subscriber['id'], owner, url, subscriber['secret'], json.dumps(filters), subscriber['created_at'])
+        )
+        return subscriber
+
+    def remove_subscriber(self, subscriber_id: str) -> bool:
+        """Delete a subscriber and its pending deliveries"""
+        conn = self._connect()
+        conn.execute("DELETE FROM webhook_queue WHERE subscriber_id = ?", (subscriber_id,))
+        return conn.execute("DELETE FROM webhook_subscribers WHERE id = ?", (subscriber_id,)).rowcount > 0
+
+    def subscribers(self, owner: Optional[str] = None) -> List[Dict[str, Any]]:
+        """All subscribers (or one owner's), oldest first"""
+        query = "SELECT id, owner, url, secret, filters, created_at FROM webhook_subscribers"
+        args: tuple = ()
+        if owner is not None:
+            query += " WHERE owner = ?"
+            args = (owner,)
+        rows = self._connect().execute(query + " ORDER BY created_at", args).fetchall()
+        return [
+            {'id': r[0], 'owner': r[1], 'url': r[2], 'secret': r[3], 'filters': json.loads(r[4]), 'created_at': r[5]}
+            for r in rows
+        ]
+
+    def enqueue(self, subscriber_id: str, body: str, events: int):
+        """Add a delivery, due immediately"""
+        now = time.time()
+        self._connect().execute(
+            "INSERT INTO webhook_queue (subscriber_id, body, events, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)",
+            (subscriber_id, body, events, now, now)
+        )
+
+    def due(self, now: float, exclude=()) -> List[Dict[str, Any]]:
+        """
+        The oldest pending delivery of each subscriber, if it is due and unclaimed
+
+        Only a subscriber's oldest delivery is ever sent, so each subscriber
+        receives its batches in order even across retries. Claims older than
+        CLAIM_SECONDS (a process that died mid-delivery) are ignored.
+        """
+        rows = self._connect().execute(
+            "SELECT q.id, q.subscriber_id, q.body, q.events, q.attempts, q.created_at, s.url, s.secret "
+            "FROM webhook_queue q "
+            "JOIN (SELECT MIN(id) AS id FROM webhook_queue GROUP BY subscriber_id) head ON q.id = head.id "
+            "JOIN webhook_subscribers s ON s.id = q.subscriber_id "
+            "WHERE q.next_attempt_at <= ? AND (q.claimed_by IS NULL OR q.claimed_at < ?) ORDER BY q.id",
+            (now, now - CLAIM_SECONDS)
+        ).fetchall()
+        return [
+            {'id': r[0], 'subscriber_id': r[1], 'body': r[2], 'events': r[3], 'attempts': r[4],
+             'created_at': r[5], 'url': r[6], 'secret': r[7]}
+            for r in rows if r[1] not in exclude
+        ]
+
+    def claim(self, delivery_id: int, holder: str, now: float) -> bool:
+        """
+        Take a delivery for sending; only one caller (in any process) succeeds
+
+        Returns:
+            Whether holder now owns the delivery
+        """
+        return self._connect().execute(
+            "UPDATE webhook_queue SET claimed_by = ?, claimed_at = ? "
+            "WHERE id = ? AND (claimed_by IS NULL OR claimed_at < ?)",
+            (holder, now, delivery_id, now - CLAIM_SECONDS)
+        ).rowcount == 1
+
+    def complete(self, delivery_id: int):
+        """Remove a delivered (or abandoned) delivery"""
+        self._connect().execute("DELETE FROM webhook_queue WHERE id = ?", (delivery_id,))
+
+    def retry(self, delivery_id: int, attempts: int, next_attempt_at: float, error: str):
+        """Record a failed attempt and when to try again (releasing the claim)"""
+        self._connect().execute(
+            "UPDATE webhook_queue SET attempts = ?, next_attempt_at = ?, last_error = ?, "
+            "claimed_by = NULL, claimed_at = NULL WHERE id = ?",
+            (attempts, next_attempt_at, error, delivery_id)
+        )
+
+    def acquire_lease(self, holder: str, now: float, seconds: float = LEASE_SECONDS, name: str = 'dispatcher') -> bool:
+        """
+        Take or renew a named lease; it stays with its holder until it lapses
+
+        Returns:
+            Whether holder has the lease
+        """
+        return self._connect().execute(
+            "INSERT INTO webhook_lease (name, holder, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+            "WHERE webhook_lease.holder = excluded.holder OR webhook_lease.expires_at < ?",
+            (name, holder, now + seconds, now)
+        ).rowcount == 1
+
+    def release_lease(self, holder: str, name: str = 'dispatcher'):
+        """Give up a lease so another process can take it at once"""
+        self._connect().execute("DELETE FROM webhook_lease WHERE name = ? AND holder = ?", (name, holder))
+
+    def depth(self) -> Dict[str, int]:
+        """Pending deliveries per subscriber"""
+        rows = self._connect().execute(
+            "SELECT subscriber_id, COUNT(*) FROM webhook_queue GROUP BY subscriber_id"
+        ).fetchall()
+        return dict(rows)
+
+
+class _SubscriberStats:
+    """Delivery counters for one subscriber"""
+
+    def __init__(self):
+        self.delivered_batches = 0
+        self.delivered_events = 0
+        self.failed_attempts = 0
+        self.dropped_batches = 0
+        self.latency_seconds = 0.0
+        self.lag_seconds = 0.0
+        self.last_error: Optional[str] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        batches = self.delivered_batches
+        return {
+            'delivered_batches': batches,
+            'delivered_events': self.delivered_events,
+            'failed_attempts': self.failed_attempts,
+            'dropped_batches': self.dropped_batches,
+            'avg_latency_ms': round(self.latency_seconds / batches * 1000, 1) if batches else None,
+            'avg_lag_ms': round(self.lag_seconds / batches * 1000, 1) if batches else None,
+            'last_error': self.last_error,
+        }
+
+
+class WebhookDispatcher:
+    """
+    Matches new events to subscribers and delivers them
+
+    Each pass reads the events added to the detector's log since the last
+    pass, groups the matching ones per subscriber into batches of up to
+    MAX_BATCH_EVENTS, and queues them on disk. Due deliveries are POSTed by
+    at most max_workers threads, one in flight per subscriber. A failed
+    delivery is retried after BACKOFF_BASE * 2^attempts seconds (with
+    jitter, capped at BACKOFF_MAX) and dropped after MAX_ATTEMPTS; a 410
+    Gone response unsubscribes the subscriber. URLs must resolve to public
+    addresses, checked when subscribing and again before each attempt, and
+    redirects are not followed.
+
+    Several processes (e.g. gunicorn workers) may each run a dispatcher on
+    the same store. Each one sends deliveries it has claimed in SQLite, and
+    only the holder of the store's lease checks the feeds and queues
+    events, so every batch is queued and sent once.
+
+    Request body:
+        {"subscription_id": "...", "events": [event, ...]}
+    Headers:
+        X-RTD-Signature: sha256=HMAC of the body with the subscriber's secret
+        X-RTD-Delivery: Delivery id (the same across retries)
+    """
+
+    def __init__(
+        self,
+        detector,
+        store: Optional[WebhookStore] = None,
+        max_workers: int = 4,
+        post: Callable[..., Any] = requests.post,
+        visible: Optional[Callable[[str, Dict[str, Any]], bool]] = None,
+        allow_private_urls: bool = False
+    ):
+        """
+        Args:
+            detector: FeedEventDetector whose log is delivered
+            store: WebhookStore (default: the one in the cache directory)
+            max_workers: Concurrent deliveries
+            post: HTTP POST function (requests.post signature)
+            visible: Optional function(owner, event) -> bool limiting which
+                     events a subscriber's owner may receive
+            allow_private_urls: Accept webhooks on loopback and private
+                                addresses (local development and tests only)
+        """
+        self.detector = detector
+        self.store = store or WebhookStore()
+        self.max_workers = max_workers
+        self.post = post
+        self.visible = visible
+        self.allow_private_urls = allow_private_urls
+        self.cursor = detector.log.last_id
+        self.instance_id = f'{os.getpid()}-{secrets.token_hex(4)}'
+        self.leader = False
+        self._lease_checked_at: Optional[float] = None
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='webhook')
+        self._in_flight: set = set()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, _SubscriberStats] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._filters: Dict[str, tuple] = {}
+
+    def subscribe(self, owner: str, url: str, filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Register a webhook
+
+        Raises:
+            ValueError: If the URL or filters are invalid
+        """
+        check_url(url, self.allow_private_urls)
+        return self.store.add_subscriber(owner, url, parse_filters(filters))
+
+    def unsubscribe(self, subscriber_id: str) -> bool:
+        """Remove a webhook and drop its pending deliveries"""
+        with self._lock:
+            self._stats.pop(subscriber_id, None)
+            self._filters.pop(subscriber_id, None)
+        return self.store.remove_subscriber(subscriber_id)
+
+    def _matcher(self, subscriber):
+        # Compiled filters are cached while the stored filters are unchanged
+        key = json.dumps(subscriber['filters'], sort_keys=True)
+        cached = self._filters.get(subscriber['id'])
+        if cached is None or cached[0] != key:
+            cached = self._filters[subscriber['id']] = (key, compile_filters(subscriber['filters']))
+        return cached[1]
+
+    def dispatch_events(self) -> int:
+        """
+        Queue the events logged since the last call for matching subscribers
+
+        Returns:
+            Number of deliveries queued
+        """
+        log = self.detector.log
+        events = log.since(self.cursor, limit=log.max_events * 2)
+        if not events:
+            return 0
+        self.cursor = events[-1]['id']
+
+        queued = 0
+        for subscriber in self.store.subscribers():
+            match = self._matcher(subscriber)
+            owner = subscriber['owner']
+            matched = [e for e in events if match(e) and (self.visible is None or self.visible(owner, e))]
+            for start in range(0, len(matched), MAX_BATCH_EVENTS):
+                batch = matched[start:start + MAX_BATCH_EVENTS]
+                body = json.dumps({'subscription_id': subscriber['id'], 'events': batch}, separators=(',', ':'))
+                self.store.enqueue(subscriber['id'], body, len(batch))
+                queued += 1
+        return queued
+
+    def deliver_due(self) -> int:
+        """
+        Start sending due deliveries on free workers
+
+        Returns:
+            Number of deliveries started
+        """
+        with self._lock:
+            free = self.max_workers - len(self._in_flight)
+            if free <= 0:
+                return 0
+            now = time.time()
+            due = [
+                delivery for delivery in self.store.due(now, exclude=set(self._in_flight))[:free]
+                if self.store.claim(delivery['id'], self.instance_id, now)
+            ]
+            for delivery in due:
+                self._in_flight.add(delivery['subscriber_id'])
+        for delivery in due:
+            self._executor.submit(self._deliver, delivery)
+        return len(due)
+
+    def _deliver(self, delivery):
+        subscriber_id = delivery['subscriber_id']
+        body = delivery['body'].encode('utf-8')
+        headers = {
+            'Content-Type': 'application/json',
+            'X-RTD-Signature': sign(delivery['secret'], body),
+            'X-RTD-Delivery': str(delivery['id']),
+        }
+        start = time.time()
+        error = None
+        gone = False
+        try:
+            # Checked again: the host's DNS may have changed since subscribing
+            check_url(delivery['url'], self.allow_private_urls)
+            response = self.post(delivery['url'], data=body, headers=headers, timeout=DELIVERY_TIMEOUT,
+                                 allow_redirects=False)
+            if response.status_code == 410:
+                gone = True
+            elif not 200 <= response.status_code < 300:
+                error = f'HTTP {response.status_code}'
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+        finished = time.time()
+
+        try:
+            if gone:
+                self.unsubscribe(subscriber_id)
+                return
+            with self._lock:
+                stats = self._stats.setdefault(subscriber_id, _SubscriberStats())
+                if error is None:
+                    stats.delivered_batches += 1
+                    stats.delivered_events += delivery['events']
+                    stats.latency_seconds += finished - start
+                    stats.lag_seconds += finished - delivery['created_at']
+                else:
+                    stats.failed_attempts += 1
+                    stats.last_error = error
+
+            attempts = delivery['attempts'] + 1
+            if error is None:
+                self.store.complete(delivery['id'])
+            elif attempts >= MAX_ATTEMPTS:
+                print(f"Dropping webhook delivery {delivery['id']} to {delivery['url']} after {attempts} attempts: {error}")
+                self.store.complete(delivery['id'])
+                with self._lock:
+                    stats.dropped_batches += 1
+            else:
+                delay = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX) * random.uniform(0.8, 1.2)
+                self.store.retry(delivery['id'], attempts, finished + delay, error)
+        finally:
+            with self._lock:
+                self._in_flight.discard(subscriber_id)
+
+    def lead(self, now: Optional[float] = None) -> bool:
+        """
+        Take or renew the store's lease (at most every LEASE_SECONDS / 3)
+
+        Returns:
+            Whether this dispatcher queues events
+        """
+        now = now or time.time()
+        if self._lease_checked_at is not None and now - self._lease_checked_at < LEASE_SECONDS / 3:
+            return self.leader
+        leader = self.store.acquire_lease(self.instance_id, now)
+        if leader and not self.leader and self._lease_checked_at is not None:
+            # Taking over: the previous leader queued what this log holds so far
+            self.cursor = self.detector.log.last_id
+        self._lease_checked_at = now
+        self.leader = leader
+        return leader
+
+    def run_once(self, update_feeds: bool = True) -> Dict[str, int]:
+        """One pass: check the feeds and queue new events (if leading), start due deliveries"""
+        queued = 0
+        if self.lead():
+            if update_feeds:
+                self.detector.update()
+            queued = self.dispatch_events()
+        return {'queued': queued, 'started': self.deliver_due()}
+
+    def start(self):
+        """Run passes in a background thread (idempotent)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='webhook-dispatcher', daemon=True)
+            self._thread.start()
+
+    def start_if_pending(self) -> bool:
+        """
+        Start the background thread if webhooks or deliveries were persisted by an earlier run
+
+        Returns:
+            Whether the dispatcher is running
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return True
+        if self.store.subscribers() or self.store.depth():
+            self.start()
+            return True
+        return False
+
+    def stop(self, wait: bool = True):
+        """Stop the background thread and the worker pool"""
+        self._stop.set()
+        if self._thread is not None and wait:
+            self._thread.join()
+        self._executor.shutdown(wait=wait)
+        if self.leader:
+            self.store.release_lease(self.instance_id)
+            self.leader = False
+
+    def _loop(self):
+        last_feed_check = 0.0
+        while not self._stop.is_set():
+            try:
+                now = time.time()
+                update_feeds = now - last_feed_check >= FEED_INTERVAL
+                if update_feeds:
+                    last_feed_check = now
+                self.run_once(update_feeds)
+            except Exception as e:
+                print(f"Webhook dispatcher error: {e}")
+            self._stop.wait(TICK_INTERVAL)
+
+    def stats(self, owner: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """Per-subscriber delivery metrics and queue depth"""
+        depth = self.store.depth()
+        result = {}
+        with self._lock:
+            for subscriber in self.store.subscribers(owner):
+                stats = self._stats.get(subscriber['id'])
+                entry = stats.as_dict() if stats else _SubscriberStats().as_dict()
+                entry['queue_depth'] = depth.get(subscriber['id'], 0)
+                entry['in_flight'] = subscriber['id'] in self._in_flight
+                result[subscriber['id']] = entry
+        return result